@@ -0,0 +1,136 @@
+import argparse
+import json
+import logging
+import platform
+import sys
+
+from ..misc import setup_logging
+from .compare import compare_results
+from .end_to_end import run_end_to_end, SCENARIOS
+from .micro import run_micro_benchmarks
+from .startup import run_startup_benchmarks, check_startup_budget
+
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark.py')
+    parser.add_argument('--output',
+        default=None,
+        help='write the results as JSON to this file')
+    parser.add_argument('--compare',
+        default=None,
+        help='compare the results against a previous JSON result and fail on regressions')
+    parser.add_argument('--threshold',
+        default=10,
+        type=float,
+        help='set the relative change in percent counted as a regression (default: 10)')
+    parser.add_argument('--scenarios',
+        default=list(SCENARIOS),
+        nargs='*',
+        choices=list(SCENARIOS),
+        help='set the end to end scenarios to run, none to skip them (default: all)')
+    parser.add_argument('--skip-micro',
+        type=bool,
+        default=False,
+        const=True,
+        nargs='?',
+        help='skip the micro benchmarks (default: False)')
+    parser.add_argument('--skip-startup',
+        type=bool,
+        default=False,
+        const=True,
+        nargs='?',
+        help='skip timing the imports of the entry points (default: False)')
+    parser.add_argument('--import-budget-ms',
+        default=300,
+        type=float,
+        help='fail when importing an entry point takes longer or loads GUI or async modules (default: 300)')
+    parser.add_argument('--senders',
+        default=4,
+        type=int,
+        help='set the number of publishers in the end to end scenarios (default: 4)')
+    parser.add_argument('--frequency-hz',
+        default=500,
+        type=int,
+        help='set the rate of every publisher in the end to end scenarios (default: 500)')
+    parser.add_argument('--duration-s',
+        default=5.0,
+        type=float,
+        help='set the duration of each end to end scenario (default: 5)')
+    parser.add_argument('--publishers',
+        default='thread',
+        choices=['thread', 'process'],
+        help='run the publishers in this process or as publisher processes, baseline only (default: thread)')
+    parser.add_argument('--consumer-args',
+        default='',
+        help='extra arguments passed to the consumer, given with an equals sign since they start with dashes, '
+             'e.g. --consumer-args="--shards 2"')
+    parser.add_argument('--seed',
+        default=0,
+        type=int,
+        help='set the seed for the generated data and impairments (default: 0)')
+    parser.add_argument(
+        '--log-level',
+        default='INFO',
+        choices=['debug', 'info', 'warning', 'error', 'critical'],
+        help='set logging level (default: info)')
+
+    args = parser.parse_args()
+
+    setup_logging(args.log_level)
+
+    results = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'startup': {},
+        'micro': {},
+        'end_to_end': {},
+    }
+    over_budget = []
+
+    if not args.skip_startup:
+        results['startup'] = run_startup_benchmarks()
+        over_budget = check_startup_budget(results['startup'], args.import_budget_ms)
+
+        for name, result in results['startup'].items():
+            logger.info(f'{name} import: {result["import_ms"]:.0f}ms '
+                        f'deferred modules loaded: {" ".join(result["deferred_loaded"]) or "none"}')
+
+    if not args.skip_micro:
+        results['micro'] = run_micro_benchmarks(args.seed)
+
+        for name, result in results['micro'].items():
+            logger.info(f'{name}: {result["ops_per_s"]:.0f} ops/s {result["ns_per_op"]:.0f} ns/op')
+
+    for scenario_name in args.scenarios:
+        result = run_end_to_end(scenario_name, args.senders, args.frequency_hz, args.duration_s, args.publishers,
+                                seed=args.seed, consumer_args=args.consumer_args.split())
+        results['end_to_end'][scenario_name] = result
+
+        logger.info(f'{scenario_name}: {result["msgs_per_s"]:.0f} msgs/s '
+                    f'publish to receive p50:{result["publish_to_receive_p50_ms"]:.2f}ms '
+                    f'p99:{result["publish_to_receive_p99_ms"]:.2f}ms '
+                    f'receive to update p50:{result["recv_to_update_p50_ms"]:.2f}ms '
+                    f'p99:{result["recv_to_update_p99_ms"]:.2f}ms '
+                    f'cpu:{result["cpu_percent"]:.0f}%')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if over_budget:
+        logger.error(f'entry points over the startup budget of {args.import_budget_ms:.0f}ms: {" ".join(over_budget)}')
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        regressions = compare_results(baseline, results, args.threshold / 100)
+
+        if regressions:
+            logger.error(f'regressions over {args.threshold}%: {" ".join(regressions)}')
+            sys.exit(1)
+
+    if over_budget:
+        sys.exit(1)
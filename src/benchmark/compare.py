@@ -0,0 +1,39 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Suffixes of the result keys where a larger value is better, everything else is a cost
+_HIGHER_IS_BETTER = ('ops_per_s', 'msgs_per_s')
+
+# Counters describing the run rather than its performance
+_IGNORED = ('ns_per_op', 'sent', 'received', 'missing', 'reordered', 'stall_flushes', 'gap_skips', 'deferred_loaded')
+
+def compare_results(baseline: dict, current: dict, threshold: float = 0.1) -> list[str]:
+    """
+    Compare two benchmark results and log the relative change of every metric present in both.
+    Returns the names of the metrics that got worse by more than the threshold
+    """
+    regressions = []
+
+    for section in ('startup', 'micro', 'end_to_end'):
+        for name, current_values in current.get(section, {}).items():
+            baseline_values = baseline.get(section, {}).get(name)
+
+            if baseline_values is None:
+                continue
+
+            for key, value in current_values.items():
+                baseline_value = baseline_values.get(key)
+
+                if key in _IGNORED or value is None or not baseline_value:
+                    continue
+
+                change = (value - baseline_value) / baseline_value
+                worse = -change if key.endswith(_HIGHER_IS_BETTER) else change
+
+                logger.info(f'{section}.{name}.{key} {baseline_value:.4g} -> {value:.4g} ({change * 100:+.1f}%)')
+
+                if worse > threshold:
+                    regressions.append(f'{section}.{name}.{key}')
+
+    return regressions
@@ -0,0 +1,283 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from socket import socket, AF_UNIX, SOCK_DGRAM
+import numpy as np
+
+from ..misc import IntervalTimer
+from ..transport import SensorMessage, IMUPayload, IMUPayload_size, pack_imu_payload, timestamp_ms
+from ..publisher.imu_simulator import IMUSimulator
+
+logger = logging.getLogger(__name__)
+
+# Impairments applied by the in-process publishers
+#   loss      - probability of dropping a message
+#   reorder   - probability of holding a message back and sending it after the next one
+#   stall     - how long a sender pauses, in multiples of the consumer timeout, 0 for no stalls
+Scenario = namedtuple('Scenario', 'loss reorder stall')
+
+SCENARIOS = {
+    'baseline': Scenario(loss=0.0, reorder=0.0, stall=0),
+    'loss': Scenario(loss=0.05, reorder=0.0, stall=0),
+    'reorder': Scenario(loss=0.0, reorder=0.1, stall=0),
+    'stall': Scenario(loss=0.0, reorder=0.0, stall=3),
+}
+
+class ScenarioPublisher:
+    """
+    Sends pre-generated IMU states of a single sender with the impairments of a scenario.
+    Timestamps are taken when sending so the consumer metrics measure the real latency
+    """
+    def __init__(self, sock: socket, socket_path: str, sender_id: int, scenario: Scenario, rng: np.random.Generator,
+                 states: list, rate_hz: int):
+        self.sock = sock
+        self.socket_path = socket_path
+        self.sender_id = sender_id
+        self.scenario = scenario
+        self.rng = rng
+        self.states = states
+
+        # Stall once a second on average
+        self.stall_probability = 1.0 / rate_hz if scenario.stall else 0.0
+
+        self.sensor_msg = SensorMessage(IMUPayload_size)
+        self.seq_num = 0
+        self.held = None
+        self.stalled_until = 0
+        self.sent = 0
+
+    def _send(self, buf: bytes):
+        try:
+            self.sock.sendto(buf, self.socket_path)
+            self.sent += 1
+        except OSError as e:
+            logger.debug(f'send failed {e}')
+
+    def step(self, now: float, stall_time: float):
+        accel, gyro, mag = self.states[self.seq_num % len(self.states)]
+        timestamp = timestamp_ms(now)
+
+        self.sensor_msg.pack(self.sender_id, self.seq_num, pack_imu_payload(IMUPayload(
+            *accel, timestamp, *gyro, timestamp, *mag, timestamp)))
+        self.seq_num = (self.seq_num + 1) & ((1 << 32) - 1)
+
+        # Stalled senders skip their samples, the consumer sees a gap followed by a restart of the stream
+        if now < self.stalled_until:
+            return
+
+        if self.rng.uniform() < self.stall_probability:
+            self.stalled_until = now + self.scenario.stall * stall_time
+            return
+
+        if self.rng.uniform() < self.scenario.loss:
+            return
+
+        buf = bytes(self.sensor_msg.get_buffer())
+
+        if self.held is not None:
+            self._send(buf)
+            self._send(self.held)
+            self.held = None
+        elif self.rng.uniform() < self.scenario.reorder:
+            self.held = buf
+        else:
+            self._send(buf)
+
+def _make_states(count: int, rate_hz: int) -> list:
+    imu_simulator = IMUSimulator(time_step=1.0 / rate_hz)
+    return [next(imu_simulator) for _ in range(count)]
+
+def _cpu_time(pid: int) -> float:
+    """
+    User and system time of a process in seconds, from /proc
+    """
+    with open(f'/proc/{pid}/stat') as f:
+        # Fields after the command name, which may contain spaces
+        fields = f.read().rsplit(')', 1)[1].split()
+
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def _cpu_times(pid: int) -> dict[int, float]:
+    """
+    CPU time of a process and of its direct children by pid, e.g. the workers of a sharded consumer
+    """
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        pids = [pid, *map(int, f.read().split())]
+
+    cpu_times = dict()
+
+    for child_pid in pids:
+        try:
+            cpu_times[child_pid] = _cpu_time(child_pid)
+        except FileNotFoundError:
+            pass
+
+    return cpu_times
+
+def _start_consumer(socket_path: str, metrics_path: str, interval: float, timeout_ms: int,
+                    consumer_args: list[str]) -> subprocess.Popen:
+    process = subprocess.Popen([
+        sys.executable, '-m', 'src.consumer',
+        '--socket-path', socket_path,
+        '--timeout-ms', str(timeout_ms),
+        '--metrics-file', metrics_path,
+        '--metrics-interval-s', str(interval),
+        '--log-level', 'error',
+        *consumer_args,
+    ])
+
+    # Wait for the consumer to bind its socket
+    deadline = time.perf_counter() + 30
+
+    while not os.path.exists(socket_path):
+        if process.poll() is not None or time.perf_counter() > deadline:
+            raise RuntimeError('consumer failed to start')
+        time.sleep(0.01)
+
+    return process
+
+def _run_thread_publishers(socket_path: str, scenario: Scenario, senders: int, rate_hz: int, duration: float,
+                           stall_time: float, seed: int) -> int:
+    np.random.seed(seed)
+    rng = np.random.default_rng(seed)
+    sock = socket(AF_UNIX, SOCK_DGRAM, 0)
+
+    publishers = [ScenarioPublisher(sock, socket_path, sender_id, scenario, rng, _make_states(256, rate_hz), rate_hz)
+                  for sender_id in range(senders)]
+
+    timer = IntervalTimer(rate_hz)
+    timer.reset()
+    end_time = time.perf_counter() + duration
+
+    while (now := time.perf_counter()) < end_time:
+        for publisher in publishers:
+            publisher.step(now, stall_time)
+
+        timer.wait()
+
+    timer.close()
+    sock.close()
+
+    return sum(publisher.sent for publisher in publishers)
+
+def _start_process_publishers(socket_path: str, senders: int, rate_hz: int) -> list[subprocess.Popen]:
+    # Sends fail until the consumer is up, keep those errors out of the benchmark output
+    return [subprocess.Popen([
+        sys.executable, '-m', 'src.publisher',
+        '--socket-path', socket_path,
+        '--sender-id', str(sender_id),
+        '--frequency-hz', str(rate_hz),
+        '--log-level', 'critical',
+    ], stderr=subprocess.DEVNULL) for sender_id in range(senders)]
+
+def _stop_processes(processes: list[subprocess.Popen]):
+    for process in processes:
+        process.terminate()
+
+    for process in processes:
+        process.wait()
+
+def _read_metrics(path: str, deadline: float) -> dict:
+    while not os.path.exists(path) and time.perf_counter() < deadline:
+        time.sleep(0.05)
+
+    if not os.path.exists(path):
+        raise RuntimeError(f'consumer did not report metrics to {path}')
+
+    with open(path) as f:
+        return json.load(f)
+
+def _merge_shard_metrics(shard_metrics: list[dict]) -> tuple[dict, dict]:
+    """
+    Sum the stats of the shard workers. Percentiles can't be combined from the summaries, the worst shard is taken
+    """
+    stats = dict()
+    histograms = dict()
+
+    for metrics in shard_metrics:
+        for name, value in metrics['stats'].items():
+            stats[name] = stats.get(name, 0) + value
+
+        for name, summary in metrics['histograms'].items():
+            merged = histograms.setdefault(name, {'count': 0, 'p50': 0, 'p99': 0, 'max': 0})
+            merged['count'] += summary['count']
+            merged.update({key: max(merged[key], summary[key]) for key in ('p50', 'p99', 'max')})
+
+    return stats, histograms
+
+def run_end_to_end(scenario_name: str, senders: int = 4, rate_hz: int = 500, duration: float = 5.0,
+                   publishers: str = 'thread', timeout_ms: int = 100, seed: int = 0,
+                   consumer_args: list[str] | None = None, process_warmup: float = 3.0) -> dict:
+    """
+    Run a consumer subprocess against N publishers for the duration and collect its metrics.
+    Publishers either run in this process, applying the impairments of the scenario, or as publisher
+    subprocesses, which only support the baseline scenario. The metrics of a sharded consumer are summed over its
+    workers
+    """
+    scenario = SCENARIOS[scenario_name]
+    publisher_processes = []
+
+    if publishers == 'process' and scenario != SCENARIOS['baseline']:
+        raise ValueError(f'scenario {scenario_name} needs in-process publishers')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, 'consumer.sock')
+        metrics_path = os.path.join(tmp_dir, 'metrics.json')
+
+        # Publisher processes are started first so their startup doesn't fall into the measured window
+        if publishers == 'process':
+            publisher_processes = _start_process_publishers(socket_path, senders, rate_hz)
+            time.sleep(process_warmup)
+
+        # The consumer reports once, covering the whole run
+        consumer = _start_consumer(socket_path, metrics_path, duration, timeout_ms, consumer_args or [])
+
+        try:
+            start_cpu_times = _cpu_times(consumer.pid)
+            start_time = time.perf_counter()
+
+            # Keep sending a bit longer so the report is due while the consumer is still busy
+            if publishers == 'thread':
+                sent = _run_thread_publishers(socket_path, scenario, senders, rate_hz, duration + 0.5,
+                                              timeout_ms / 1e3, seed)
+            else:
+                time.sleep(duration + 0.5)
+                sent = None
+
+            # Children started later, like the workers of a sharded consumer, count from their start
+            cpu_time = sum(cpu_time - start_cpu_times.get(pid, 0.0)
+                           for pid, cpu_time in _cpu_times(consumer.pid).items())
+            cpu_percent = cpu_time / (time.perf_counter() - start_time) * 100
+
+            # Give the consumer a moment to flush and write the report
+            deadline = time.perf_counter() + 2 * timeout_ms / 1e3 + 1
+            metrics = _read_metrics(metrics_path, deadline)
+
+            # A sharded consumer only routes, its workers report the senders to files suffixed by the shard
+            shard_metrics = [_read_metrics(f'{metrics_path}.shard{i}', deadline)
+                             for i in range(metrics['stats'].get('shards', 0))]
+        finally:
+            _stop_processes([consumer, *publisher_processes])
+
+    stats, histograms = _merge_shard_metrics(shard_metrics) if shard_metrics else (metrics['stats'],
+                                                                                    metrics['histograms'])
+
+    return {
+        'msgs_per_s': stats['received'] / metrics['interval'],
+        'sent': sent,
+        'received': stats['received'],
+        'missing': stats['missing'],
+        'reordered': stats['reordered'],
+        'stall_flushes': stats['stall_flushes'],
+        'gap_skips': stats['gap_skips'],
+        'publish_to_receive_p50_ms': histograms.get('publish_to_receive', {}).get('p50', 0) * 1e3,
+        'publish_to_receive_p99_ms': histograms.get('publish_to_receive', {}).get('p99', 0) * 1e3,
+        'recv_to_update_p50_ms': histograms.get('recv_to_update', {}).get('p50', 0) * 1e3,
+        'recv_to_update_p99_ms': histograms.get('recv_to_update', {}).get('p99', 0) * 1e3,
+        'cpu_percent': cpu_percent,
+    }
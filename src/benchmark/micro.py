@@ -0,0 +1,202 @@
+import time
+import numpy as np
+
+from ..transport import SensorMessage, IMUPayload, IMUPayload_size, pack_imu_payload, pack_imu_payload_into
+from ..transport import unpack_imu_payload
+from ..transport import decode_imu_messages, CompactMessage, pack_compact_payload, decode_compact_messages
+from ..consumer.message_queue import MessageQueue
+from ..consumer.remote_sensor import RemoteSensor
+from ..consumer.orientation_history import OrientationHistory
+from ..publisher.imu_simulator import IMUSimulator
+
+def _measure(fn, number: int, repeat: int = 5) -> dict:
+    """
+    Time number calls of fn, repeat times, and keep the fastest run, which is the least disturbed by the system.
+    Each call performs ops operations, fn returns ops
+    """
+    best = float('inf')
+    ops = 0
+
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+
+        for _ in range(number):
+            ops = fn()
+
+        best = min(best, time.perf_counter() - start_time)
+
+    total_ops = ops * number
+
+    return {
+        'ops_per_s': total_ops / best,
+        'ns_per_op': best / total_ops * 1e9,
+    }
+
+def _make_payloads(count: int, seed: int) -> list[IMUPayload]:
+    np.random.seed(seed)
+    imu_simulator = IMUSimulator(time_step=0.002)
+    payloads = []
+
+    for i in range(count):
+        accel, gyro, mag = next(imu_simulator)
+        payloads.append(IMUPayload(*accel, 2 * i, *gyro, 2 * i, *mag, 2 * i))
+
+    return payloads
+
+def _make_reordered_seq_nums(count: int, depth: int, rng: np.random.Generator) -> list[int]:
+    """
+    Sequence numbers where every message is displaced by less than depth positions
+    """
+    keys = np.arange(count) + rng.uniform(0, depth, count)
+    return np.argsort(keys).tolist()
+
+def run_micro_benchmarks(seed: int = 0, repeat: int = 5) -> dict:
+    rng = np.random.default_rng(seed)
+    payloads = _make_payloads(1024, seed)
+    packed_payloads = [pack_imu_payload(payload) for payload in payloads]
+
+    sensor_msg = SensorMessage(IMUPayload_size)
+    sensor_msg.pack(1, 1, packed_payloads[0])
+
+    # Receive buffer of 64 back to back messages, as drained by the consumer in one wakeup
+    msgs = bytearray()
+    for i, packed_payload in enumerate(packed_payloads[:64]):
+        sensor_msg.pack(1, i, packed_payload)
+        msgs += sensor_msg.get_buffer()
+
+    imu_states = decode_imu_messages(msgs).payload.copy()
+
+    # The same 64 messages in the compact format
+    compact_msg = CompactMessage()
+    compact_msgs = bytearray()
+    for i, imu_state in enumerate(imu_states):
+        compact_msg.pack(1, i, pack_compact_payload(imu_state['acc'], imu_state['gyro'], imu_state['mag']), 2 * i)
+        compact_msgs += compact_msg.get_buffer()
+    results = dict()
+
+    def pack_payload():
+        for payload in payloads:
+            pack_imu_payload(payload)
+        return len(payloads)
+
+    def unpack_payload():
+        for packed_payload in packed_payloads:
+            unpack_imu_payload(packed_payload)
+        return len(packed_payloads)
+
+    samples = [(payload[0:3], payload[4:7], payload[8:11]) for payload in payloads]
+
+    def pack_payload_into():
+        body = sensor_msg.get_body()
+
+        for accel, gyro, mag in samples:
+            pack_imu_payload_into(body, 0, accel, gyro, mag, 0)
+        return len(samples)
+
+    imu_simulator = IMUSimulator(time_step=0.001)
+
+    def simulate():
+        for _ in range(256):
+            next(imu_simulator)
+        return 256
+
+    def pack_message():
+        for i, packed_payload in enumerate(packed_payloads):
+            sensor_msg.pack(1, i, packed_payload)
+        return len(packed_payloads)
+
+    def unpack_message():
+        for _ in range(1024):
+            sensor_msg.unpack()
+        return 1024
+
+    def unpack_message_view():
+        for _ in range(1024):
+            sensor_msg.unpack_view()
+        return 1024
+
+    def decode_messages():
+        decode_imu_messages(msgs)
+        return 64
+
+    def pack_compact():
+        for imu_state in imu_states:
+            pack_compact_payload(imu_state['acc'], imu_state['gyro'], imu_state['mag'])
+        return len(imu_states)
+
+    def decode_compact():
+        decode_compact_messages(compact_msgs)
+        return 64
+
+    results['pack_imu_payload'] = _measure(pack_payload, 20, repeat)
+    results['pack_imu_payload_into'] = _measure(pack_payload_into, 20, repeat)
+    results['unpack_imu_payload'] = _measure(unpack_payload, 20, repeat)
+    results['imu_simulator_next'] = _measure(simulate, 5, repeat)
+    results['sensor_message_pack'] = _measure(pack_message, 20, repeat)
+    results['sensor_message_unpack'] = _measure(unpack_message, 20, repeat)
+    results['sensor_message_unpack_view'] = _measure(unpack_message_view, 20, repeat)
+    results['decode_imu_messages_64'] = _measure(decode_messages, 2000, repeat)
+    results['pack_compact_payload'] = _measure(pack_compact, 20, repeat)
+    results['decode_compact_messages_64'] = _measure(decode_compact, 2000, repeat)
+
+    in_order = list(range(4096))
+    reordered = _make_reordered_seq_nums(4096, 8, rng)
+    lossy = [seq_num for seq_num in in_order if rng.uniform() >= 0.05]
+
+    def queue_messages(seq_nums: list[int], force_order: bool):
+        def fn():
+            message_queue = MessageQueue()
+
+            for seq_num in seq_nums:
+                message_queue.put_message(seq_num, seq_num)
+
+                while message_queue.pop_message(force_order) is not None:
+                    pass
+
+            return len(seq_nums)
+        return fn
+
+    results['message_queue_in_order'] = _measure(queue_messages(in_order, True), 5, repeat)
+    results['message_queue_reordered'] = _measure(queue_messages(reordered, True), 5, repeat)
+    results['message_queue_lossy_flush'] = _measure(queue_messages(lossy, False), 5, repeat)
+
+    def update_single():
+        remote_sensor = RemoteSensor(1, 0.1)
+
+        for imu_state in imu_states:
+            remote_sensor._update(imu_state)
+        return len(imu_states)
+
+    def update_batch():
+        remote_sensor = RemoteSensor(1, 0.1)
+        remote_sensor.update_batch(imu_states)
+        return len(imu_states)
+
+    results['remote_sensor_update'] = _measure(update_single, 5, repeat)
+    results['remote_sensor_update_batch_64'] = _measure(update_batch, 50, repeat)
+
+    # History of 256 senders with 10s at 500Hz, filled past its capacity so the rings have wrapped
+    history = OrientationHistory(5000, 256)
+    orientations = RemoteSensor(1, 0.1).update_batch(imu_states)
+    timestamps = np.arange(len(orientations)) * 2
+
+    for sender_id in range(256):
+        for offset in range(0, 6000 * 2, len(orientations) * 2):
+            history.append(sender_id, timestamps + offset, orientations)
+
+    def history_append():
+        history.append(0, timestamps + history.last_timestamps[0] + 2, orientations)
+        return len(orientations)
+
+    # Queries for every sender at times spread over the history, as for aligning with a camera frame
+    query_senders = rng.integers(0, 256, 1024)
+    query_times = rng.uniform(2000, 12000, 1024)
+
+    def history_lookup():
+        history.lookup(query_senders, query_times + history.last_timestamps[query_senders] - 12000)
+        return len(query_senders)
+
+    results['orientation_history_append_64'] = _measure(history_append, 200, repeat)
+    results['orientation_history_lookup_1024'] = _measure(history_lookup, 20, repeat)
+
+    return results
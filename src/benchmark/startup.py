@@ -0,0 +1,59 @@
+import json
+import subprocess
+import sys
+
+# Entry points timed by the startup benchmark, both run headless by default
+STARTUP_MODULES = {
+    'consumer': 'src.consumer.consumer',
+    'publisher': 'src.publisher.publisher',
+}
+
+# Modules only needed with --visualize or --async, a headless entry point must not load them
+DEFERRED_MODULES = ('pyqtgraph', 'PyQt5', 'PyQt6', 'PySide2', 'PySide6', 'asyncio', 'scipy.interpolate')
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+start_time = time.perf_counter()
+import {module}
+print(json.dumps([time.perf_counter() - start_time, sorted(sys.modules)]))
+"""
+
+def _measure_import(module: str) -> tuple[float, list[str]]:
+    """
+    Import the module in a fresh interpreter, returns the import time without the interpreter startup
+    and the names of all modules loaded
+    """
+    output = subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT.format(module=module)],
+                            check=True, capture_output=True, text=True).stdout
+
+    import_time, modules = json.loads(output)
+    return import_time, modules
+
+def run_startup_benchmarks(repeat: int = 5) -> dict:
+    """
+    Time importing every entry point and list the deferred modules it loads anyway.
+    The fastest of repeat runs is kept, the first ones also pay for a cold file cache
+    """
+    results = dict()
+
+    for name, module in STARTUP_MODULES.items():
+        best = float('inf')
+        modules = []
+
+        for _ in range(repeat):
+            import_time, modules = _measure_import(module)
+            best = min(best, import_time)
+
+        results[name] = {
+            'import_ms': best * 1e3,
+            'deferred_loaded': [deferred for deferred in DEFERRED_MODULES if deferred in modules],
+        }
+
+    return results
+
+def check_startup_budget(results: dict, budget_ms: float) -> list[str]:
+    """
+    Returns the entry points importing slower than the budget or loading deferred modules
+    """
+    return [name for name, result in results.items()
+            if result['import_ms'] > budget_ms or result['deferred_loaded']]
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import time
+
+from ..misc import Metrics
+from ..transport import OrientationTable, CaptureWriter, BatchMessage_max_count
+from .consumer import Consumer
+from .orientation_history import OrientationHistory
+from .remote_sensor import RemoteSensor
+
+logger = logging.getLogger(__name__)
+
+class AsyncConsumer(Consumer):
+    """
+    Consumer running on an asyncio event loop.
+    The socket is drained from a reader callback which only queues the messages. Each sender has its own task
+    updating its remote sensor when messages arrive or when its stall timer expires, so updates can't hold up
+    receiving
+    """
+    def __init__(self, socket_path: str, timeout_s: float, visualize: bool = False, recv_batch: int = 64,
+                 orientation_table: OrientationTable | None = None, max_batch: int = BatchMessage_max_count,
+                 metrics: Metrics | None = None, capture: CaptureWriter | None = None,
+                 frame_time: float = 1.0 / 60, history: OrientationHistory | None = None):
+        super().__init__(socket_path, timeout_s, visualize, recv_batch, orientation_table, max_batch, metrics,
+                         capture, history=history)
+        self.frame_time = frame_time
+
+        self.task_group = None
+        self.sensor_events = dict()
+
+    def _on_readable(self):
+        count = self._drain_sock()
+        start_time = time.perf_counter() if self.metrics is not None else 0.0
+
+        # Wake up the tasks of the senders that received messages
+        for sender_id in self._put_messages(count):
+            self.sensor_events[sender_id].set()
+
+        # Updates run in the sender tasks, so this only times receiving and queueing
+        if self.metrics is not None:
+            self.metrics.histogram('loop').record(time.perf_counter() - start_time)
+
+        if self.log_summary and time.perf_counter() - self.last_summary_time >= self.summary_interval:
+            self._log_sender_summary(time.perf_counter())
+
+    def _add_remote_sensor(self, sender_id: int):
+        super()._add_remote_sensor(sender_id)
+
+        event = asyncio.Event()
+        self.sensor_events[sender_id] = event
+        self.task_group.create_task(self._run_remote_sensor(self.remote_sensors[sender_id], event))
+
+    async def _run_remote_sensor(self, remote_sensor: RemoteSensor, event: asyncio.Event):
+        while True:
+            # Sleep until new messages arrive or the buffered ones are due to be flushed
+            deadline = remote_sensor.get_stall_deadline()
+            loop_deadline = None
+
+            if deadline is not None:
+                loop_deadline = asyncio.get_running_loop().time() + max(0, deadline - time.perf_counter())
+
+            try:
+                async with asyncio.timeout_at(loop_deadline):
+                    await event.wait()
+            except TimeoutError:
+                logger.debug(f'stall timer expired for remote sensor {remote_sensor.id}')
+
+            # Skips the gaps whose wait is over
+            event.clear()
+            self._update_remote_sensor(remote_sensor)
+
+    async def _run_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics.interval)
+            self._report_metrics(time.perf_counter())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.sock, self._on_readable)
+        self._start_viewer()
+
+        try:
+            async with asyncio.TaskGroup() as self.task_group:
+                if self.metrics is not None:
+                    self.task_group.create_task(self._run_metrics())
+
+                # Run until cancelled or until one of the tasks fails
+                await loop.create_future()
+        finally:
+            loop.remove_reader(self.sock)
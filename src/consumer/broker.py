@@ -0,0 +1,231 @@
+import logging
+import time
+from collections import deque
+from socket import socket, AF_UNIX, SOCK_DGRAM
+from os import access, unlink, F_OK
+
+from ..misc.quaternion_loader import quat
+from ..transport import SUBSCRIBE_RAW, UNSUBSCRIBE, Subscription, decode_subscription, pack_orientation_message
+
+logger = logging.getLogger(__name__)
+
+class Subscriber:
+    """
+    State of one subscriber, identified by the address of its socket.
+    Deliveries wait in a bounded queue, when it's full the oldest one is dropped
+    """
+    def __init__(self, address: str, subscription: Subscription, queue_size: int, now: float):
+        self.address = address
+        self.subscription = subscription
+        self.queue = deque(maxlen=queue_size)
+        self.last_seen = now
+
+        # Number of frames or orientations seen per sender, for decimation
+        self.counts = dict()
+
+        self.sent = 0
+        self.dropped = 0
+
+    def accepts(self, sender_id: int) -> bool:
+        sender_ids = self.subscription.sender_ids
+
+        if sender_ids is not None and sender_id not in sender_ids:
+            return False
+
+        count = self.counts.get(sender_id, 0)
+        self.counts[sender_id] = count + 1
+
+        return count % self.subscription.decimation == 0
+
+    def put(self, item: bytes):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+
+        self.queue.append(item)
+
+class Broker:
+    """
+    Fans the received frames and the fused orientations out to subscribers registered on a separate UNIX socket.
+    Subscribers send a subscription from their own bound socket and repeat it to stay subscribed, they are
+    dropped after expiry_s without one or when their socket is gone.
+    Delivering never blocks: the socket is non-blocking and whatever a subscriber can't take yet stays in its
+    queue, so a slow subscriber only loses its own oldest deliveries
+    """
+    def __init__(self, socket_path: str, queue_size: int = 256, expiry_s: float = 5.0,
+                 accept_interval: float = 0.1, max_records: int = 64):
+        self.socket_path = socket_path
+        self.queue_size = queue_size
+        self.expiry_s = expiry_s
+        self.accept_interval = accept_interval
+        self.max_records = max_records
+
+        self.sock = self._open_broker_sock()
+        self.sock.setblocking(False)
+
+        self.subscribers = dict()
+        self.raw_subscribers = []
+        self.orientation_subscribers = []
+        self.last_accept_time = time.perf_counter()
+
+        # Deliveries of the subscribers that are gone
+        self.sent = 0
+        self.dropped = 0
+
+    def _open_broker_sock(self) -> socket:
+        sock = socket(AF_UNIX, SOCK_DGRAM, 0)
+
+        # Remove if socket already exists
+        if access(self.socket_path, F_OK):
+            unlink(self.socket_path)
+            logger.debug('removed existing broker socket')
+
+        sock.bind(self.socket_path)
+        logger.info(f'broker socket bound at {self.socket_path}')
+
+        return sock
+
+    def _update_lists(self):
+        self.raw_subscribers = [subscriber for subscriber in self.subscribers.values()
+                                if subscriber.subscription.mode == SUBSCRIBE_RAW]
+        self.orientation_subscribers = [subscriber for subscriber in self.subscribers.values()
+                                        if subscriber.subscription.mode != SUBSCRIBE_RAW]
+
+    def _remove_subscriber(self, address: str, reason: str):
+        subscriber = self.subscribers.pop(address)
+        self.sent += subscriber.sent
+        self.dropped += subscriber.dropped + len(subscriber.queue)
+        self._update_lists()
+
+        logger.info(f'removed subscriber {address} ({reason}) sent:{subscriber.sent} dropped:{subscriber.dropped}')
+
+    def _accept_subscriptions(self, now: float):
+        changed = False
+
+        while True:
+            try:
+                msg, address = self.sock.recvfrom(256)
+            except BlockingIOError:
+                break
+            except Exception as e:
+                logger.error(f'recv threw an exception {e}')
+                break
+
+            # Replies need an address, the subscriber must bind its socket
+            if not address:
+                logger.warning(f'ignoring subscription from an unbound socket {msg}')
+                continue
+
+            if msg == UNSUBSCRIBE:
+                if address in self.subscribers:
+                    self._remove_subscriber(address, 'unsubscribed')
+                continue
+
+            try:
+                subscription = decode_subscription(msg)
+            except ValueError:
+                logger.warning(f'ignoring malformed subscription {msg}')
+                continue
+
+            subscriber = self.subscribers.get(address)
+
+            # Subscriptions are repeated periodically, a changed one starts over
+            if subscriber is not None and subscriber.subscription == subscription:
+                subscriber.last_seen = now
+                continue
+
+            self.subscribers[address] = Subscriber(address, subscription, self.queue_size, now)
+            changed = True
+
+            logger.info(f'subscribed {address} mode:{subscription.mode} decimation:{subscription.decimation} '
+                        f'senders:{sorted(subscription.sender_ids) if subscription.sender_ids else "all"}')
+
+        if changed:
+            self._update_lists()
+
+    def poll(self, now: float):
+        """
+        Accept new subscriptions and expire the stale ones, at most every accept_interval
+        """
+        if now - self.last_accept_time < self.accept_interval:
+            return
+
+        self.last_accept_time = now
+        self._accept_subscriptions(now)
+
+        for address in [address for address, subscriber in self.subscribers.items()
+                        if now - subscriber.last_seen > self.expiry_s]:
+            self._remove_subscriber(address, 'expired')
+
+    def publish_frames(self, buffer, frame_sizes: list[int]):
+        """
+        Queue the frames stored back to back in buffer for the raw subscribers
+        """
+        offset = 0
+
+        for size in frame_sizes:
+            # First byte of every frame header is the sender id, the frame is copied once for all subscribers
+            sender_id = buffer[offset]
+            frame = None
+
+            for subscriber in self.raw_subscribers:
+                if subscriber.accepts(sender_id):
+                    frame = frame or bytes(buffer[offset:offset + size])
+                    subscriber.put(frame)
+
+            offset += size
+
+    def publish_orientation(self, sender_id: int, orientation, seq_num: int, timestamp: int):
+        record = None
+
+        for subscriber in self.orientation_subscribers:
+            if subscriber.accepts(sender_id):
+                record = record or pack_orientation_message(sender_id, seq_num, timestamp,
+                                                            quat.as_float_array(orientation).tolist())
+                subscriber.put(record)
+
+    def _send(self, subscriber: Subscriber) -> bool:
+        """
+        Send the queued deliveries until the subscriber's socket is full, returns False if the subscriber is gone
+        """
+        queue = subscriber.queue
+        raw = subscriber.subscription.mode == SUBSCRIBE_RAW
+
+        while queue:
+            # Frames go one per datagram, orientation records are sent back to back
+            count = 1 if raw else min(len(queue), self.max_records)
+            data = queue[0] if count == 1 else b''.join([queue[i] for i in range(count)])
+
+            try:
+                self.sock.sendto(data, subscriber.address)
+            except BlockingIOError:
+                break
+            except (ConnectionRefusedError, FileNotFoundError):
+                return False
+            except Exception as e:
+                logger.error(f'send threw an exception {e}')
+                return False
+
+            for _ in range(count):
+                queue.popleft()
+
+            subscriber.sent += count
+
+        return True
+
+    def flush(self):
+        for subscriber in list(self.subscribers.values()):
+            if subscriber.queue and not self._send(subscriber):
+                self._remove_subscriber(subscriber.address, 'gone')
+
+    def get_stats(self) -> dict:
+        return {
+            'subscribers': len(self.subscribers),
+            'subscriber_sent': self.sent + sum(subscriber.sent for subscriber in self.subscribers.values()),
+            'subscriber_dropped': self.dropped + sum(subscriber.dropped for subscriber in self.subscribers.values()),
+        }
+
+    def close(self):
+        self.sock.close()
+
+        if access(self.socket_path, F_OK):
+            unlink(self.socket_path)
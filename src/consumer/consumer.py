@@ -1,27 +1,86 @@
 import argparse
+import heapq
 import logging
+import time
+import numpy as np
 from socket import socket, AF_UNIX, SOCK_DGRAM
+from select import poll, POLLIN
 from os import access, unlink, F_OK
 
-from ..misc import setup_logging
-from ..transport import SensorMessage, IMUPayload_size, unpack_imu_payload
+from ..misc import setup_logging, Metrics
+from ..transport import SensorMessage, IMUPayload_size, OrientationTable, BatchMessage_header_size
+from ..transport import BatchMessage_max_count
+from ..transport import IMUBatch, decode_imu_messages, decode_frame, batch_message_size, CaptureWriter
+from ..transport import CompactMessage_dtype, compact_message_size, decode_compact_messages
+from ..transport import ReceiveBuffer, ReceiveBufferPool
 from .remote_sensor import RemoteSensor
-from ..visualization import OrientationPreview
+from .orientation_filter import warm_up
+from .broker import Broker
+from .orientation_history import OrientationHistory
 
 logger = logging.getLogger(__name__)
 
 
 class Consumer:
-    def __init__(self, socket_path: str, timeout_s: float, visualize: bool = False):
+    def __init__(self, socket_path: str, timeout_s: float, visualize: bool = False, recv_batch: int = 64,
+                 orientation_table: OrientationTable | None = None, max_batch: int = BatchMessage_max_count,
+                 metrics: Metrics | None = None, capture: CaptureWriter | None = None, broker: Broker | None = None,
+                 history: OrientationHistory | None = None):
         self.socket_path = socket_path
         self.timeout_s = timeout_s
         self.visualize = visualize
+        self.recv_batch = recv_batch
+        self.max_batch = max_batch
 
+        # The viewer draws from the orientation table in its own process, a private table is created if none is given
+        self.owns_table = visualize and orientation_table is None
+        self.orientation_table = OrientationTable.create() if self.owns_table else orientation_table
+        self.frame_time = 1.0 / 60
+        self.viewer = None
+
+        # Metrics are only collected when enabled
+        self.metrics = metrics
+
+        # Per message records are only logged at debug level, at info a summary per sender is logged every interval
+        self.log_debug = logger.isEnabledFor(logging.DEBUG)
+        self.log_summary = logger.isEnabledFor(logging.INFO)
+        self.summary_interval = 5.0
+        self.last_summary_time = time.perf_counter()
+        self.summary_counts = dict()
+
+        # Received messages are also recorded to a capture file when set
+        self.capture = capture
+
+        # Frames and fused orientations are also fanned out to subscribers when set
+        self.broker = broker
+
+        # Orientations of all senders are kept for lookups by time when set
+        self.history = history
+
+        # Otherwise the first update would stall the wakeup while the socket queue overflows
+        warm_up()
+
+        # The socket stays non-blocking, waiting for data is done with poll
         self.sock = self._open_consumer_sock()
-        self.sock.settimeout(self.timeout_s)
+        self.sock.setblocking(False)
+        self.poller = poll()
+        self.poller.register(self.sock, POLLIN)
+
+        # Ring shared by all datagrams of a single wakeup, they are stored back to back with their sizes kept aside.
+        # Every wakeup receives into a ring from the pool, the queued messages are views into it until processed
+        self.msg_size = len(SensorMessage(IMUPayload_size).get_buffer())
+        self.max_frame_size = max(self.msg_size, BatchMessage_header_size + IMUPayload_size * self.max_batch)
+        self.recv_pool = ReceiveBufferPool(self.max_frame_size * self.recv_batch)
+        self._next_ring()
+        self.frame_sizes = []
 
         self.remote_sensors = dict()
-        self.orientation_previews = dict()
+
+        # Sensors holding messages behind a gap, as a heap of (stall deadline, sender id), and the deadline each
+        # sensor is scheduled at. The deadline moves earlier as the gap wait shrinks, a new entry is pushed then and
+        # the one it replaces is skipped when it expires. Entries are checked against the current deadline as well
+        self.stall_timers = []
+        self.stall_scheduled = dict()
 
     def _open_consumer_sock(self) -> socket:
         sock = socket(AF_UNIX, SOCK_DGRAM, 0)
@@ -37,52 +96,318 @@ class Consumer:
 
         return sock
 
-    def run(self):
-        sensor_msg = SensorMessage(IMUPayload_size)
-        buf = sensor_msg.get_buffer()
+    def _next_ring(self):
+        """
+        Switch to a ring none of the queued messages refer to, usually the same one as before
+        """
+        # Queued messages hold the buffer they were received into, the pool only hands out ones nothing holds
+        self.recv_buffer = self.recv_pool.acquire()
+        self.ring = self.recv_buffer.buf
+        self.ring_view = self.recv_buffer.view
 
-        while True:
-            recv_size = 0
+    def _recv_batch(self) -> int:
+        """
+        Wait for the first datagram, then drain the pending ones without blocking.
+        Returns the number of frames received
+        """
+        if not self.poller.poll(self._get_poll_timeout() * 1e3):
+            logger.debug('recv timeout')
+            self.frame_sizes = []
+            return 0
+
+        return self._drain_sock()
+
+    def _get_poll_timeout(self) -> float:
+        """
+        Time to wait for messages, at most until the earliest stall deadline
+        """
+        if not self.stall_timers:
+            return self.timeout_s
+
+        return min(max(self.stall_timers[0][0] - time.perf_counter(), 0), self.timeout_s)
 
+    def _is_valid_frame(self, offset: int, size: int) -> bool:
+        """
+        Frames are either single sensor messages, compact messages or batch frames matching the size in their header.
+        Full single messages are only known by their size, the others carry flags in their header
+        """
+        if size == self.msg_size:
+            return True
+
+        if size == CompactMessage_dtype.itemsize:
+            return compact_message_size(self.ring, offset) == size
+
+        return size > BatchMessage_header_size and batch_message_size(self.ring, offset) == size
+
+    def _drain_sock(self) -> int:
+        """
+        Receive the pending datagrams back to back into the ring without blocking.
+        Returns the number of frames received
+        """
+        self._next_ring()
+        self.frame_sizes = []
+        offset = 0
+
+        for _ in range(self.recv_batch):
             try:
-                recv_size = self.sock.recv_into(buf, len(buf))
-            except TimeoutError:
-                logger.debug('recv timeout')
+                recv_size = self.sock.recv_into(self.ring_view[offset:], self.max_frame_size)
+            except BlockingIOError:
+                break
             except Exception as e:
                 logger.error(f'recv threw an exception {e}')
+                break
 
-            # Make sure packet was received
-            if recv_size == len(buf):
-                sender_id, seq_num, packed_payload = sensor_msg.unpack()
-
-                if logger.getEffectiveLevel() > logging.DEBUG:
-                    logger.info(f'message received id:{sender_id} seq:{seq_num}')
+            # Make sure a whole frame was received
+            if self._is_valid_frame(offset, recv_size):
+                self.frame_sizes.append(recv_size)
+                offset += recv_size
+            else:
+                # A frame filling the whole receive size was most likely a larger batch, cut off
+                if recv_size == self.max_frame_size:
+                    logger.warning(f'dropped frame truncated to {recv_size} bytes, batches are limited to '
+                                   f'{self.max_batch} payloads by --max-batch')
                 else:
-                    logger.debug(f'message received id:{sender_id} seq:{seq_num} {buf}')
-
-                imu_payload = unpack_imu_payload(packed_payload)
-                logger.debug(f'received imu payload {imu_payload}')
-
-                # Create remote sensor state if first message from this sender
-                if sender_id not in self.remote_sensors:
-                    self.remote_sensors[sender_id] = RemoteSensor(sender_id, self.timeout_s)
-                    
-                    # Create visualization if enabled
-                    if self.visualize:
-                        self.orientation_previews[sender_id] = OrientationPreview(f'Consumer {sender_id}')
-
-                # Put message in queue for given remote sensor
-                remote_sensor = self.remote_sensors[sender_id]
-                remote_sensor.put_message(seq_num, imu_payload)
-
-            # Process imu data for all sensors
-            for remote_sensor in self.remote_sensors.values():
-                logger.info(f'updating remote sensor {remote_sensor.id}')
-                remote_sensor.update()
-                
-                # Update visualization if enabled
-                if self.visualize:
-                    self.orientation_previews[remote_sensor.id].update(remote_sensor.orientation)
+                    logger.warning(f'dropped malformed frame of {recv_size} bytes')
+
+                if self.metrics is not None:
+                    self.metrics.count('malformed')
+
+        return len(self.frame_sizes)
+
+    def _get_remote_sensor(self, sender_id: int) -> RemoteSensor:
+        # Create remote sensor state if first message from this sender
+        if sender_id not in self.remote_sensors:
+            self._add_remote_sensor(sender_id)
+
+        return self.remote_sensors[sender_id]
+
+    def _put_messages(self, count: int) -> set[int]:
+        """
+        Decode the frames in the ring and queue the messages for their remote sensors.
+        Returns the ids of the senders that received messages
+        """
+        updated_sensors = set()
+
+        # The decoded messages are views into the ring, the queues hold it until they were all processed
+        data = self.ring
+        owner = self.recv_buffer
+
+        # Messages of one wakeup share the receive time, the remote sensors learn their arrival statistics from it
+        recv_time = time.perf_counter()
+
+        if self.capture is not None:
+            self.capture.write(self.ring_view[:sum(self.frame_sizes)], self.frame_sizes, recv_time)
+
+        if self.broker is not None and self.broker.raw_subscribers:
+            self.broker.publish_frames(self.ring_view, self.frame_sizes)
+
+        # Single messages only, decode them all at once
+        if self.frame_sizes.count(self.msg_size) == count:
+            self._put_single_messages(decode_imu_messages(data, count), updated_sensors, recv_time, owner)
+            return updated_sensors
+
+        # Compact messages only, decode them all at once as well
+        if self.frame_sizes.count(CompactMessage_dtype.itemsize) == count:
+            self._put_single_messages(decode_compact_messages(data, count), updated_sensors, recv_time, owner)
+            return updated_sensors
+
+        offset = 0
+
+        for size in self.frame_sizes:
+            if size == self.msg_size:
+                self._put_single_messages(decode_imu_messages(data, 1, offset), updated_sensors, recv_time, owner)
+            else:
+                sender_id, first_seq, imu_payloads = decode_frame(data, offset, size)
+
+                if self.log_debug:
+                    logger.debug(f'frame received id:{sender_id} seq:{first_seq} count:{len(imu_payloads)}')
+
+                if self.metrics is not None:
+                    self._record_publish_latency(imu_payloads['gyro_timestamp'], recv_time)
+
+                # Queue the whole run of sequence numbers at once
+                self._get_remote_sensor(sender_id).put_messages(first_seq, imu_payloads, recv_time, owner)
+                updated_sensors.add(sender_id)
+
+            offset += size
+
+        return updated_sensors
+
+    def _put_single_messages(self, batch: IMUBatch, updated_sensors: set[int], recv_time: float = 0.0,
+                             owner: ReceiveBuffer | None = None):
+        if self.metrics is not None:
+            self._record_publish_latency(batch.gyro_timestamp, recv_time)
+
+        for sender_id, seq_num, imu_payload in zip(batch.sender_id.tolist(), batch.seq_num.tolist(), batch.payload):
+            if self.log_debug:
+                logger.debug(f'message received id:{sender_id} seq:{seq_num} {imu_payload}')
+
+            # Put message in queue for given remote sensor
+            self._get_remote_sensor(sender_id).put_message(seq_num, imu_payload, recv_time, owner)
+            updated_sensors.add(sender_id)
+
+    def _record_publish_latency(self, timestamps: np.ndarray, recv_time: float):
+        """
+        Record the age of the payloads when received. Timestamps are wrapping milliseconds of the publisher's
+        perf_counter, which is the same monotonic clock for all processes on a host
+        """
+        age_ms = (int(recv_time * 1000) - timestamps.astype(np.int64) + (1 << 31)) % (1 << 32) - (1 << 31)
+        self.metrics.histogram('publish_to_receive').record_many(age_ms / 1e3)
+
+    def _report_metrics(self, now: float):
+        senders = {sender_id: remote_sensor.get_stats() for sender_id, remote_sensor in self.remote_sensors.items()}
+
+        # Totals over all senders for the compact summary, the dump has them per sender
+        stats = {name: sum(sender[name] for sender in senders.values())
+                 for name in ('received', 'reordered', 'missing', 'duplicates', 'stall_flushes', 'gap_skips')}
+        stats['senders'] = len(senders)
+        stats['max_queue_depth'] = max((sender['queue_depth'] for sender in senders.values()), default=0)
+        stats['recv_buffers'] = len(self.recv_pool)
+        stats['recv_pool_exhausted'] = self.recv_pool.exhausted
+
+        if self.broker is not None:
+            stats.update(self.broker.get_stats())
+
+        self.metrics.report(now, stats, senders)
+
+    def _log_sender_summary(self, now: float):
+        """
+        Log the message rate, gaps and reordering of every sender since the last summary, one record per sender
+        no matter how many messages it sent
+        """
+        elapsed = now - self.last_summary_time
+
+        for sender_id, remote_sensor in self.remote_sensors.items():
+            message_queue = remote_sensor.message_queue
+            counts = (message_queue.received, message_queue.missing, message_queue.reordered, remote_sensor.gap_skips)
+            received, missing, reordered, gap_skips = [count - last for count, last in
+                                                       zip(counts, self.summary_counts.get(sender_id, (0, 0, 0, 0)))]
+            self.summary_counts[sender_id] = counts
+
+            if received or missing:
+                logger.info(f'sender {sender_id}: {received / elapsed:.0f} msgs/s, {gap_skips} gaps, '
+                            f'{missing} missing, {reordered} reordered')
+
+        self.last_summary_time = now
+
+    def _add_remote_sensor(self, sender_id: int):
+        latency = self.metrics.histogram('recv_to_update') if self.metrics is not None else None
+        self.remote_sensors[sender_id] = RemoteSensor(sender_id, self.timeout_s, latency, self.history)
+
+    def _update_remote_sensor(self, remote_sensor: RemoteSensor, flush: bool = False):
+        if self.log_debug:
+            logger.debug(f'updating remote sensor {remote_sensor.id}')
+
+        remote_sensor.update(flush)
+
+        if remote_sensor.prev_state is None:
+            return
+
+        message_queue = remote_sensor.message_queue
+        seq_num = (message_queue.seq_num - 1) & message_queue.seq_wrap
+        timestamp = int(remote_sensor.prev_state['gyro_timestamp'])
+
+        # Publish the estimate for readers in other processes
+        if self.orientation_table is not None:
+            self.orientation_table.write(remote_sensor.id, remote_sensor.orientation, seq_num, timestamp)
+
+        if self.broker is not None and self.broker.orientation_subscribers:
+            self.broker.publish_orientation(remote_sensor.id, remote_sensor.orientation, seq_num, timestamp)
+
+    def _start_viewer(self):
+        # Create visualization if enabled
+        if self.visualize:
+            from ..visualization import start_viewer
+            self.viewer = start_viewer(self.orientation_table.name, 'Consumer', self.frame_time)
+
+    def close(self):
+        if self.viewer is not None:
+            self.viewer.terminate()
+            self.viewer.join()
+            self.viewer = None
+
+        if self.owns_table:
+            self.orientation_table.close()
+
+    def _schedule_stall_timer(self, remote_sensor: RemoteSensor):
+        deadline = remote_sensor.get_stall_deadline()
+
+        if deadline is None:
+            return
+
+        # A later deadline is picked up when the scheduled one expires
+        scheduled = self.stall_scheduled.get(remote_sensor.id)
+
+        if scheduled is None or deadline < scheduled:
+            heapq.heappush(self.stall_timers, (deadline, remote_sensor.id))
+            self.stall_scheduled[remote_sensor.id] = deadline
+
+    def _run_stall_timers(self, now: float):
+        """
+        Update the sensors whose stall deadline has passed, they skip the gaps that waited long enough
+        """
+        while self.stall_timers and self.stall_timers[0][0] <= now:
+            scheduled, sender_id = heapq.heappop(self.stall_timers)
+
+            # Replaced by an earlier deadline
+            if self.stall_scheduled.get(sender_id) != scheduled:
+                continue
+
+            del self.stall_scheduled[sender_id]
+            remote_sensor = self.remote_sensors[sender_id]
+            deadline = remote_sensor.get_stall_deadline()
+
+            # Messages were delivered in the meantime, check again at the new deadline
+            if deadline is None or deadline > now:
+                self._schedule_stall_timer(remote_sensor)
+                continue
+
+            self._update_remote_sensor(remote_sensor)
+
+            # Only the expired gap was skipped, the messages behind later gaps wait on their own deadline
+            self._schedule_stall_timer(remote_sensor)
+
+    def _run_once(self):
+        """
+        Wait for one wakeup and process it
+        """
+        count = self._recv_batch()
+        start_time = time.perf_counter() if self.metrics is not None else 0.0
+        updated_sensors = self._put_messages(count)
+
+        # Process imu data only for the sensors that can deliver the next message in order
+        for sender_id in updated_sensors:
+            remote_sensor = self.remote_sensors[sender_id]
+
+            if remote_sensor.message_queue.has_next():
+                self._update_remote_sensor(remote_sensor)
+
+            # Whatever is left waits on a gap until it's filled or the stall deadline passes
+            self._schedule_stall_timer(remote_sensor)
+
+        self._run_stall_timers(time.perf_counter())
+
+        # Deliver to the subscribers whatever their sockets can take without waiting
+        if self.broker is not None:
+            self.broker.flush()
+            self.broker.poll(time.perf_counter())
+
+        if self.log_summary and time.perf_counter() - self.last_summary_time >= self.summary_interval:
+            self._log_sender_summary(time.perf_counter())
+
+        # Time spent processing the wakeup, not counting the wait for messages
+        if self.metrics is not None:
+            now = time.perf_counter()
+            self.metrics.histogram('loop').record(now - start_time)
+
+            if self.metrics.is_due(now):
+                self._report_metrics(now)
+
+    def run(self):
+        self._start_viewer()
+
+        while True:
+            self._run_once()
 
 def main():
     parser = argparse.ArgumentParser(prog='consumer.py')
@@ -93,30 +418,147 @@ def main():
         default=100,
         type=int,
         help='set how long the consumer should wait for missing packets')
+    parser.add_argument('--recv-batch',
+        default=64,
+        type=int,
+        help='set the maximum number of datagrams received per wakeup (default: 64)')
     parser.add_argument(
         '--log-level',
         default='INFO',
         choices=['debug', 'info', 'warning', 'error', 'critical'],
         help='set logging level (default: info)')
+    parser.add_argument('--max-batch',
+        default=BatchMessage_max_count,
+        type=int,
+        help='set the largest number of payloads accepted in a batch frame, larger frames are dropped. Lowering '
+             f'it shrinks the receive buffers (default: {BatchMessage_max_count}, the most a publisher sends)')
+    parser.add_argument('--transport',
+        default='socket',
+        choices=['socket', 'shm'],
+        help='receive over the UNIX socket or over shared memory rings registered on it (default: socket)')
+    parser.add_argument('--shards',
+        default=0,
+        type=int,
+        help='partition the senders across this many worker processes (default: 0, no sharding)')
+    parser.add_argument('--shm-table',
+        default=None,
+        help='publish the estimated orientations to a shared memory table with this name')
+    parser.add_argument('--async',
+        dest='use_async',
+        type=bool,
+        default=False,
+        const=True,
+        nargs='?',
+        help='run the consumer on an asyncio event loop (default: False)')
+    parser.add_argument('--capture',
+        default=None,
+        help='record all received messages to this capture file for replay')
+    parser.add_argument('--metrics',
+        type=bool,
+        default=False,
+        const=True,
+        nargs='?',
+        help='collect latency and throughput metrics and log a summary periodically (default: False)')
+    parser.add_argument('--metrics-interval-s',
+        default=5.0,
+        type=float,
+        help='set the interval between metrics summaries (default: 5)')
+    parser.add_argument('--metrics-file',
+        default=None,
+        help='also dump the metrics as JSON to this file every interval, implies --metrics')
     parser.add_argument('--visualize',
         type=bool,
         default=False,
         const=True,
         nargs='?',
-        help='show a 3D visualization of the orientation (default: False)')
+        help='show the estimated orientations of all senders in a separate viewer process (default: False)')
+    parser.add_argument('--subscribe-socket',
+        default=None,
+        help='accept subscribers to the received frames or the estimated orientations on this UNIX socket')
+    parser.add_argument('--subscriber-queue',
+        default=256,
+        type=int,
+        help='set how many deliveries are kept per subscriber before dropping the oldest (default: 256)')
 
     args = parser.parse_args()
 
+    if args.transport == 'shm' and (args.shards > 0 or args.use_async):
+        parser.error('--transport shm is not supported together with --shards or --async')
+
+    if not 0 < args.max_batch <= BatchMessage_max_count:
+        parser.error(f'--max-batch must be between 1 and {BatchMessage_max_count}')
+
+    if args.subscribe_socket is not None and (args.shards > 0 or args.use_async):
+        parser.error('--subscribe-socket is not supported together with --shards or --async')
+
     setup_logging(args.log_level)
 
     logger.debug(f'socket path: {args.socket_path}')
     logger.debug(f'timeout: {args.timeout_ms}ms')
     logger.debug(f'visualize: {args.visualize}')
+    logger.debug(f'recv batch: {args.recv_batch}')
+    logger.debug(f'max batch: {args.max_batch}')
+    logger.debug(f'async: {args.use_async}')
+    logger.debug(f'transport: {args.transport}')
+    logger.debug(f'shards: {args.shards}')
+    logger.debug(f'shm table: {args.shm_table}')
+    logger.debug(f'metrics: {args.metrics} file:{args.metrics_file}')
+    logger.debug(f'capture: {args.capture}')
+    logger.debug(f'subscribe socket: {args.subscribe_socket} queue:{args.subscriber_queue}')
+
+    orientation_table = None
+    metrics = None
+    capture = None
+    broker = None
+    consumer = None
+
+    if args.metrics or args.metrics_file is not None:
+        metrics = Metrics('consumer', args.metrics_interval_s, args.metrics_file)
 
     try:
-        consumer = Consumer(args.socket_path, args.timeout_ms / 1e3, args.visualize)
-        consumer.run()
+        if args.shm_table is not None:
+            orientation_table = OrientationTable.create(args.shm_table)
+
+        if args.capture is not None:
+            capture = CaptureWriter(args.capture)
+
+        if args.subscribe_socket is not None:
+            broker = Broker(args.subscribe_socket, args.subscriber_queue)
+
+        if args.shards > 0:
+            from .sharded_consumer import ShardedConsumer
+            consumer = ShardedConsumer(args.socket_path, args.timeout_ms / 1e3, args.shards, args.visualize,
+                                       args.recv_batch, orientation_table, args.max_batch, args.log_level,
+                                       metrics=metrics, capture=capture)
+            consumer.run()
+        elif args.transport == 'shm':
+            from .shm_consumer import ShmConsumer
+            consumer = ShmConsumer(args.socket_path, args.timeout_ms / 1e3, args.visualize, args.recv_batch,
+                                   orientation_table, args.max_batch, metrics, capture, broker)
+            consumer.run()
+        elif args.use_async:
+            import asyncio
+            from .async_consumer import AsyncConsumer
+            consumer = AsyncConsumer(args.socket_path, args.timeout_ms / 1e3, args.visualize, args.recv_batch,
+                                     orientation_table, args.max_batch, metrics, capture)
+            asyncio.run(consumer.run())
+        else:
+            consumer = Consumer(args.socket_path, args.timeout_ms / 1e3, args.visualize, args.recv_batch,
+                                orientation_table, args.max_batch, metrics, capture, broker)
+            consumer.run()
     except KeyboardInterrupt:
         pass
     except Exception as e:
         logger.error(e)
+    finally:
+        if consumer is not None:
+            consumer.close()
+
+        if orientation_table is not None:
+            orientation_table.close()
+
+        if capture is not None:
+            capture.close()
+
+        if broker is not None:
+            broker.close()
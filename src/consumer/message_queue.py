@@ -1,44 +1,334 @@
-from queue import PriorityQueue
+from collections import deque
 import time
 
+# Weight of a new observation in the arrival statistics, and the decay of the reorder depth per message
+Arrival_alpha = 1.0 / 16
+Reorder_decay = 1.0 - 1.0 / 256
+
+# Messages buffered per sender, a restart is detected further behind than half of it
+Window_capacity = 1024
+
 class MessageQueue:
     """
     Orders messages based on sequence number.
-    Keeps track of time when it was last updated to allow flushing during a stall
+    Messages are held in a fixed capacity reorder window, a ring indexed by seq_num % capacity, so inserting and
+    draining in order are O(1). Sequence numbers are compared modulo seq_wrap + 1 to handle the wrap around.
+    Keeps track of time when it was last updated to allow flushing during a stall.
+    Put times are the receive times in seconds of perf_counter, they also feed the arrival statistics of the sender
+    used to size how long a gap is waited on.
+    Messages can be put with the receive buffer they are a view into, the queue holds the buffer while it keeps
+    the message and releases it when the message is popped or dropped.
+    A message further behind than half the window, or behind it after the sender was silent for restart_time, is
+    taken as the sender having restarted. The window then starts over at its sequence number
     """
-    def __init__(self, seq_wrap=((1 << 32) - 1)):
+    def __init__(self, seq_wrap=((1 << 32) - 1), capacity=Window_capacity, restart_time: float | None = None):
+        assert capacity & (capacity - 1) == 0, 'capacity must be a power of two'
+        assert capacity <= (seq_wrap + 1) // 2, 'capacity must be at most half of the sequence range'
+
         self.seq_num = 0
         self.seq_wrap = seq_wrap
-        self.pq = PriorityQueue()
+        self.capacity = capacity
+        self.restart_time = restart_time
+        self.slots = [None] * capacity
         self.last_pop_time = None
 
+        # Time each buffered message was received at, as passed by the caller, and of the last popped one
+        self.put_times = [0.0] * capacity
+        self.pop_put_time = 0.0
+
+        # Receive buffer each buffered message is held in, None if it owns its memory
+        self.owners = [None] * capacity
+
+        # Number of buffered messages and the distance from seq_num past the furthest one
+        self.count = 0
+        self.span = 0
+
+        # Messages too far ahead of the window, e.g. after a long outage. Bounded so a flood can't grow memory
+        self.overflow = deque(maxlen=capacity)
+
+        # Statistics
+        self.received = 0       # messages put into the queue
+        self.reordered = 0      # arrived after a later sequence number was buffered
+        self.missing = 0        # sequence numbers skipped when flushing
+        self.late = 0           # arrived after the window moved past them
+        self.duplicates = 0     # arrived while the same sequence number was buffered
+        self.out_of_window = 0  # arrived too far from the window
+        self.dropped = 0        # out of window messages evicted from the overflow, or left buffered on a restart
+        self.restarts = 0       # times the sender restarted its sequence numbers
+
+        # Arrival statistics
+        self.last_put_time = None
+        self.put_count = 0
+        self.arrivals = 0           # receives the statistics were updated with
+        self.interval = 0.0         # moving average of the time between messages
+        self.jitter = 0.0           # moving average of the deviation of the time between messages from interval
+        self.reorder_depth = 0.0    # decaying maximum of how many later messages arrived before a reordered one
+
+    def _observe_arrival(self, put_time: float, count: int):
+        """
+        Update the arrival statistics with count messages received at put_time.
+        Messages received together share the put time, so the statistics change once per receive
+        """
+        if put_time == self.last_put_time:
+            self.put_count += count
+            return
+
+        # Messages put again when resyncing arrived earlier and were already counted
+        if self.last_put_time is not None and put_time < self.last_put_time:
+            return
+
+        if self.last_put_time is not None:
+            # The time since the previous receive is spread over the messages received then
+            interval = (put_time - self.last_put_time) / self.put_count
+
+            # Start out from the first interval with a deviation of half of it
+            if self.arrivals == 0:
+                self.interval, self.jitter = interval, interval / 2
+            else:
+                self.jitter += (abs(interval - self.interval) - self.jitter) * Arrival_alpha
+                self.interval += (interval - self.interval) * Arrival_alpha
+
+            self.reorder_depth *= Reorder_decay ** self.put_count
+            self.arrivals += 1
+
+        self.last_put_time = put_time
+        self.put_count = count
+
+    def _observe_reorder(self, depth: int):
+        if depth > self.reorder_depth:
+            self.reorder_depth = depth
+
     def _update_last_pop(self):
         self.last_pop_time = time.perf_counter()
 
     def get_stall_time(self) -> float:
         return time.perf_counter() - self.last_pop_time if self.last_pop_time else 0
 
-    def put_message(self, seq_num: int, msg: object):
-        self.pq.put((seq_num, msg))
+    def has_next(self) -> bool:
+        """
+        Whether the next message in order is buffered
+        """
+        return self.slots[self.seq_num & (self.capacity - 1)] is not None
+
+    def get_missing_seq_nums(self) -> list[int]:
+        """
+        Sequence numbers currently missing between the next expected and the furthest buffered message
+        """
+        seq_nums = [(self.seq_num + i) & self.seq_wrap for i in range(self.span)]
+        return [seq_num for seq_num in seq_nums if self.slots[seq_num & (self.capacity - 1)] is None]
+
+    def get_gap_time(self) -> float | None:
+        """
+        Put time of the first buffered message past the missing next one, None if nothing waits on a gap
+        """
+        if self.count == 0 or self.has_next():
+            return None
+
+        for i in range(1, self.span):
+            index = (self.seq_num + i) & (self.capacity - 1)
+
+            if self.slots[index] is not None:
+                return self.put_times[index]
+
+    def get_gap_wait(self, max_wait: float, jitter_factor: float = 4.0) -> float:
+        """
+        How long a missing message is waited for after a later one arrived. Long enough for the deepest recent
+        reordering to resolve, with a margin for the arrival jitter, and at most max_wait
+        """
+        if self.arrivals == 0:
+            return max_wait
+
+        return min((self.reorder_depth + 1) * self.interval + jitter_factor * self.jitter, max_wait)
+
+    def skip_gap(self) -> int:
+        """
+        Skip the missing sequence numbers up to the next buffered message, returns how many were skipped
+        """
+        skipped = 0
+
+        while self.count > 0 and self.slots[self.seq_num & (self.capacity - 1)] is None:
+            self.seq_num = (self.seq_num + 1) & self.seq_wrap
+            self.span -= 1
+            skipped += 1
+
+        self.missing += skipped
+
+        return skipped
+
+    def _store(self, index: int, msg: object, put_time: float, owner):
+        self.slots[index] = msg
+        self.put_times[index] = put_time
+        self.owners[index] = owner
+        self.count += 1
+
+        if owner is not None:
+            owner.retain()
+
+    def _is_restart(self, offset: int, idle_time: float) -> bool:
+        """
+        Whether a message at offset from the window was sent after the sender restarted
+        """
+        # Only messages behind the window, the sequence numbers start over lower
+        if offset <= (self.seq_wrap + 1) // 2:
+            return False
+
+        # Reordering doesn't hold messages back that far, and a late one doesn't arrive after such a silence
+        behind = self.seq_wrap + 1 - offset
+        return behind > self.capacity // 2 or (self.restart_time is not None and idle_time >= self.restart_time)
+
+    def _restart(self, seq_num: int):
+        """
+        Start the window over at seq_num, dropping the messages of the previous run still buffered
+        """
+        for index in range(self.capacity):
+            if (owner := self.owners[index]) is not None:
+                owner.release()
+
+        for _, _, _, owner in self.overflow:
+            if owner is not None:
+                owner.release()
+
+        self.dropped += self.count + len(self.overflow)
+        self.restarts += 1
+
+        self.slots = [None] * self.capacity
+        self.owners = [None] * self.capacity
+        self.overflow.clear()
+        self.count = 0
+        self.span = 0
+        self.seq_num = seq_num
+
+    def put_message(self, seq_num: int, msg: object, put_time: float = 0.0, owner=None):
+        offset = (seq_num - self.seq_num) & self.seq_wrap
+        idle_time = put_time - self.last_put_time if self.last_put_time is not None else 0.0
+        self.received += 1
+
+        if offset >= self.capacity and self._is_restart(offset, idle_time):
+            self._restart(seq_num)
+            offset = 0
+
+        if put_time == self.last_put_time:
+            self.put_count += 1
+        else:
+            self._observe_arrival(put_time, 1)
+
+        if offset < self.capacity:
+            index = seq_num & (self.capacity - 1)
+
+            if self.slots[index] is None:
+                self._store(index, msg, put_time, owner)
+
+                if offset + 1 < self.span:
+                    self.reordered += 1
+                    self._observe_reorder(self.span - offset - 1)
+                else:
+                    self.span = offset + 1
+            else:
+                self.duplicates += 1
+        elif offset > self.seq_wrap - self.capacity:
+            self.late += 1
+        else:
+            self.out_of_window += 1
+
+            if len(self.overflow) == self.overflow.maxlen:
+                self.dropped += 1
+
+                if (dropped_owner := self.overflow[0][3]) is not None:
+                    dropped_owner.release()
+
+            self.overflow.append((seq_num, msg, put_time, owner))
+
+            if owner is not None:
+                owner.retain()
 
         # Initalize the stall timer
         if self.last_pop_time is None:
             self._update_last_pop()
 
-    def pop_message(self, force_order=True) -> object | None:
-        if self.pq.empty():
-            return None
+    def put_messages(self, seq_num: int, msgs, put_time: float = 0.0, owner=None):
+        """
+        Put a run of messages with consecutive sequence numbers starting at seq_num
+        """
+        offset = (seq_num - self.seq_num) & self.seq_wrap
+
+        # Take the message by message path unless the whole run fits in the window
+        if offset + len(msgs) > self.capacity:
+            for i, msg in enumerate(msgs):
+                self.put_message((seq_num + i) & self.seq_wrap, msg, put_time, owner)
+            return
+
+        self.received += len(msgs)
+        self._observe_arrival(put_time, len(msgs))
+
+        # The whole run arrived after a later sequence number was buffered
+        if offset + len(msgs) < self.span:
+            self.reordered += len(msgs)
+            self._observe_reorder(self.span - offset - len(msgs))
+
+        for i, msg in enumerate(msgs):
+            index = (seq_num + i) & (self.capacity - 1)
 
-        seq_num, msg = self.pq.get()
-        is_ordered = (self.seq_num == seq_num)
+            if self.slots[index] is None:
+                self._store(index, msg, put_time, owner)
+            else:
+                self.duplicates += 1
 
-        # Return if its ordered or we're flushing
-        if is_ordered or not force_order:
+        self.span = max(self.span, offset + len(msgs))
+
+        # Initalize the stall timer
+        if self.last_pop_time is None:
             self._update_last_pop()
-            self.seq_num = (self.seq_num if force_order else seq_num) + 1 & self.seq_wrap
-            return msg
 
-        # Put the message back
-        self.pq.put((seq_num, msg))
+    def _resync(self):
+        """
+        Move the window to the earliest out of window message and buffer the overflow again
+        """
+        overflow = self.overflow
+        self.overflow = deque(maxlen=self.capacity)
+
+        # Order relative to a point before the first overflowed message to handle the wrap around
+        ref = (overflow[0][0] - self.capacity) & self.seq_wrap
+        self.seq_num = min((seq_num for seq_num, *_ in overflow), key=lambda seq_num: (seq_num - ref) & self.seq_wrap)
+        self.span = 0
+
+        # Already counted when they first arrived
+        self.received -= len(overflow)
+
+        # Buffered again with a hold of their own, the hold of the overflow is released
+        for seq_num, msg, put_time, owner in overflow:
+            self.put_message(seq_num, msg, put_time, owner)
+
+            if owner is not None:
+                owner.release()
+
+    def pop_message(self, force_order=True) -> object | None:
+        if not force_order:
+            if self.count == 0 and self.overflow:
+                self._resync()
+
+            if self.count == 0:
+                return None
+
+            # Skip the missing sequence numbers up to the next buffered message
+            self.skip_gap()
+
+        index = self.seq_num & (self.capacity - 1)
+        msg = self.slots[index]
+
+        # Return only if it's the next in order
+        if msg is None:
+            return None
+
+        # The caller has to copy the message before the next receive when it was held in a receive buffer
+        if (owner := self.owners[index]) is not None:
+            owner.release()
+            self.owners[index] = None
+
+        self.slots[index] = None
+        self.pop_put_time = self.put_times[index]
+        self.count -= 1
+        self.span -= 1
+        self.seq_num = (self.seq_num + 1) & self.seq_wrap
+        self._update_last_pop()
 
-        return None
+        return msg
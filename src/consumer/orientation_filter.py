@@ -0,0 +1,61 @@
+import numpy as np
+
+from ..misc.quaternion_loader import quat
+
+"""
+Vectorized stages of the complementary filter used by RemoteSensor.
+Sample arrays have a leading time axis of length N followed by optional sensor axes, so the same functions
+process one sensor (N, 3) or many sensors at once (N, S, 3).
+"""
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+def compass_orientations(accel: np.ndarray, mag: np.ndarray) -> np.ndarray:
+    """
+    Find the compass orientations based on accelerometer and tilt-compensated magnetometer readings
+    """
+    up = -_normalize(accel)
+    right = _normalize(np.cross(mag, up))
+    forward = _normalize(np.cross(right, up))
+
+    # Axes are the columns of the rotation matrix
+    return quat.from_rotation_matrix(np.stack([right, up, forward], axis=-1))
+
+def warm_up():
+    """
+    Run the filter stages that load modules lazily once. The first rotation matrix conversion imports scipy, which
+    takes a few hundred milliseconds that are better spent before any messages queue up
+    """
+    compass_orientations(np.array([[0.0, 0.0, -1.0]]), np.array([[1.0, 0.0, 0.0]]))
+
+def gyro_rotations(gyro: np.ndarray, dt: np.ndarray) -> np.ndarray:
+    """
+    Find the delta rotations from the integrated gyro readings
+    """
+    return quat.from_rotation_vector(gyro * dt[..., np.newaxis])
+
+def blend_orientations(orientation, compass: np.ndarray, gyro_rotation: np.ndarray, gyro_alpha: float) -> np.ndarray:
+    """
+    Blend the compass orientations and the gyro orientations.
+    Each step depends on the previous estimate, so this is a sequential scan over the time axis.
+    Returns the estimated orientation after every step
+    """
+    orientations = np.empty_like(compass)
+
+    for i in range(len(compass)):
+        orientation = quat.slerp_evaluate(compass[i], gyro_rotation[i] * orientation, gyro_alpha)
+        orientations[i] = orientation
+
+    return orientations
+
+def complementary_filter(orientation, accel: np.ndarray, gyro: np.ndarray, mag: np.ndarray, dt: np.ndarray,
+                         gyro_alpha: float) -> np.ndarray:
+    """
+    Run the complementary filter over N readings starting from the given orientation.
+    dt is the time step following each reading in seconds, returns the estimated orientation after every step
+    """
+    compass = compass_orientations(accel, mag)
+    gyro_rotation = gyro_rotations(gyro, dt)
+
+    return blend_orientations(orientation, compass, gyro_rotation, gyro_alpha)
@@ -0,0 +1,179 @@
+import numpy as np
+
+from ..misc.quaternion_loader import quat
+
+# Timestamps are wrapping 32 bit milliseconds, differences are taken modulo the wrap
+Timestamp_wrap = 1 << 32
+
+class OrientationHistory:
+    """
+    Recent orientations of up to slots senders indexed by their timestamp, for looking up the orientation at an
+    arbitrary time, e.g. to align with a camera frame.
+    Every sender has a ring of the last capacity (timestamp, orientation) pairs in one preallocated array, so the
+    memory is fixed at slots * capacity * 40 bytes no matter how many senders show up, e.g. about 51MB for
+    256 senders with 10s of history at 500Hz. Lookups binary search the rings of many senders at once and slerp
+    between the neighbouring samples.
+    Timestamps are the gyro timestamps in milliseconds of the sender's clock. They are unwrapped when appended,
+    queries are taken relative to the newest sample of their sender
+    """
+    def __init__(self, capacity: int, slots: int = 256):
+        assert capacity > 1
+
+        self.capacity = capacity
+        self.slots = slots
+
+        # Unwrapped timestamps and orientations as w, x, y, z, the oldest sample of a sender is at its start
+        self.timestamps = np.zeros((slots, capacity), dtype=np.int64)
+        self.orientations = np.zeros((slots, capacity, 4), dtype=np.float64)
+        self.starts = np.zeros(slots, dtype=np.int64)
+        self.counts = np.zeros(slots, dtype=np.int64)
+
+        # Wrapped timestamp of the newest sample of every sender, for unwrapping
+        self.last_timestamps = np.zeros(slots, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return int(self.counts.sum())
+
+    def clear(self, sender_id: int):
+        self.starts[sender_id] = 0
+        self.counts[sender_id] = 0
+
+    def _unwrap(self, sender_ids, timestamps) -> np.ndarray:
+        """
+        Timestamps unwrapped relative to the newest sample of their sender, within half the wrap around it
+        """
+        last = self.last_timestamps[sender_ids]
+        newest = self.timestamps[sender_ids, (self.starts[sender_ids] + self.counts[sender_ids] - 1) % self.capacity]
+
+        return newest + (np.mod(timestamps - last + Timestamp_wrap // 2, Timestamp_wrap) - Timestamp_wrap // 2)
+
+    def append(self, sender_id: int, timestamps: np.ndarray, orientations: np.ndarray):
+        """
+        Append the orientations of a sender estimated at the given wrapping millisecond timestamps, in order.
+        Orientations are an array of np.quaternion, the oldest samples are overwritten once the ring is full
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+
+        if len(timestamps) == 0:
+            return
+
+        orientations = quat.as_float_array(orientations)
+        count = self.counts[sender_id]
+
+        # Steps between samples, the first one from the newest sample already held
+        steps = np.diff(timestamps, prepend=self.last_timestamps[sender_id] if count else timestamps[0])
+        steps = np.mod(steps + Timestamp_wrap // 2, Timestamp_wrap) - Timestamp_wrap // 2
+
+        # The clock went back, e.g. the sender restarted on another host, the history before can't be ordered
+        if (backwards := np.flatnonzero(steps < 0)).size:
+            self.clear(sender_id)
+            count = 0
+            timestamps, orientations, steps = (timestamps[backwards[-1]:], orientations[backwards[-1]:],
+                                               steps[backwards[-1]:])
+            steps[0] = 0
+
+        base = self.timestamps[sender_id, (self.starts[sender_id] + count - 1) % self.capacity] if count else 0
+        unwrapped = base + np.cumsum(steps) if count else timestamps[0] + np.cumsum(steps)
+        self.last_timestamps[sender_id] = timestamps[-1]
+
+        # Only the newest samples fit
+        if len(unwrapped) > self.capacity:
+            unwrapped, orientations = unwrapped[-self.capacity:], orientations[-self.capacity:]
+
+        # Write at the end of the ring, wrapping around the array at most once
+        indices = (self.starts[sender_id] + count + np.arange(len(unwrapped))) % self.capacity
+        self.timestamps[sender_id, indices] = unwrapped
+        self.orientations[sender_id, indices] = orientations
+
+        overwritten = max(count + len(unwrapped) - self.capacity, 0)
+        self.starts[sender_id] = (self.starts[sender_id] + overwritten) % self.capacity
+        self.counts[sender_id] = count + len(unwrapped) - overwritten
+
+    def _search(self, sender_ids: np.ndarray, timestamps: np.ndarray) -> np.ndarray:
+        """
+        Number of samples of every sender at or before the timestamp, a binary search over the rings of all
+        queries at once taking log2(capacity) steps
+        """
+        starts = self.starts[sender_ids]
+        lo = np.zeros(len(sender_ids), dtype=np.int64)
+        hi = self.counts[sender_ids].copy()
+
+        for _ in range(self.capacity.bit_length()):
+            mid = (lo + hi) // 2
+            after = self.timestamps[sender_ids, (starts + mid) % self.capacity] > timestamps
+            searching = lo < hi
+            hi = np.where(searching & after, mid, hi)
+            lo = np.where(searching & ~after, mid + 1, lo)
+
+        return lo
+
+    def lookup(self, sender_ids, timestamps) -> np.ndarray:
+        """
+        Orientations of the senders at the timestamps, both broadcast against each other, as an array of
+        np.quaternion. Between two samples the orientation is slerped, after the newest sample it's the newest
+        orientation, before the oldest sample held or for senders without history it's NaN
+        """
+        sender_ids, timestamps = np.broadcast_arrays(np.asarray(sender_ids, dtype=np.int64),
+                                                     np.asarray(timestamps, dtype=np.float64))
+        shape = sender_ids.shape
+        sender_ids, timestamps = sender_ids.ravel(), timestamps.ravel()
+        result = np.full((len(sender_ids), 4), np.nan)
+
+        held = self.counts[sender_ids] > 0
+        sender_ids, timestamps = sender_ids[held], self._unwrap(sender_ids[held], timestamps[held])
+
+        # Indices of the samples either side, clamped to the newest
+        counts = self.counts[sender_ids]
+        after = self._search(sender_ids, timestamps)
+        next_ = np.minimum(after, counts - 1)
+        prev = np.maximum(next_ - 1, 0)
+
+        starts = self.starts[sender_ids]
+        prev_index, next_index = (starts + prev) % self.capacity, (starts + next_) % self.capacity
+        prev_time = self.timestamps[sender_ids, prev_index]
+        next_time = self.timestamps[sender_ids, next_index]
+
+        # Position between the samples, 1 at and after the newest
+        span = next_time - prev_time
+        tau = np.where(after >= counts, 1.0, (timestamps - prev_time) / np.where(span > 0, span, 1))
+
+        orientations = _slerp(self.orientations[sender_ids, prev_index], self.orientations[sender_ids, next_index],
+                              tau)
+        orientations[after == 0] = np.nan
+        result[held] = orientations
+
+        return quat.as_quat_array(result.reshape(shape + (4,)))
+
+    def get_range(self, sender_id: int) -> tuple[int, int] | None:
+        """
+        Unwrapped timestamps of the oldest and newest samples of a sender, None if it has no history
+        """
+        count = self.counts[sender_id]
+
+        if count == 0:
+            return None
+
+        start = self.starts[sender_id]
+        newest = (start + count - 1) % self.capacity
+
+        return int(self.timestamps[sender_id, start]), int(self.timestamps[sender_id, newest])
+
+def _slerp(q0: np.ndarray, q1: np.ndarray, tau: np.ndarray) -> np.ndarray:
+    """
+    Spherical linear interpolation between rows of unit quaternions as float arrays, along the shorter arc
+    """
+    dot = np.einsum('ij,ij->i', q0, q1)
+    q1 = np.where(dot[:, None] < 0, -q1, q1)
+    dot = np.minimum(np.abs(dot), 1.0)
+
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+
+    # Nearly parallel quaternions fall back to a normalized linear interpolation
+    close = sin_theta < 1e-6
+    safe_sin = np.where(close, 1.0, sin_theta)
+    w0 = np.where(close, 1 - tau, np.sin((1 - tau) * theta) / safe_sin)
+    w1 = np.where(close, tau, np.sin(tau * theta) / safe_sin)
+
+    q = w0[:, None] * q0 + w1[:, None] * q1
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
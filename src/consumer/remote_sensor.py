@@ -1,21 +1,37 @@
 import logging
+import time
 import numpy as np
-import quaternion as quat
 
-from ..transport import IMUPayload
+from ..misc import LatencyHistogram
+from ..misc.quaternion_loader import quat
+from ..transport import IMUPayload_dtype, ReceiveBuffer
 from .message_queue import MessageQueue
+from .orientation_filter import complementary_filter
+from .orientation_history import OrientationHistory
 
 logger = logging.getLogger(__name__)
 
 class RemoteSensor:
     """
     Represents a remote sensor sending us state updates.
-    Messages are submitted with put_message and calling update will process the state changes
+    Messages are submitted with put_message and calling update will process the state changes.
+    A message missing behind a later one is waited for as long as the sender's arrival jitter and recent
+    reordering suggest it may still arrive, at most stall_time, then only that gap is skipped. A sender going back
+    in sequence numbers after being silent for stall_time is taken as restarted.
+    When a latency histogram is given, update records how long each processed message waited since it was put,
+    when a history is given the orientation after each processed message is kept in it
     """
-    def __init__(self, id_: int, stall_time: float):
+    def __init__(self, id_: int, stall_time: float, latency: LatencyHistogram | None = None,
+                 history: OrientationHistory | None = None):
         self.id = id_
         self.stall_time = stall_time
-        self.message_queue = MessageQueue()
+        self.latency = latency
+        self.history = history
+        self.message_queue = MessageQueue(restart_time=stall_time)
+
+        # Number of times the queue was flushed out of order after a stall, and of single gaps skipped
+        self.stall_flushes = 0
+        self.gap_skips = 0
         
         # Estimated orientation of the system
         self.orientation = np.quaternion(1, 0, 0, 0)
@@ -24,36 +40,164 @@ class RemoteSensor:
         # Weight for gyroscope data
         self.gyro_alpha = 0.98
 
-    def put_message(self, seq_num: int, msg: IMUPayload):
-        self.message_queue.put_message(seq_num, msg)
+    def put_message(self, seq_num: int, msg: np.void, put_time: float | None = None,
+                    owner: ReceiveBuffer | None = None):
+        self.message_queue.put_message(seq_num, msg, time.perf_counter() if put_time is None else put_time, owner)
+
+    def put_messages(self, seq_num: int, msgs: np.ndarray, put_time: float | None = None,
+                     owner: ReceiveBuffer | None = None):
+        self.message_queue.put_messages(seq_num, msgs, time.perf_counter() if put_time is None else put_time, owner)
+
+    def get_gap_wait(self) -> float:
+        return self.message_queue.get_gap_wait(self.stall_time)
+
+    def get_stall_deadline(self) -> float | None:
+        """
+        Time at which the gap in front of the buffered messages will be skipped, or the messages too far from the
+        window will be flushed. None if nothing is waiting
+        """
+        gap_time = self.message_queue.get_gap_time()
+
+        if gap_time is not None:
+            return gap_time + self.get_gap_wait()
+
+        if self.message_queue.count == 0 and not self.message_queue.overflow:
+            return None
+
+        return self.message_queue.last_pop_time + self.stall_time
+
+    def update(self, flush: bool = False):
+        """
+        Process the messages deliverable in order, skipping the gaps waited on for longer than the gap wait.
+        When stalled for stall_time, or when flush is set, the remaining messages are processed too, skipping
+        over all gaps
+        """
+        imu_states = []
+        put_times = [] if self.latency is not None else None
+        now = time.perf_counter()
+        gap_wait = self.get_gap_wait()
+
+        while True:
+            # Handle ordered messages
+            while imu_state := self.message_queue.pop_message():
+                imu_states.append(imu_state)
+
+                if put_times is not None:
+                    put_times.append(self.message_queue.pop_put_time)
+
+            # Give up on the next message once a later one waited long enough, the gaps after it get their own time
+            gap_time = self.message_queue.get_gap_time()
 
-    def update(self):
-        # Handle ordered messages
-        while imu_state := self.message_queue.pop_message():
-            self._update(imu_state)
+            if gap_time is None or (not flush and now - gap_time < gap_wait):
+                break
+
+            skipped = self.message_queue.skip_gap()
+            self.gap_skips += 1
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'remote sensor {self.id} skipped {skipped} missing after {now - gap_time:.3f}s')
+
+        # Messages too far from the window are only taken when flushing, or once nothing else arrived for stall_time
+        stalled = self.message_queue.count == 0 and self.message_queue.get_stall_time() >= self.stall_time
+
+        if self.message_queue.overflow and (flush or stalled):
+            logger.warning(f'remote sensor {self.id} stalled for {self.message_queue.get_stall_time():.3f}s')
+            flushed = len(imu_states)
 
-        # Flush the rest if stalled
-        if self.message_queue.get_stall_time() >= self.stall_time:
-            logging.warn(f'stalled for {self.message_queue.get_stall_time()}s')
             while imu_state := self.message_queue.pop_message(force_order=False):
-                self._update(imu_state)
+                imu_states.append(imu_state)
+
+                if put_times is not None:
+                    put_times.append(self.message_queue.pop_put_time)
+
+            if len(imu_states) > flushed:
+                self.stall_flushes += 1
+
+        if imu_states:
+            imu_states = np.array(imu_states, dtype=IMUPayload_dtype)
+            orientations = self.update_batch(imu_states)
+
+            if self.history is not None:
+                self.history.append(self.id, imu_states['gyro_timestamp'], orientations)
+
+            if put_times is not None:
+                self.latency.record_many(time.perf_counter() - np.array(put_times))
+
+    def lookup(self, timestamps) -> np.ndarray:
+        """
+        Orientations at the gyro timestamps in milliseconds, interpolated from the history
+        """
+        assert self.history is not None
+        return self.history.lookup(self.id, timestamps)
+
+    def get_stats(self) -> dict:
+        """
+        Counters and queue depth of this sender for the metrics summary
+        """
+        message_queue = self.message_queue
+
+        return {
+            'received': message_queue.received,
+            'reordered': message_queue.reordered,
+            'missing': message_queue.missing,
+            'late': message_queue.late,
+            'duplicates': message_queue.duplicates,
+            'dropped': message_queue.dropped,
+            'restarts': message_queue.restarts,
+            'stall_flushes': self.stall_flushes,
+            'gap_skips': self.gap_skips,
+            'gap_wait_ms': self.get_gap_wait() * 1e3,
+            'queue_depth': message_queue.count + len(message_queue.overflow),
+        }
+
+    def update_batch(self, imu_states: np.ndarray) -> np.ndarray:
+        """
+        Update the estimated orientation from N ordered states of IMUPayload_dtype.
+        Gives the same result as calling _update for each state in order, with the per-sample math vectorized.
+        Returns the estimated orientation after each of the N states
+        """
+        states = imu_states if self.prev_state is None else np.concatenate(([self.prev_state], imu_states))
+        orientations = np.full(len(imu_states), self.orientation, dtype=np.quaternion)
+
+        if len(states) > 1:
+            prev_states, next_states = states[:-1], states[1:]
+
+            # Timestamps are unsigned, convert before taking the difference
+            gyro_dt = (next_states['gyro_timestamp'].astype(np.int64) - prev_states['gyro_timestamp']) / 1e3
+
+            # The very first state only sets the previous state, so it keeps the initial orientation
+            orientations[len(imu_states) - len(prev_states):] = complementary_filter(
+                self.orientation,
+                prev_states['acc'].astype(np.float64),
+                prev_states['gyro'].astype(np.float64),
+                prev_states['mag'].astype(np.float64),
+                gyro_dt,
+                self.gyro_alpha)
+
+            self.orientation = orientations[-1]
+
+        self.prev_state = imu_states[-1]
+
+        return orientations
 
-    def _update(self, imu_state: IMUPayload):
+    def _update(self, imu_state: np.void):
         """
         Update the estimated orientation of the system based on sensor readings.
         This implementation combines a rotation estimate from integration of gyroscope rates and absolute orientation estimate from
-        tilt-compensated magnetometer readings. The impact of each term is controlled by the gyro_alpha coefficient
+        tilt-compensated magnetometer readings. The impact of each term is controlled by the gyro_alpha coefficient.
+        The state is a record of IMUPayload_dtype
         """
         normalize = lambda x: x / np.linalg.norm(x)
 
         if self.prev_state is not None:
-            acc_dt = (imu_state.acc_timestamp - self.prev_state.acc_timestamp) / 1e3
-            gyro_dt = (imu_state.gyro_timestamp - self.prev_state.gyro_timestamp) / 1e3
-            mag_dt = (imu_state.mag_timestamp - self.prev_state.mag_timestamp) / 1e3
+            # Timestamps are unsigned, convert before taking the difference
+            acc_dt = (int(imu_state['acc_timestamp']) - int(self.prev_state['acc_timestamp'])) / 1e3
+            gyro_dt = (int(imu_state['gyro_timestamp']) - int(self.prev_state['gyro_timestamp'])) / 1e3
+            mag_dt = (int(imu_state['mag_timestamp']) - int(self.prev_state['mag_timestamp'])) / 1e3
 
-            accel = np.array([self.prev_state.acc_x, self.prev_state.acc_y, self.prev_state.acc_z])
-            gyro = np.array([self.prev_state.gyro_x, self.prev_state.gyro_y, self.prev_state.gyro_z])
-            mag = np.array([self.prev_state.mag_x, self.prev_state.mag_y, self.prev_state.mag_z])
+            accel = self.prev_state['acc'].astype(np.float64)
+            gyro = self.prev_state['gyro'].astype(np.float64)
+            mag = self.prev_state['mag'].astype(np.float64)
 
             # Find the compass orientation based on accelerometer and tilt-compensated magnetometer readings
             up = -normalize(accel)
@@ -0,0 +1,258 @@
+import logging
+import os
+import signal
+import time
+from collections import deque
+from multiprocessing import Process
+from select import POLLOUT, POLLHUP
+from socket import socket, socketpair, AF_UNIX, SOCK_SEQPACKET
+
+from ..misc import setup_logging, Metrics
+from ..transport import OrientationTable, CaptureWriter, BatchMessage_max_count
+from .consumer import Consumer
+
+logger = logging.getLogger(__name__)
+
+# Frames held for a worker whose socket is full, the oldest are dropped beyond that
+Shard_backlog = 256
+
+class ShardWorker(Consumer):
+    """
+    Consumer owning the remote sensors of a single shard.
+    Receives the datagrams routed to it over a socket pair and publishes the estimated orientations
+    into the shared orientation table.
+    Stops when the front process closes its end of the pair or exits, even when it was killed
+    """
+    def __init__(self, sock: socket, orientation_table: OrientationTable, timeout_s: float, recv_batch: int = 64,
+                 max_batch: int = BatchMessage_max_count, metrics: Metrics | None = None):
+        self.shard_sock = sock
+        self.parent_pid = os.getppid()
+        self.running = True
+        super().__init__(f'shard socket {sock.fileno()}', timeout_s, False, recv_batch, orientation_table, max_batch,
+                         metrics)
+
+    def _open_consumer_sock(self) -> socket:
+        return self.shard_sock
+
+    def _recv_batch(self) -> int:
+        events = self.poller.poll(self._get_poll_timeout() * 1e3)
+
+        # The front process is gone, whatever it routed before has no one to report to
+        if any(event & POLLHUP for _, event in events) or os.getppid() != self.parent_pid:
+            logger.info('front process exited, stopping shard worker')
+            self.running = False
+            self.frame_sizes = []
+            return 0
+
+        if not events:
+            logger.debug('recv timeout')
+            self.frame_sizes = []
+            return 0
+
+        return self._drain_sock()
+
+    def run(self):
+        while self.running:
+            self._run_once()
+
+def _run_shard_worker(sock: socket, table_name: str, timeout_s: float, recv_batch: int, max_batch: int,
+                      log_level: str, metrics: Metrics | None):
+    setup_logging(log_level)
+
+    orientation_table = OrientationTable.attach(table_name)
+
+    try:
+        ShardWorker(sock, orientation_table, timeout_s, recv_batch, max_batch, metrics).run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        orientation_table.close()
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+class ShardedConsumer(Consumer):
+    """
+    Front process partitioning the senders across worker processes.
+    Datagrams are routed by the sender id in the SensorMessage header, so each worker owns the state of
+    every sender in its shard. Workers publish orientations back through the shared orientation table, which the
+    viewer process reads directly for visualization. A private table is created if none is given.
+    With metrics enabled every worker reports its own senders, dumping to the metrics file suffixed by the shard
+    """
+    def __init__(self, socket_path: str, timeout_s: float, shards: int, visualize: bool = False,
+                 recv_batch: int = 64, orientation_table: OrientationTable | None = None,
+                 max_batch: int = BatchMessage_max_count, log_level: str = 'INFO', frame_time: float = 1.0 / 60,
+                 metrics: Metrics | None = None, capture: CaptureWriter | None = None):
+        owns_table = orientation_table is None
+        super().__init__(socket_path, timeout_s, visualize, recv_batch,
+                         OrientationTable.create() if owns_table else orientation_table, max_batch, metrics,
+                         capture)
+        self.owns_table = owns_table
+        self.shards = shards
+        self.log_level = log_level
+        self.frame_time = frame_time
+
+        self.workers = []
+        self.worker_socks = []
+
+        # Frames waiting for the socket of each worker to drain, and the sockets, by their file descriptor
+        self.backlogs = dict()
+        self.socks_by_fd = dict()
+
+        # Number of frames dropped because the backlog of a worker was full
+        self.dropped = 0
+
+    def _open_worker_sock(self) -> socket:
+        """
+        Open the socket pair to the next worker, returns the end of the worker
+        """
+        # Sequenced packets keep the frame boundaries like datagrams, and tell the worker when the front is gone
+        front_sock, worker_sock = socketpair(AF_UNIX, SOCK_SEQPACKET)
+
+        # Packet queues of UNIX sockets are short, frames for a busy worker wait in its backlog instead
+        front_sock.setblocking(False)
+        self.backlogs[front_sock.fileno()] = deque()
+        self.socks_by_fd[front_sock.fileno()] = front_sock
+        self.worker_socks.append(front_sock)
+
+        return worker_sock
+
+    def _start_workers(self):
+        for i in range(self.shards):
+            worker_sock = self._open_worker_sock()
+
+            worker_metrics = None
+            if self.metrics is not None:
+                path = f'{self.metrics.path}.shard{i}' if self.metrics.path is not None else None
+                worker_metrics = Metrics(f'shard-{i}', self.metrics.interval, path)
+
+            worker = Process(
+                target=_run_shard_worker,
+                args=(worker_sock, self.orientation_table.name, self.timeout_s, self.recv_batch, self.max_batch,
+                      self.log_level, worker_metrics),
+                name=f'shard-{i}',
+                daemon=True)
+            worker.start()
+            worker_sock.close()
+
+            logger.info(f'started shard worker {i} pid:{worker.pid}')
+
+            self.workers.append(worker)
+
+    def _stop_workers(self):
+        for worker in self.workers:
+            worker.terminate()
+
+        for worker in self.workers:
+            worker.join()
+
+        for sock in self.worker_socks:
+            sock.close()
+
+    def _recv_batch(self) -> int:
+        """
+        Wait for datagrams or for the socket of a worker with a backlog to drain.
+        Returns the number of frames received
+        """
+        events = self.poller.poll(self._get_poll_timeout() * 1e3)
+        readable = False
+
+        for fd, event in events:
+            if fd == self.sock.fileno():
+                readable = True
+            elif event & POLLOUT:
+                self._flush_backlog(self.socks_by_fd[fd])
+
+        if not readable:
+            self.frame_sizes = []
+            return 0
+
+        return self._drain_sock()
+
+    def _flush_backlog(self, sock: socket):
+        """
+        Send the frames waiting for a worker until its socket is full again
+        """
+        backlog = self.backlogs[sock.fileno()]
+
+        while backlog:
+            try:
+                sock.send(backlog[0])
+            except BlockingIOError:
+                return
+
+            backlog.popleft()
+
+        self.poller.unregister(sock)
+
+    def _route_frame(self, sock: socket, frame: memoryview):
+        backlog = self.backlogs[sock.fileno()]
+
+        # Frames queued before keep their order
+        if not backlog:
+            try:
+                sock.send(frame)
+                return
+            except BlockingIOError:
+                self.poller.register(sock, POLLOUT)
+
+        # The ring is reused by the next wakeup, the backlog keeps its own copy
+        if len(backlog) == Shard_backlog:
+            backlog.popleft()
+            self.dropped += 1
+            logger.debug(f'dropped frame for shard socket {sock.fileno()}, total dropped:{self.dropped}')
+
+            if self.metrics is not None:
+                self.metrics.count('dropped')
+
+        backlog.append(bytes(frame))
+
+    def _route_messages(self, count: int):
+        """
+        Send every frame to the worker of its sender without waiting, a busy worker only delays its own shard
+        """
+        offset = 0
+
+        for size in self.frame_sizes:
+            # First byte of every frame header is the sender id
+            sender_id = self.ring[offset]
+            self._route_frame(self.worker_socks[sender_id % self.shards], self.ring_view[offset:offset + size])
+            offset += size
+
+    def run(self):
+        # Terminating the front process must stop the workers too, take the same way out as an interrupt
+        previous_handler = signal.signal(signal.SIGTERM, _raise_interrupt)
+        last_check_time = time.perf_counter()
+
+        try:
+            self._start_workers()
+            self._start_viewer()
+
+            while True:
+                count = self._recv_batch()
+                start_time = time.perf_counter() if self.metrics is not None or self.capture is not None else 0.0
+
+                # Captured before routing, the workers never see the frames of other shards
+                if self.capture is not None:
+                    self.capture.write(self.ring_view[:sum(self.frame_sizes)], self.frame_sizes, start_time)
+
+                self._route_messages(count)
+                now = time.perf_counter()
+
+                if self.metrics is not None:
+                    self.metrics.histogram('loop').record(now - start_time)
+                    self.metrics.count('routed', count)
+
+                    if self.metrics.is_due(now):
+                        self.metrics.report(now, {'shards': self.shards})
+
+                # Check on the workers once per timeout, a dead shard would silently drop its senders
+                if now - last_check_time >= self.timeout_s:
+                    for worker in self.workers:
+                        if not worker.is_alive():
+                            raise RuntimeError(f'shard worker {worker.name} exited with code {worker.exitcode}')
+
+                    last_check_time = now
+        finally:
+            self._stop_workers()
+            signal.signal(signal.SIGTERM, previous_handler)
@@ -0,0 +1,137 @@
+import logging
+import os
+import time
+from select import POLLIN
+from socket import recv_fds
+
+from ..misc import Metrics
+from ..transport import ShmRing, OrientationTable, CaptureWriter, BatchMessage_max_count
+from .broker import Broker
+from .orientation_history import OrientationHistory
+from .consumer import Consumer
+
+logger = logging.getLogger(__name__)
+
+class ShmConsumer(Consumer):
+    """
+    Consumer receiving messages over shared memory rings, one per publisher.
+    Publishers register their ring on the consumer socket, passing along an eventfd used to wake the
+    consumer when it's sleeping. Registrations are repeated by the publishers, so a restarted consumer
+    picks the rings up again
+    """
+    def __init__(self, socket_path: str, timeout_s: float, visualize: bool = False, recv_batch: int = 64,
+                 orientation_table: OrientationTable | None = None, max_batch: int = BatchMessage_max_count,
+                 metrics: Metrics | None = None, capture: CaptureWriter | None = None, broker: Broker | None = None,
+                 history: OrientationHistory | None = None):
+        super().__init__(socket_path, timeout_s, visualize, recv_batch, orientation_table, max_batch, metrics,
+                         capture, broker, history)
+
+        # Rings by the id of the sender writing them, rotated to share the batch fairly
+        self.rings = dict()
+        self.ring_order = []
+
+        # Registrations are also checked periodically, the consumer doesn't sleep while the rings are busy
+        self.last_registration_time = time.perf_counter()
+
+    def _accept_registrations(self):
+        while True:
+            try:
+                msg, fds, _, _ = recv_fds(self.sock, 256, 1)
+            except BlockingIOError:
+                break
+            except Exception as e:
+                logger.error(f'recv threw an exception {e}')
+                break
+
+            try:
+                sender_id, name = msg.decode().split()
+                sender_id = int(sender_id)
+            except ValueError:
+                logger.warning(f'ignoring malformed ring registration {msg}')
+                sender_id, name = None, None
+
+            ring = self.rings.get(sender_id)
+
+            # Already attached, registrations are repeated periodically
+            if sender_id is None or (ring is not None and ring.name == name):
+                for fd in fds:
+                    os.close(fd)
+                continue
+
+            # The publisher restarted with a new ring
+            if ring is not None:
+                self._remove_ring(sender_id)
+
+            ring = ShmRing.attach(name)
+            ring.eventfd = fds[0] if fds else None
+            self.rings[sender_id] = ring
+            self.ring_order.append(sender_id)
+
+            if ring.eventfd is not None:
+                self.poller.register(ring.eventfd, POLLIN)
+
+            logger.info(f'attached ring {name} of sender {sender_id}')
+
+    def _remove_ring(self, sender_id: int):
+        ring = self.rings.pop(sender_id)
+        self.ring_order.remove(sender_id)
+
+        if ring.eventfd is not None:
+            self.poller.unregister(ring.eventfd)
+
+        ring.close()
+
+    def _read_rings(self) -> int:
+        """
+        Copy pending messages from all rings back to back into the ring buffer, returns the number of frames copied
+        """
+        count = 0
+
+        for sender_id in self.ring_order:
+            count += self.rings[sender_id].read_into(self.ring_view[count * self.msg_size:], self.recv_batch - count)
+
+            if count == self.recv_batch:
+                break
+
+        # Rings only carry single messages
+        self.frame_sizes = [self.msg_size] * count
+
+        # Start with the next ring on the following call
+        if self.ring_order:
+            self.ring_order.append(self.ring_order.pop(0))
+
+        return count
+
+    def _recv_batch(self) -> int:
+        now = time.perf_counter()
+        if now - self.last_registration_time >= self.timeout_s:
+            self._accept_registrations()
+            self.last_registration_time = now
+
+        self._next_ring()
+
+        if count := self._read_rings():
+            return count
+
+        # Flag that we're going to sleep, then check once more so a message written in between isn't missed
+        for ring in self.rings.values():
+            ring.set_waiting(True)
+
+        events = [] if any(len(ring) for ring in self.rings.values()) else self.poller.poll(self._get_poll_timeout() * 1e3)
+
+        for ring in self.rings.values():
+            ring.set_waiting(False)
+
+        for fd, _ in events:
+            if fd == self.sock.fileno():
+                self._accept_registrations()
+            else:
+                try:
+                    os.eventfd_read(fd)
+                except BlockingIOError:
+                    pass
+
+        if not events:
+            logger.debug('recv timeout')
+
+        return self._read_rings()
@@ -1,2 +1,3 @@
 from .interval_timer import IntervalTimer
 from .logging_utils import setup_logging
+from .metrics import Metrics, LatencyHistogram
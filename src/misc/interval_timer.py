@@ -1,25 +1,54 @@
+import math
+import os
 import time
 
 class IntervalTimer:
     """
     A timer that aligns operations to a fixed repetition interval.
-    Uses sleep for longer waits and spins for short, precise adjustments.
+    With spin pacing it uses sleep for longer waits and spins for short, precise adjustments.
+    With sleep pacing it blocks until shortly before the deadline and spins only for the remaining wake-up slack,
+    which is calibrated from how late the wake-ups turn out. Blocking uses a timerfd armed with the absolute
+    deadline where available, otherwise a relative sleep.
+    A wait starting a whole interval or more past its deadline is counted as an overrun. The catch_up policy then
+    runs the missed ticks back to back, the skip policy drops them and continues with the next tick on the grid
     """
-    def __init__(self, frequency_hz: int):
+    def __init__(self, frequency_hz: int, pacing: str = 'spin', policy: str = 'catch_up'):
+        assert pacing in ('spin', 'sleep'), f'unknown pacing {pacing}'
+        assert policy in ('catch_up', 'skip'), f'unknown policy {policy}'
+
         self.interval = 1.0 / frequency_hz
         self.next_time = time.perf_counter()
         self.sleep_threshold = 0.004 # 4ms
+        self.pacing = pacing
+        self.policy = policy
+
+        # perf_counter reads CLOCK_MONOTONIC, so its values can be used as absolute timerfd deadlines
+        self.timerfd = None
+        if pacing == 'sleep' and hasattr(os, 'timerfd_create'):
+            self.timerfd = os.timerfd_create(time.CLOCK_MONOTONIC, flags=os.TFD_CLOEXEC)
+
+        # Wake-up slack for sleep pacing, tracks a high percentile of how late the wake-ups are
+        self.slack = 0.0002
+        self.slack_step = 0.00001
+        self.slack_percentile = 0.99
+
+        # Statistics
+        self.ticks = 0
+        self.overruns = 0       # waits starting at least a whole interval late
+        self.skipped = 0        # missed ticks dropped by the skip policy
+        self.jitter_sum = 0.0   # lateness of the ticks
+        self.jitter_sq_sum = 0.0
+        self.jitter_max = 0.0
 
     def reset(self):
         self.next_time = time.perf_counter()
 
-    def wait(self):
-        """
-        Wait until the next scheduled interval
-        """
-        now = time.perf_counter()
-        time_left = self.next_time - now
+    def close(self):
+        if self.timerfd is not None:
+            os.close(self.timerfd)
+            self.timerfd = None
 
+    def _spin_wait(self, time_left: float):
         if time_left > self.sleep_threshold:
             # Sleep for most of the duration, leaving a small buffer
             time.sleep(max(0, time_left - 0.0001))
@@ -32,4 +61,71 @@ class IntervalTimer:
             while time.perf_counter() < self.next_time:
                 pass
 
+    def _sleep_wait(self, time_left: float):
+        if time_left > self.slack:
+            wake_time = self.next_time - self.slack
+
+            if self.timerfd is not None:
+                os.timerfd_settime(self.timerfd, flags=os.TFD_TIMER_ABSTIME, initial=wake_time)
+                os.read(self.timerfd, 8)
+            else:
+                time.sleep(time_left - self.slack)
+
+            # Step up after waking past the deadline and slowly down otherwise, so the slack settles where
+            # the given share of wake-ups is in time. Unlike a mean, single long oversleeps barely move it
+            if time.perf_counter() > self.next_time:
+                self.slack += self.slack_step * self.slack_percentile
+            else:
+                self.slack -= self.slack_step * (1 - self.slack_percentile)
+
+            self.slack = min(max(self.slack, 0), self.sleep_threshold)
+
+        while time.perf_counter() < self.next_time:
+            pass # Spin for the slack
+
+    def wait(self):
+        """
+        Wait until the next scheduled interval
+        """
+        now = time.perf_counter()
+        time_left = self.next_time - now
+
+        if -time_left >= self.interval:
+            missed = math.floor(-time_left / self.interval)
+            self.overruns += 1
+
+            # Continue with the latest tick on the grid, the current one fires right away
+            if self.policy == 'skip':
+                self.next_time += missed * self.interval
+                self.skipped += missed
+                time_left = self.next_time - now
+
+        if self.pacing == 'spin':
+            self._spin_wait(time_left)
+        else:
+            self._sleep_wait(time_left)
+
+        jitter = time.perf_counter() - self.next_time
+        self.ticks += 1
+        self.jitter_sum += jitter
+        self.jitter_sq_sum += jitter * jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+
         self.next_time += self.interval
+
+    def get_stats(self) -> dict:
+        """
+        Overrun counts and the mean, standard deviation and maximum of the tick lateness in seconds
+        """
+        ticks = max(self.ticks, 1)
+        jitter_mean = self.jitter_sum / ticks
+
+        return {
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'jitter_mean': jitter_mean,
+            'jitter_std': math.sqrt(max(self.jitter_sq_sum / ticks - jitter_mean * jitter_mean, 0)),
+            'jitter_max': self.jitter_max,
+            'slack': self.slack,
+        }
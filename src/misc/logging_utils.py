@@ -1,9 +1,48 @@
+import atexit
 import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# Records are queued by the logging threads and written by a listener thread, one per process
+_queue_handler = None
+_listener = None
+
+def _start_listener(*handlers: logging.Handler):
+    global _listener
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler.queue = log_queue
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+def _restart_listener():
+    # Forked children don't inherit the listener thread, records queued before the fork belong to the parent
+    if _listener is not None:
+        _start_listener(*_listener.handlers)
+
+def _stop_listener():
+    global _listener
+
+    # Writes out whatever is still queued
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def _register_child_finalizer(_):
+    from multiprocessing.util import Finalize
+
+    # Runs after the other finalizers of the child, which may still log
+    Finalize(None, _stop_listener, exitpriority=-100)
 
 def setup_logging(log_level):
     """
-    Configure logging based on the specified log level
+    Configure logging based on the specified log level.
+    Records are handed through a queue to a background thread which formats and writes them, so logging never
+    waits on stderr. Forked processes start their own thread, which is drained when they exit
     """
+    global _queue_handler
+
     numeric_level = {
         'DEBUG': logging.DEBUG,
         'INFO': logging.INFO,
@@ -12,8 +51,25 @@ def setup_logging(log_level):
         'CRITICAL': logging.CRITICAL
     }.get(log_level.upper(), logging.INFO)
 
-    logging.basicConfig(
-        level=numeric_level,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
+    logging.getLogger().setLevel(numeric_level)
+
+    # Already set up in this process or in the parent it was forked from
+    if _queue_handler is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(
+        fmt='%(asctime)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'))
+
+    _queue_handler = QueueHandler(None)
+    _start_listener(stream_handler)
+    logging.getLogger().addHandler(_queue_handler)
+
+    atexit.register(_stop_listener)
+    os.register_at_fork(after_in_child=_restart_listener)
+
+    # Children started by multiprocessing leave with os._exit and skip atexit, but run the finalizers registered
+    # after they were forked
+    from multiprocessing.util import register_after_fork
+    register_after_fork(_queue_handler, _register_child_finalizer)
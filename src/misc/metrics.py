@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class LatencyHistogram:
+    """
+    HDR style histogram of durations with microsecond resolution.
+    Values below 2^(precision_bits + 1) us get their own bucket, above that every power of two range is split
+    into 2^precision_bits linear buckets, so the relative error stays below 2^-precision_bits at any magnitude
+    """
+    def __init__(self, precision_bits: int = 5, max_value_s: float = 100.0):
+        self.precision_bits = precision_bits
+        self.max_value_us = int(max_value_s * 1e6)
+        self.counts = np.zeros(self._bucket(np.array([self.max_value_us]))[0] + 1, dtype=np.int64)
+        self.total = 0
+        self.max = 0
+
+    def _bucket(self, values_us: np.ndarray) -> np.ndarray:
+        # frexp gives the bit length of each value as its exponent
+        shift = np.maximum(np.frexp(values_us)[1] - self.precision_bits - 1, 0)
+        return (shift << self.precision_bits) + (values_us >> shift)
+
+    def _bucket_value(self, bucket: int) -> int:
+        shift = max((bucket >> self.precision_bits) - 1, 0)
+        return (bucket - (shift << self.precision_bits)) << shift
+
+    def record(self, value_s: float):
+        # Plain python for single values, building an array costs more than the bucketing
+        value_us = min(max(int(value_s * 1e6), 0), self.max_value_us)
+        shift = max(value_us.bit_length() - self.precision_bits - 1, 0)
+        self.counts[(shift << self.precision_bits) + (value_us >> shift)] += 1
+        self.total += 1
+        self.max = max(self.max, value_us)
+
+    def record_many(self, values_s: np.ndarray):
+        values_us = np.clip(np.asarray(values_s) * 1e6, 0, self.max_value_us).astype(np.int64)
+
+        if len(values_us) == 0:
+            return
+
+        self.counts += np.bincount(self._bucket(values_us), minlength=len(self.counts))
+        self.total += len(values_us)
+        self.max = max(self.max, int(values_us.max()))
+
+    def percentile(self, p: float) -> float:
+        """
+        Lower bound of the bucket holding the p-th percentile, in seconds
+        """
+        if self.total == 0:
+            return 0.0
+
+        bucket = int(np.searchsorted(np.cumsum(self.counts), self.total * p / 100.0))
+        return self._bucket_value(bucket) / 1e6
+
+    def summary(self) -> dict:
+        return {
+            'count': self.total,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max / 1e6,
+        }
+
+    def reset(self):
+        self.counts[:] = 0
+        self.total = 0
+        self.max = 0
+
+class Metrics:
+    """
+    Collects counters and latency histograms and reports them periodically, as one compact log line and
+    optionally as a JSON dump to a file for other tools to pick up.
+    Components take an optional Metrics instance and skip all collection when it's None.
+    Histograms cover the last report interval, counters are cumulative
+    """
+    def __init__(self, name: str, interval: float = 5.0, path: str | None = None):
+        self.name = name
+        self.interval = interval
+        self.path = path
+        self.histograms = dict()
+        self.counters = dict()
+        self.last_report_time = time.perf_counter()
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        if name not in self.histograms:
+            self.histograms[name] = LatencyHistogram()
+
+        return self.histograms[name]
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def is_due(self, now: float) -> bool:
+        return now - self.last_report_time >= self.interval
+
+    def report(self, now: float, stats: dict | None = None, senders: dict | None = None):
+        """
+        Log the summary and dump it to the file if set, then start a new interval.
+        Stats are extra values reported by the owner, e.g. gauges or totals, senders holds per sender stats
+        """
+        histograms = {name: histogram.summary() for name, histogram in self.histograms.items()}
+
+        parts = [f'{name}:{value}' for name, value in self.counters.items()]
+        parts += [f'{name}:{value}' for name, value in (stats or {}).items()]
+        parts += [f'{name} p50:{s["p50"] * 1e3:.2f}ms p99:{s["p99"] * 1e3:.2f}ms' for name, s in histograms.items()]
+        logger.info(f'{self.name} metrics {" ".join(parts)}')
+
+        if self.path is not None:
+            self._dump({
+                'name': self.name,
+                'interval': now - self.last_report_time,
+                'counters': self.counters,
+                'stats': stats or {},
+                'histograms': histograms,
+                'senders': senders or {},
+            })
+
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+        self.last_report_time = now
+
+    def _dump(self, stats: dict):
+        # Write then rename so readers never see a partial file
+        tmp_path = f'{self.path}.tmp'
+
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(stats, f)
+
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f'failed to write metrics to {self.path} {e}')
@@ -0,0 +1,27 @@
+import sys
+
+def load_quaternion():
+    """
+    Import numpy-quaternion without its optional spline support.
+    At load it tries to import scipy.interpolate for the spline based derivatives and integrals, which makes up
+    most of the startup time of the entry points and isn't used here. Blocking that import only while quaternion
+    loads makes it fall back to finite differences, scipy.interpolate can still be imported normally afterwards
+    """
+    if 'quaternion' in sys.modules:
+        return sys.modules['quaternion']
+
+    # A None entry makes the import fail with ImportError, which quaternion handles
+    blocked = 'scipy.interpolate' not in sys.modules
+
+    if blocked:
+        sys.modules['scipy.interpolate'] = None
+
+    try:
+        import quaternion
+    finally:
+        if blocked:
+            del sys.modules['scipy.interpolate']
+
+    return quaternion
+
+quat = load_quaternion()
@@ -0,0 +1,87 @@
+import numpy as np
+
+from ..misc.quaternion_loader import quat
+from ..transport import IMUPayload_dtype
+
+class FleetSimulator:
+    """
+    Simulates a fleet of independent devices performing the same random motion as IMUSimulator, stepping all of
+    them at once with quaternion arrays.
+    Samples are generated ahead in chunks of chunk_size steps from noise blocks drawn at once, each call to next
+    returns the next step of every device as an array of IMUPayload_dtype with the timestamps left at zero
+    """
+
+    def __init__(self, devices: int, time_step: float, chunk_size: int = 256, seed: int | None = None,
+                 max_angular_vel: float = np.pi / 4, accel_noise: float = 0.05, gyro_noise: float = 0.01,
+                 mag_noise: float = 10):
+        self.devices = devices
+        self.dt = time_step
+        self.chunk_size = chunk_size
+        self.rng = np.random.default_rng(seed)
+
+        self.gravity = np.array([0, -9.81, 0])          # m/s^2
+        self.magnetic_field = np.array([0, 400, -200])  # mGauss
+
+        # Limits the maximum angular velocity
+        self.max_angular_vel = max_angular_vel
+        self.max_angular_accel = max_angular_vel * 10  # rad/s^2
+
+        # Sensor noise levels
+        self.accel_noise = accel_noise  # m/s^2
+        self.gyro_noise = gyro_noise    # rad/s
+        self.mag_noise = mag_noise      # mGauss
+
+        # State at the end of the last generated chunk
+        self.current_orientation = quat.as_quat_array(np.tile([1.0, 0, 0, 0], (devices, 1)))
+        self.current_angular_vel = np.zeros((devices, 3))
+
+        # Generated chunk, the orientation of every step and the index of the next step to return
+        self.chunk = None
+        self.chunk_orientations = None
+        self.index = chunk_size
+
+        # Orientation of every device at the last returned step
+        self.orientation = self.current_orientation
+
+    def _generate_chunk(self):
+        shape = (self.chunk_size, self.devices, 3)
+        angular_accel = self.rng.normal(0, self.max_angular_accel, shape)
+
+        angular_vels = np.empty(shape)
+        orientations = np.empty((self.chunk_size, self.devices), dtype=np.quaternion)
+
+        # Velocities are clamped at every step, so only the devices are vectorized, not the steps
+        angular_vel = self.current_angular_vel
+        orientation = self.current_orientation
+
+        for i in range(self.chunk_size):
+            angular_vel = np.clip(angular_vel + angular_accel[i] * self.dt, -self.max_angular_vel, self.max_angular_vel)
+            orientation = quat.from_rotation_vector(angular_vel * self.dt) * orientation
+
+            angular_vels[i] = angular_vel
+            orientations[i] = orientation
+
+        self.current_angular_vel = angular_vel
+        self.current_orientation = orientation
+
+        chunk = np.zeros((self.chunk_size, self.devices), dtype=IMUPayload_dtype)
+        chunk['acc'] = quat.rotate_vectors(orientations, self.gravity) + self.rng.normal(0, self.accel_noise, shape)
+        chunk['gyro'] = angular_vels + self.rng.normal(0, self.gyro_noise, shape)
+        chunk['mag'] = quat.rotate_vectors(orientations, self.magnetic_field) + self.rng.normal(0, self.mag_noise, shape)
+
+        self.chunk = chunk
+        self.chunk_orientations = orientations
+        self.index = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> np.ndarray:
+        if self.index == self.chunk_size:
+            self._generate_chunk()
+
+        imu_states = self.chunk[self.index]
+        self.orientation = self.chunk_orientations[self.index]
+        self.index += 1
+
+        return imu_states
@@ -1,29 +1,176 @@
 import argparse
 import logging
+import os
 import time
-from socket import socket, AF_UNIX, SOCK_DGRAM
+import numpy as np
+from array import array
+from socket import socket, AF_UNIX, SOCK_DGRAM, SOL_SOCKET, SCM_RIGHTS
 
-from ..misc import setup_logging, IntervalTimer
-from ..transport import SensorMessage, IMUPayload, IMUPayload_size, pack_imu_payload
+from ..misc import setup_logging, IntervalTimer, Metrics
+from ..transport import SensorMessage, BatchMessage, IMUPayload_size, ShmRing, pack_imu_payload_into
+from ..transport import SensorMessage_dtype, OrientationTable, BatchMessage_max_count
+from ..transport import CompactMessage, CompactMessage_dtype, CompactPayload_size, COMPACT_FLAG, COMPACT_VERSION
+from ..transport import pack_compact_payload_into, encode_compact_payloads, timestamp_ms
+from ..transport import CompactPayload_default_scales, CompactPayload_max_dt
 from .imu_simulator import IMUSimulator
-from ..visualization import OrientationPreview
+from .fleet_simulator import FleetSimulator
 
 logger = logging.getLogger(__name__)
 
 class Publisher:
-    def __init__(self, socket_path: str, sender_id: int, frequency_hz: int, visualize: bool):
+    def __init__(self, socket_path: str, sender_id: int, frequency_hz: int, visualize: bool, transport: str = 'socket',
+                 register_interval: float = 1.0, batch_size: int = 1, batch_latency: float = 0.01,
+                 metrics: Metrics | None = None, senders: int = 1, seed: int | None = None, pacing: str = 'spin',
+                 timer_policy: str = 'catch_up', payload: str = 'full'):
         self.socket_path = socket_path
         self.sender_id = sender_id
         self.frequency_hz = frequency_hz
         self.visualize = visualize
+        self.transport = transport
+
+        # With more than one sender a fleet of devices is simulated, with ids starting at sender_id
+        self.senders = senders
+        self.seed = seed
+
+        # Payloads are sent in full or in the compact fixed-point format, consumers accept both
+        assert payload in ('full', 'compact'), f'unknown payload {payload}'
+        self.payload = payload
+
+        # How the interval timer waits and handles missed ticks
+        self.pacing = pacing
+        self.timer_policy = timer_policy
+
+        # Metrics are only collected when enabled
+        self.metrics = metrics
+
+        # Sends are logged as a summary every interval instead of one record per message
+        self.summary_interval = 5.0
+        self.last_summary_time = 0.0
+        self.summary_sent = 0
+        self.summary_errors = 0
+
+        # Payloads are coalesced into batch frames flushed when full or when the oldest would wait too long
+        self.batch_size = batch_size
+        self.batch_latency = batch_latency
 
         self.sock = self._open_publisher_sock()
+        self.ring = self._open_publisher_ring() if transport == 'shm' else None
+
+        # Ring registrations are repeated so a restarted consumer finds the ring again
+        self.register_interval = register_interval
+        self.last_register_time = None
+
+        # The simulated orientations are drawn by a viewer process from a private orientation table,
+        # written at the frame rate of the viewer rather than the send rate
+        self.orientation_table = OrientationTable.create() if visualize else None
+        self.frame_time = 1.0 / 60
+        self.last_frame_time = 0.0
+        self.viewer = None
+
+        # Interval timer of the send loop, it holds a timerfd until closed
+        self.timer = None
 
     def _open_publisher_sock(self) -> socket:
         return socket(AF_UNIX, SOCK_DGRAM, 0)
 
+    def _open_publisher_ring(self) -> ShmRing:
+        ring = ShmRing.create(len(SensorMessage(IMUPayload_size).get_buffer()))
+        ring.eventfd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        logger.info(f'created ring {ring.name}')
+
+        return ring
+
+    def _register_ring(self):
+        """
+        Announce the ring to the consumer, passing along the eventfd for wakeups
+        """
+        self.last_register_time = time.perf_counter()
+
+        try:
+            # socket.send_fds ignores the address, so build the control message directly
+            self.sock.sendmsg(
+                [f'{self.sender_id} {self.ring.name}'.encode()],
+                [(SOL_SOCKET, SCM_RIGHTS, array('i', [self.ring.eventfd]))],
+                0,
+                self.socket_path)
+        except Exception as e:
+            logger.debug(f'ring registration failed {e}')
+
+    def _send(self, buf: bytearray):
+        if self.ring is None:
+            self.sock.sendto(buf, self.socket_path)
+            return
+
+        if self.last_register_time is None or time.perf_counter() - self.last_register_time >= self.register_interval:
+            self._register_ring()
+
+        if not self.ring.write(buf):
+            logger.debug(f'ring full, dropped:{self.ring.dropped}')
+
+            if self.metrics is not None:
+                self.metrics.count('ring_dropped')
+
+    def _report_metrics(self, now: float, timer: IntervalTimer, seq_num: int):
+        timer_stats = timer.get_stats()
+
+        self.metrics.report(now, {
+            'seq_num': seq_num,
+            'overruns': timer_stats['overruns'],
+            'skipped': timer_stats['skipped'],
+            'jitter_std_us': round(timer_stats['jitter_std'] * 1e6, 1),
+        })
+
+    def _start_viewer(self):
+        # Create visualization if enabled
+        if self.visualize:
+            from ..visualization import start_viewer
+            self.viewer = start_viewer(self.orientation_table.name, f'Publisher {self.sender_id}', self.frame_time)
+
+    def _update_visualization(self, orientations, seq_num: int):
+        """
+        Publish the orientations of the simulated devices, indexed from sender_id, once per frame of the viewer
+        """
+        now = time.perf_counter()
+
+        if now - self.last_frame_time < self.frame_time:
+            return
+
+        self.last_frame_time = now
+        timestamp = timestamp_ms(now)
+
+        for i, orientation in enumerate(orientations):
+            self.orientation_table.write(self.sender_id + i, orientation, seq_num, timestamp)
+
+    def close(self):
+        if self.viewer is not None:
+            self.viewer.terminate()
+            self.viewer.join()
+            self.viewer = None
+
+        if self.timer is not None:
+            self.timer.close()
+            self.timer = None
+
+        if self.orientation_table is not None:
+            self.orientation_table.close()
+
+        if self.ring is not None:
+            self.ring.close()
+
+        self.sock.close()
+
     def run(self):
-        sensor_msg = SensorMessage(IMUPayload_size)
+        if self.senders > 1:
+            self._run_fleet()
+            return
+
+        compact = self.payload == 'compact'
+        sensor_msg = CompactMessage() if compact else SensorMessage(IMUPayload_size)
+        body_size = CompactPayload_size if compact else IMUPayload_size
+        batch_msg = BatchMessage(body_size, self.batch_size, compact) if self.batch_size > 1 else None
+        batch_first_seq = 0
+        batch_start_time = 0
+        batch_timestamp = 0
 
         # Sequence number for keeping track of message order
         seq_num = 0
@@ -32,46 +179,209 @@ class Publisher:
         # Simulator for generating IMU data
         imu_simulator = IMUSimulator(time_step=(1.0 / self.frequency_hz))
 
-        if self.visualize:
-            orientation_preview = OrientationPreview(f'Publisher {self.sender_id}')
+        self._start_viewer()
 
         # Timer for sending messages at the specified frequency
-        timer = IntervalTimer(self.frequency_hz)
+        timer = self.timer = IntervalTimer(self.frequency_hz, self.pacing, self.timer_policy)
         timer.reset()
 
+        # Log messages are only formatted when their level is enabled
+        log_debug = logger.isEnabledFor(logging.DEBUG)
+        self.last_summary_time = time.perf_counter()
+
         while True:
             imu_state = next(imu_simulator)
-            logger.debug(f'next imu state {imu_state}')
+
+            if log_debug:
+                logger.debug(f'next imu state {imu_state}')
 
             # Update the orientation preview if enabled
             if self.visualize:
-                orientation_preview.update(imu_simulator.orientation)
+                self._update_visualization([imu_simulator.orientation], seq_num)
+
+            # All readings of a sample share one timestamp
+            now = time.perf_counter()
+            timestamp = timestamp_ms(now)
+
+            # Pack the payload in place into the frame that is sent, compact payloads are timed relative to their
+            # frame, which holds the timestamp of the first one
+            if batch_msg is None:
+                body = sensor_msg.get_body()
+
+                if compact:
+                    sensor_msg.pack_compact_header(timestamp)
+            else:
+                if len(batch_msg) == 0:
+                    batch_first_seq = seq_num
+
+                    if compact:
+                        batch_msg.pack_compact_header(timestamp)
+                        batch_timestamp = timestamp
+
+                body = batch_msg.next_body()
+
+            if compact:
+                dt = (timestamp - batch_timestamp) & 0xFFFFFFFF if batch_msg is not None else 0
+                pack_compact_payload_into(body, 0, *imu_state, min(dt, CompactPayload_max_dt))
+            else:
+                pack_imu_payload_into(body, 0, *imu_state, timestamp)
+
+            # Wait for the interval timer to signal
+            timer.wait()
+
+            if self.metrics is not None:
+                wake_time = time.perf_counter()
+                self.metrics.histogram('timer_lateness').record(wake_time - (timer.next_time - timer.interval))
+
+            if batch_msg is None:
+                sensor_msg.pack_header(self.sender_id, seq_num)
+                buf = sensor_msg.get_buffer()
+            else:
+                if len(batch_msg) == 1:
+                    batch_start_time = time.perf_counter()
+
+                buf = None
+
+                # Flush when full or when the next sample would be due past the latency deadline
+                if batch_msg.is_full() or timer.next_time - batch_start_time >= self.batch_latency:
+                    buf = batch_msg.pack(self.sender_id, batch_first_seq)
+                    batch_msg.clear()
+
+            if buf is not None:
+                if log_debug:
+                    logger.debug(f'sending message seq:{seq_num} {buf}')
 
-            packed_payload = pack_imu_payload(IMUPayload(
-                *imu_state[0],
-                int(time.perf_counter() * 1000),
-                *imu_state[1],
-                int(time.perf_counter() * 1000),
-                *imu_state[2],
-                int(time.perf_counter() * 1000),
-            ))
+                try:
+                    self._send(buf)
+                    self.summary_sent += 1
 
-            # Pack the payload into a sensor message
-            sensor_msg.pack(self.sender_id, seq_num, packed_payload)
-            buf = sensor_msg.get_buffer()
+                    if self.metrics is not None:
+                        self.metrics.count('sent')
+                except Exception as e:
+                    self._send_failed(e)
+
+                    if self.metrics is not None:
+                        self.metrics.count('send_errors')
+
+            if now - self.last_summary_time >= self.summary_interval:
+                self._log_summary(now, seq_num)
+
+            # Time spent packing and sending after the timer woke up
+            if self.metrics is not None:
+                now = time.perf_counter()
+                self.metrics.histogram('loop').record(now - wake_time)
+
+                if self.metrics.is_due(now):
+                    self._report_metrics(now, timer, seq_num)
+
+            # Increment the sequence number with modulo
+            seq_num = (seq_num + 1) & seq_wrap
+
+    def _send_failed(self, e: Exception):
+        # Only the first failure of an interval is logged in full, sends keep failing e.g. while the consumer is down
+        if self.summary_errors == 0:
+            logger.error(f'send threw an exception {e}')
+
+        self.summary_errors += 1
+
+    def _log_summary(self, now: float, seq_num: int):
+        """
+        Log the send rate since the last summary, and how many more sends failed after the first one was logged
+        """
+        elapsed = now - self.last_summary_time
+        ids = self.sender_id if self.senders == 1 else f'{self.sender_id}-{self.sender_id + self.senders - 1}'
+
+        logger.info(f'sender {ids}: {self.summary_sent / elapsed:.0f} msgs/s, seq:{seq_num}')
+
+        if self.summary_errors > 1:
+            logger.error(f'sender {ids}: {self.summary_errors - 1} more sends failed in {elapsed:.1f}s')
+
+        self.summary_sent = 0
+        self.summary_errors = 0
+        self.last_summary_time = now
+
+    def _run_fleet(self):
+        """
+        Send the samples of all simulated devices on every tick, each as a single message of its own sender id
+        """
+        fleet_simulator = FleetSimulator(self.senders, 1.0 / self.frequency_hz, seed=self.seed)
+
+        # Messages of all devices are packed in place and sent from views into one buffer
+        compact = self.payload == 'compact'
+        msgs = np.zeros(self.senders, dtype=CompactMessage_dtype if compact else SensorMessage_dtype)
+        msgs['id'] = np.arange(self.sender_id, self.sender_id + self.senders)
+        msgs_view = memoryview(msgs.view(np.uint8))
+        msg_size = msgs.dtype.itemsize
+
+        if compact:
+            msgs['flags'] = COMPACT_FLAG | COMPACT_VERSION
+            msgs['scales'] = CompactPayload_default_scales
+        bufs = [msgs_view[i * msg_size:(i + 1) * msg_size] for i in range(self.senders)]
+
+        payloads = msgs['payload']
+        seq_num = 0
+        seq_wrap = (1 << 32) - 1 # UINT32_MAX
+
+        self._start_viewer()
+
+        timer = self.timer = IntervalTimer(self.frequency_hz, self.pacing, self.timer_policy)
+        timer.reset()
+
+        log_debug = logger.isEnabledFor(logging.DEBUG)
+        self.last_summary_time = time.perf_counter()
+
+        while True:
+            imu_states = next(fleet_simulator)
+
+            # Update the orientation preview if enabled
+            if self.visualize:
+                self._update_visualization(fleet_simulator.orientation, seq_num)
 
             # Wait for the interval timer to signal
             timer.wait()
 
-            if logger.getEffectiveLevel() > logging.DEBUG:
-                logger.info(f'sending message seq:{seq_num}')
+            if self.metrics is not None:
+                wake_time = time.perf_counter()
+                self.metrics.histogram('timer_lateness').record(wake_time - (timer.next_time - timer.interval))
+
+            # All samples of a tick share the timestamp
+            timestamp = timestamp_ms(time.perf_counter())
+
+            if compact:
+                msgs['timestamp'] = timestamp
+                payloads[:] = encode_compact_payloads(imu_states)
             else:
-                logger.debug(f'sending message seq:{seq_num} {buf}')
+                payloads[:] = imu_states
+                payloads['acc_timestamp'] = timestamp
+                payloads['gyro_timestamp'] = timestamp
+                payloads['mag_timestamp'] = timestamp
+            msgs['seq_num'] = seq_num
+
+            if log_debug:
+                logger.debug(f'sending {self.senders} messages seq:{seq_num}')
+            sent = 0
+
+            for buf in bufs:
+                try:
+                    self._send(buf)
+                    sent += 1
+                except Exception as e:
+                    self._send_failed(e)
+
+            self.summary_sent += sent
 
-            try:
-                self.sock.sendto(buf, self.socket_path)
-            except Exception as e:
-                logger.error(f'send threw an exception {e}')
+            if self.metrics is not None:
+                self.metrics.count('sent', sent)
+                self.metrics.count('send_errors', self.senders - sent)
+
+                now = time.perf_counter()
+                self.metrics.histogram('loop').record(now - wake_time)
+
+                if self.metrics.is_due(now):
+                    self._report_metrics(now, timer, seq_num)
+
+            if (now := time.perf_counter()) - self.last_summary_time >= self.summary_interval:
+                self._log_summary(now, seq_num)
 
             # Increment the sequence number with modulo
             seq_num = (seq_num + 1) & seq_wrap
@@ -89,12 +399,58 @@ def main():
         type=int,
         default=0,
         help='set the identity of the sender (default: 0)')
+    parser.add_argument('--senders',
+        type=int,
+        default=1,
+        help='simulate this many devices with consecutive ids starting at --sender-id (default: 1)')
+    parser.add_argument('--seed',
+        type=int,
+        default=None,
+        help='set the seed of the simulated fleet (default: random)')
+    parser.add_argument('--transport',
+        default='socket',
+        choices=['socket', 'shm'],
+        help='send over the UNIX socket or over a shared memory ring registered on it (default: socket)')
+    parser.add_argument('--payload',
+        default='full',
+        choices=['full', 'compact'],
+        help='send full float payloads or compact fixed-point ones, socket transport only (default: full)')
+    parser.add_argument('--pacing',
+        default='spin',
+        choices=['spin', 'sleep'],
+        help='spin for the last few ms of every interval, or sleep and spin only for a calibrated slack (default: spin)')
+    parser.add_argument('--timer-policy',
+        default='catch_up',
+        choices=['catch_up', 'skip'],
+        help='send missed ticks back to back or skip them (default: catch_up)')
+    parser.add_argument('--batch-size',
+        default=1,
+        type=int,
+        help='coalesce up to this many payloads into a single datagram, consumers accept up to their --max-batch '
+             f'(default: 1, no batching, at most {BatchMessage_max_count})')
+    parser.add_argument('--batch-latency-ms',
+        default=10,
+        type=float,
+        help='set the longest a payload may wait in a batch before it is flushed (default: 10)')
     parser.add_argument('--visualize',
         type=bool,
         default=False,
         const=True,
         nargs='?',
-        help='show a 3D visualization of the orientation (default: False)')
+        help='show the simulated orientations in a separate viewer process (default: False)')
+    parser.add_argument('--metrics',
+        type=bool,
+        default=False,
+        const=True,
+        nargs='?',
+        help='collect send and timing metrics and log a summary periodically (default: False)')
+    parser.add_argument('--metrics-interval-s',
+        default=5.0,
+        type=float,
+        help='set the interval between metrics summaries (default: 5)')
+    parser.add_argument('--metrics-file',
+        default=None,
+        help='also dump the metrics as JSON to this file every interval, implies --metrics')
     parser.add_argument(
         '--log-level',
         default='INFO',
@@ -103,16 +459,53 @@ def main():
 
     args = parser.parse_args()
 
+    if not 0 < args.batch_size <= BatchMessage_max_count:
+        parser.error(f'--batch-size must be between 1 and {BatchMessage_max_count}')
+
+    if args.batch_size > 1 and args.transport == 'shm':
+        parser.error('--batch-size is only supported with --transport socket')
+
+    if args.payload == 'compact' and args.transport == 'shm':
+        parser.error('--payload compact is only supported with --transport socket')
+
+    # Compact payloads store their time within the batch in 16 bits of milliseconds
+    if args.payload == 'compact' and args.batch_latency_ms >= CompactPayload_max_dt // 2:
+        parser.error(f'--batch-latency-ms must be below {CompactPayload_max_dt // 2} with --payload compact')
+
+    if args.senders > 1 and args.batch_size > 1:
+        parser.error('--batch-size is not supported together with --senders')
+
+    if not 0 < args.senders <= 256 - args.sender_id:
+        parser.error('sender ids of the fleet must fit in 8 bits')
+
     setup_logging(args.log_level)
 
     logger.debug(f'socket path: {args.socket_path}')
     logger.debug(f'frequency: {args.frequency_hz}Hz')
     logger.debug(f'sender_id: {args.sender_id}')
+    logger.debug(f'senders: {args.senders}')
+    logger.debug(f'pacing: {args.pacing} timer policy: {args.timer_policy}')
+    logger.debug(f'transport: {args.transport}')
+    logger.debug(f'payload: {args.payload}')
+    logger.debug(f'batch size: {args.batch_size}')
+    logger.debug(f'batch latency: {args.batch_latency_ms}ms')
+
+    publisher = None
+    metrics = None
+
+    if args.metrics or args.metrics_file is not None:
+        metrics = Metrics(f'publisher {args.sender_id}', args.metrics_interval_s, args.metrics_file)
 
     try:
-        publisher = Publisher(args.socket_path, args.sender_id, args.frequency_hz, args.visualize)
+        publisher = Publisher(args.socket_path, args.sender_id, args.frequency_hz, args.visualize, args.transport,
+                              batch_size=args.batch_size, batch_latency=args.batch_latency_ms / 1e3, metrics=metrics,
+                              senders=args.senders, seed=args.seed, pacing=args.pacing,
+                              timer_policy=args.timer_policy, payload=args.payload)
         publisher.run()
     except KeyboardInterrupt:
         pass
     except Exception as e:
         logger.error(e)
+    finally:
+        if publisher is not None:
+            publisher.close()
@@ -0,0 +1,248 @@
+import argparse
+import logging
+import time
+import numpy as np
+from socket import socket, AF_UNIX, SOCK_DGRAM
+
+from ..misc import setup_logging
+from ..misc.quaternion_loader import quat
+from ..transport import CaptureReader, SensorMessage_dtype
+from ..consumer.remote_sensor import RemoteSensor
+from ..consumer.message_queue import Window_capacity
+
+logger = logging.getLogger(__name__)
+
+# Orientation estimated after every reprocessed message
+Replay_dtype = np.dtype([
+    ('sender_id', 'u1'),
+    ('seq_num', '<u4'),
+    ('timestamp', '<u4'),
+    ('orientation', '<f8', (4,)),
+])
+
+def replay_to_socket(reader: CaptureReader, socket_path: str, speed: float = 1.0, start: int = 0,
+                     end: int | None = None) -> int:
+    """
+    Re-send the captured messages through the socket, keeping the original gaps between receive times
+    divided by speed, or as fast as possible when speed is 0. Returns the number of messages sent
+    """
+    end = len(reader) if end is None else end
+    recv_times = reader.records['recv_time']
+    buffer = reader.get_message_buffer()
+    msg_size = SensorMessage_dtype.itemsize
+    sock = socket(AF_UNIX, SOCK_DGRAM, 0)
+    sent = 0
+
+    start_time = time.perf_counter()
+    first_recv_time = recv_times[start] if end > start else 0.0
+
+    try:
+        for i in range(start, end):
+            # Messages of one wakeup share the receive time and are sent back to back
+            if speed > 0:
+                time_left = start_time + (recv_times[i] - first_recv_time) / speed - time.perf_counter()
+
+                if time_left > 0:
+                    time.sleep(time_left)
+
+            offset = reader.get_message_offset(i)
+
+            try:
+                sock.sendto(buffer[offset:offset + msg_size], socket_path)
+                sent += 1
+            except OSError as e:
+                logger.error(f'send threw an exception {e}')
+    finally:
+        buffer.release()
+        sock.close()
+
+    return sent
+
+def _order_messages(messages: np.ndarray, last_seq_num: int | None, seq_wrap: int) -> tuple[np.ndarray, int]:
+    """
+    Sort the messages of one sender by sequence number, dropping duplicates and the ones at or behind
+    last_seq_num. Returns the ordered messages and the new last sequence number
+    """
+    seq_nums = messages['seq_num'].astype(np.int64)
+
+    # Without a previous chunk, start just before the earliest sequence number, handling the wrap around
+    if last_seq_num is None:
+        half = (seq_wrap + 1) // 2
+        last_seq_num = int(seq_nums[0]) + int((((seq_nums - seq_nums[0] + half) & seq_wrap) - half).min()) - 1
+
+    offsets = (seq_nums - last_seq_num) & seq_wrap
+    ahead = offsets <= seq_wrap // 2
+
+    # Unique sorts the offsets and keeps the first message of every sequence number
+    offsets, index = np.unique(offsets[ahead], return_index=True)
+    ordered = messages[ahead][index]
+
+    if len(ordered):
+        last_seq_num = (last_seq_num + int(offsets[-1])) & seq_wrap
+
+    return ordered, last_seq_num
+
+def _find_restart(messages: np.ndarray, recv_times: np.ndarray, last_seq_num: int | None,
+                  last_recv_time: float | None, seq_wrap: int, restart_time: float) -> int | None:
+    """
+    Index of the first message of one sender sent after it restarted its sequence numbers, None if it didn't.
+    Same rule as the reorder queue of the consumer: behind the furthest sequence number so far by more than half the
+    window, or behind it after the sender was silent for restart_time
+    """
+    seq_nums = messages['seq_num'].astype(np.int64)
+    half = (seq_wrap + 1) // 2
+
+    # Unwrap the sequence numbers relative to the last one, or to just before the first one without it
+    reference = int(seq_nums[0]) - 1 if last_seq_num is None else last_seq_num
+    deltas = np.diff(seq_nums, prepend=reference)
+    unwrapped = reference + np.cumsum(((deltas + half) & seq_wrap) - half)
+
+    # Furthest sequence number before every message, and the silence before it
+    furthest = np.maximum.accumulate(np.concatenate(([reference], unwrapped[:-1])))
+    idle_times = np.diff(recv_times, prepend=recv_times[0] if last_recv_time is None else last_recv_time)
+
+    behind = furthest + 1 - unwrapped
+    restarts = np.flatnonzero((behind > 0) & ((behind > Window_capacity // 2) | (idle_times >= restart_time)))
+
+    return int(restarts[0]) if len(restarts) else None
+
+def reprocess(reader: CaptureReader, chunk_size: int = 1 << 16, output=None, gyro_alpha: float = 0.98,
+              restart_time: float = 0.1) -> dict:
+    """
+    Run the captured messages through the orientation filter of a RemoteSensor per sender, skipping the
+    socket and the reorder queue. Messages are taken in chunks, each sender's messages in a chunk are ordered by
+    sequence number and processed in one batch, late messages reordered across chunks are dropped.
+    A sender restarting its sequence numbers, as detected by the consumer with restart_time as its timeout, splits
+    the batch there and its ordering starts over.
+    The orientation after every message is written to output as Replay_dtype records when given.
+    Returns the remote sensors by sender id
+    """
+    remote_sensors = dict()
+    last_seq_nums = dict()
+    last_recv_times = dict()
+    seq_wrap = (1 << 32) - 1
+
+    for start in range(0, len(reader), chunk_size):
+        records = reader.records[start:start + chunk_size]
+        sender_ids = records['message']['id']
+
+        for sender_id in np.unique(sender_ids).tolist():
+            if sender_id not in remote_sensors:
+                remote_sensors[sender_id] = RemoteSensor(sender_id, 0)
+                remote_sensors[sender_id].gyro_alpha = gyro_alpha
+
+            sender_records = records[sender_ids == sender_id]
+
+            while len(sender_records):
+                messages, recv_times = sender_records['message'], sender_records['recv_time']
+                restart = _find_restart(messages, recv_times, last_seq_nums.get(sender_id),
+                                        last_recv_times.get(sender_id), seq_wrap, restart_time)
+
+                # Messages of the previous run are ordered up to the restart, the ones after it from scratch
+                if restart == 0:
+                    logger.info(f'sender {sender_id} restarted at seq {messages["seq_num"][0]}')
+                    last_seq_nums.pop(sender_id)
+                    continue
+
+                end = len(messages) if restart is None else restart
+                ordered, last_seq_nums[sender_id] = _order_messages(messages[:end], last_seq_nums.get(sender_id),
+                                                                    seq_wrap)
+                last_recv_times[sender_id] = recv_times[end - 1]
+                sender_records = sender_records[end:]
+
+                if len(ordered) == 0:
+                    continue
+
+                orientations = remote_sensors[sender_id].update_batch(ordered['payload'])
+
+                if output is not None:
+                    replay_records = np.empty(len(ordered), dtype=Replay_dtype)
+                    replay_records['sender_id'] = sender_id
+                    replay_records['seq_num'] = ordered['seq_num']
+                    replay_records['timestamp'] = ordered['payload']['gyro_timestamp']
+                    replay_records['orientation'] = quat.as_float_array(orientations)
+                    output.write(replay_records)
+
+    return remote_sensors
+
+def main():
+    parser = argparse.ArgumentParser(prog='replay.py')
+    parser.add_argument('--capture-file',
+        required=True,
+        help='set path to the capture file recorded by the consumer')
+    parser.add_argument('--mode',
+        default='send',
+        choices=['send', 'reprocess'],
+        help='re-send the messages to a consumer or reprocess them offline (default: send)')
+    parser.add_argument('--socket-path',
+        default=None,
+        help='set path to the UNIX socket of the consumer, required for send')
+    parser.add_argument('--speed',
+        default=1.0,
+        type=float,
+        help='set the replay speed relative to the capture, 0 for as fast as possible (default: 1)')
+    parser.add_argument('--start-s',
+        default=0.0,
+        type=float,
+        help='start replaying this many seconds into the capture (default: 0)')
+    parser.add_argument('--end-s',
+        default=None,
+        type=float,
+        help='stop replaying this many seconds into the capture (default: the end)')
+    parser.add_argument('--output',
+        default=None,
+        help='write the reprocessed orientations to this file as raw Replay_dtype records')
+    parser.add_argument('--chunk-size',
+        default=1 << 16,
+        type=int,
+        help='set the number of records reprocessed at once (default: 65536)')
+    parser.add_argument('--restart-ms',
+        default=100,
+        type=int,
+        help='set how long a sender going back in sequence numbers was silent to be taken as restarted, '
+             'as the consumer does with its --timeout-ms (default: 100)')
+    parser.add_argument(
+        '--log-level',
+        default='INFO',
+        choices=['debug', 'info', 'warning', 'error', 'critical'],
+        help='set logging level (default: info)')
+
+    args = parser.parse_args()
+
+    if args.mode == 'send' and args.socket_path is None:
+        parser.error('--socket-path is required for --mode send')
+
+    setup_logging(args.log_level)
+
+    reader = CaptureReader(args.capture_file)
+    output = None
+
+    try:
+        logger.info(f'{len(reader)} records from {np.count_nonzero(reader.sender_counts)} senders '
+                    f'over {reader.last_recv_time - reader.first_recv_time:.1f}s')
+
+        start_time = time.perf_counter()
+
+        if args.mode == 'send':
+            first_recv_time = reader.records['recv_time'][0] if len(reader) else 0.0
+            start = reader.find(first_recv_time + args.start_s)
+            end = reader.find(first_recv_time + args.end_s) if args.end_s is not None else None
+
+            count = replay_to_socket(reader, args.socket_path, args.speed, start, end)
+        else:
+            output = open(args.output, 'wb') if args.output is not None else None
+            remote_sensors = reprocess(reader, args.chunk_size, output, restart_time=args.restart_ms / 1e3)
+            count = len(reader)
+
+            for sender_id, remote_sensor in remote_sensors.items():
+                logger.info(f'sender {sender_id} orientation {remote_sensor.orientation}')
+
+        elapsed = time.perf_counter() - start_time
+        logger.info(f'replayed {count} messages in {elapsed:.2f}s, {count / max(elapsed, 1e-9):.0f} msgs/s')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if output is not None:
+            output.close()
+
+        reader.close()
@@ -0,0 +1,154 @@
+from typing import Tuple
+import argparse
+import logging
+import time
+import numpy as np
+from socket import socket, AF_UNIX, SOCK_DGRAM
+from os import access, unlink, F_OK
+
+from ..misc import setup_logging
+from ..transport import SensorMessage_dtype, SUBSCRIBE_RAW, UNSUBSCRIBE, Subscription_modes
+from ..transport import decode_imu_messages, decode_frame, encode_subscription, decode_orientation_messages
+
+logger = logging.getLogger(__name__)
+
+class Subscriber:
+    """
+    Subscribes to a consumer started with --subscribe-socket and receives either the raw frames or the fused
+    orientations of the selected senders.
+    The subscription is repeated every renew_interval to stay subscribed, also across consumer restarts
+    """
+    def __init__(self, broker_path: str, socket_path: str, mode: str, decimation: int = 1, sender_ids=None,
+                 renew_interval: float = 1.0):
+        self.broker_path = broker_path
+        self.socket_path = socket_path
+        self.subscription = encode_subscription(mode, decimation, sender_ids)
+        self.renew_interval = renew_interval
+        self.last_renew_time = None
+
+        self.sock = self._open_subscriber_sock()
+        self.buf = bytearray(1 << 16)
+
+    def _open_subscriber_sock(self) -> socket:
+        sock = socket(AF_UNIX, SOCK_DGRAM, 0)
+
+        # Remove if socket already exists
+        if access(self.socket_path, F_OK):
+            unlink(self.socket_path)
+            logger.debug('removed existing socket')
+
+        # The broker replies to the address the subscription came from
+        sock.bind(self.socket_path)
+        logger.info(f'socket bound at {self.socket_path}')
+
+        return sock
+
+    def _send(self, msg: bytes):
+        try:
+            self.sock.sendto(msg, self.broker_path)
+        except OSError as e:
+            logger.warning(f'broker not reachable at {self.broker_path}, {e}')
+
+    def renew(self):
+        now = time.perf_counter()
+
+        if self.last_renew_time is None or now - self.last_renew_time >= self.renew_interval:
+            self.last_renew_time = now
+            self._send(self.subscription)
+
+    def _recv(self, timeout_s: float) -> int:
+        self.renew()
+        self.sock.settimeout(timeout_s)
+
+        try:
+            return self.sock.recv_into(self.buf)
+        except TimeoutError:
+            return 0
+
+    def receive_frame(self, timeout_s: float) -> Tuple[int, int, np.ndarray] | None:
+        """
+        Wait for the next raw frame, returns the sender id, the first sequence number and the payload records,
+        which are a view into the receive buffer valid until the next call. None on timeout
+        """
+        size = self._recv(timeout_s)
+
+        if size == 0:
+            return None
+
+        if size == SensorMessage_dtype.itemsize:
+            batch = decode_imu_messages(self.buf, 1)
+            return int(batch.sender_id[0]), int(batch.seq_num[0]), batch.payload
+
+        return decode_frame(self.buf, 0, size)
+
+    def receive_orientations(self, timeout_s: float) -> np.ndarray | None:
+        """
+        Wait for the next orientations, returns a new array of OrientationMessage_dtype. None on timeout
+        """
+        size = self._recv(timeout_s)
+
+        if size == 0:
+            return None
+
+        return decode_orientation_messages(self.buf[:size])
+
+    def close(self):
+        self._send(UNSUBSCRIBE)
+        self.sock.close()
+
+        if access(self.socket_path, F_OK):
+            unlink(self.socket_path)
+
+def main():
+    parser = argparse.ArgumentParser(prog='subscriber.py')
+    parser.add_argument('--broker-socket',
+        required=True,
+        help='set path to the subscribe socket of the consumer')
+    parser.add_argument('--socket-path',
+        required=True,
+        help='set path to the UNIX socket deliveries are received on')
+    parser.add_argument('--mode',
+        default='orientation',
+        choices=Subscription_modes,
+        help='receive the raw frames or the estimated orientations (default: orientation)')
+    parser.add_argument('--sender-ids',
+        default=None,
+        type=int,
+        nargs='*',
+        help='only receive from these senders (default: all)')
+    parser.add_argument('--decimation',
+        default=1,
+        type=int,
+        help='only receive every Nth frame or orientation of each sender (default: 1)')
+    parser.add_argument(
+        '--log-level',
+        default='INFO',
+        choices=['debug', 'info', 'warning', 'error', 'critical'],
+        help='set logging level (default: info)')
+
+    args = parser.parse_args()
+
+    if args.decimation <= 0:
+        parser.error('--decimation must be positive')
+
+    setup_logging(args.log_level)
+
+    subscriber = Subscriber(args.broker_socket, args.socket_path, args.mode, args.decimation, args.sender_ids)
+
+    try:
+        while True:
+            if args.mode == SUBSCRIBE_RAW:
+                frame = subscriber.receive_frame(subscriber.renew_interval)
+
+                if frame is not None:
+                    sender_id, first_seq, imu_payloads = frame
+                    logger.info(f'frame received id:{sender_id} seq:{first_seq} count:{len(imu_payloads)}')
+            else:
+                orientations = subscriber.receive_orientations(subscriber.renew_interval)
+
+                for record in orientations if orientations is not None else ():
+                    logger.info(f'orientation id:{record["id"]} seq:{record["seq_num"]} {record["orientation"]}')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        subscriber.close()
@@ -1,2 +1,10 @@
 from .imu_payload import *
-from .sensor_message import SensorMessage
+from .imu_batch import IMUPayload_dtype, SensorMessage_dtype, IMUBatch, decode_imu_messages
+from .batch_message import BatchMessage, BatchMessage_header_size, BatchMessage_max_count, BATCH_FLAG, batch_message_size, decode_batch_message, decode_frame
+from .sensor_message import SensorMessage, SensorMessage_header_format, SensorMessage_header_size
+from .compact_message import CompactMessage, CompactMessage_dtype, CompactHeader_dtype, CompactHeader_size, CompactPayload_dtype, CompactPayload_size, CompactPayload_default_scales, CompactPayload_max_dt, COMPACT_FLAG, COMPACT_VERSION, pack_compact_header_into, pack_compact_payload, pack_compact_payload_into, encode_compact_payloads, decode_compact_payloads, compact_message_size, decode_compact_message, decode_compact_messages
+from .orientation_table import OrientationTable, OrientationSnapshot, OrientationTable_dtype, OrientationTable_slots
+from .shm_ring import ShmRing
+from .buffer_pool import ReceiveBuffer, ReceiveBufferPool
+from .capture_file import CaptureWriter, CaptureReader, Capture_dtype, Capture_header_size
+from .subscription import Subscription, Subscription_modes, SUBSCRIBE_RAW, SUBSCRIBE_ORIENTATION, UNSUBSCRIBE, OrientationMessage_dtype, encode_subscription, decode_subscription, pack_orientation_message, decode_orientation_messages
@@ -0,0 +1,124 @@
+from typing import Tuple
+import struct
+import numpy as np
+
+from .imu_batch import IMUPayload_dtype
+from .compact_message import CompactPayload_dtype, COMPACT_FLAG, COMPACT_VERSION, is_compact_flags
+from .compact_message import CompactMessage_dtype, decode_compact_payloads, decode_compact_message
+from .compact_message import CompactHeader_dtype, CompactHeader_size, CompactPayload_default_scales
+from .compact_message import pack_compact_header_into
+
+# Struct format string for un/packing the BatchMessage header
+BatchMessage_header_format = '<BIBB'
+BatchMessage_header_size = struct.calcsize(BatchMessage_header_format)
+
+# Set in the flags of every batch frame
+BATCH_FLAG = 0x80
+
+# Limited by the 8 bit count
+BatchMessage_max_count = 255
+
+class BatchMessage:
+    """
+    Class for assembling consecutive payloads of one sender into a single frame
+
+    Buffer layout:
+    +----+-----------+-------+-------+--------+-----+--------+
+    | id | first_seq | flags | count | body 0 | ... | body N |
+    +----+-----------+-------+-------+--------+-----+--------+
+    0    1           5       6       7                       7 + count * body_size
+
+    id        - identifies the sender
+    first_seq - the sequence number of the first body, the rest follow consecutively
+    flags     - BATCH_FLAG, with COMPACT_FLAG | COMPACT_VERSION for compact payloads
+    count     - the number of bodies
+    body      - the message payloads
+
+    Compact payloads are preceded by the compact header at offset 7, holding the scales and timestamp shared by
+    all of them, which is written with pack_compact_header
+    """
+    def __init__(self, body_size: int, max_count: int, compact: bool = False):
+        assert 0 < max_count <= BatchMessage_max_count
+
+        self.header_size = BatchMessage_header_size + (CompactHeader_size if compact else 0)
+        self.body_size = body_size
+        self.max_count = max_count
+        self.count = 0
+        self.flags = BATCH_FLAG | (COMPACT_FLAG | COMPACT_VERSION if compact else 0)
+
+        self.buf = bytearray(self.header_size + self.body_size * self.max_count)
+        self.view = memoryview(self.buf)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def is_full(self) -> bool:
+        return self.count == self.max_count
+
+    def next_body(self) -> memoryview:
+        """
+        Append a body packed in place, returns the writable view of its slot
+        """
+        offset = self.header_size + self.count * self.body_size
+        self.count += 1
+
+        return self.view[offset:offset + self.body_size]
+
+    def clear(self):
+        self.count = 0
+
+    def pack_compact_header(self, timestamp: int, scales: tuple = CompactPayload_default_scales):
+        """
+        Set the timestamp the compact payloads are relative to, and their scales
+        """
+        pack_compact_header_into(self.buf, BatchMessage_header_size, timestamp, scales)
+
+    def pack(self, id_: int, first_seq: int) -> memoryview:
+        """
+        Write the header and return the frame holding the bodies appended so far
+        """
+        struct.pack_into(BatchMessage_header_format, self.buf, 0, id_, first_seq, self.flags, self.count)
+        return self.view[:self.header_size + self.count * self.body_size]
+
+def batch_message_size(buffer, offset: int = 0) -> int:
+    """
+    Size of the batch frame at offset according to its header, 0 if it isn't one
+    """
+    _, _, flags, count = struct.unpack_from(BatchMessage_header_format, buffer, offset)
+
+    if not flags & BATCH_FLAG:
+        return 0
+
+    if flags & COMPACT_FLAG:
+        if not is_compact_flags(flags):
+            return 0
+
+        return BatchMessage_header_size + CompactHeader_size + count * CompactPayload_dtype.itemsize
+
+    return BatchMessage_header_size + count * IMUPayload_dtype.itemsize
+
+def decode_batch_message(buffer, offset: int = 0) -> Tuple[int, int, np.ndarray]:
+    """
+    Decode the batch frame at offset into the sender id, the first sequence number and the payload records.
+    The records are a view into the buffer, no data is copied, except for compact payloads which are decoded
+    into a new array
+    """
+    id_, first_seq, flags, count = struct.unpack_from(BatchMessage_header_format, buffer, offset)
+
+    if flags & COMPACT_FLAG:
+        header = np.frombuffer(buffer, CompactHeader_dtype, 1, offset + BatchMessage_header_size)[0]
+        compact = np.frombuffer(buffer, CompactPayload_dtype, count,
+                                offset + BatchMessage_header_size + CompactHeader_size)
+        return id_, first_seq, decode_compact_payloads(compact, header['scales'], header['timestamp'])
+
+    return id_, first_seq, np.frombuffer(buffer, IMUPayload_dtype, count, offset + BatchMessage_header_size)
+
+def decode_frame(buffer, offset: int, size: int) -> Tuple[int, int, np.ndarray]:
+    """
+    Decode a batch frame or a compact message at offset, which was already validated to be size bytes long,
+    into the sender id, the first sequence number and the payload records
+    """
+    if size == CompactMessage_dtype.itemsize:
+        return decode_compact_message(buffer, offset)
+
+    return decode_batch_message(buffer, offset)
@@ -0,0 +1,72 @@
+class ReceiveBuffer:
+    """
+    A preallocated buffer datagrams are received into.
+    Messages decoded from it with np.frombuffer are views into the bytearray. Whoever keeps such a view beyond the
+    current wakeup, e.g. queued for reordering, holds the buffer with retain and releases it once the view is no
+    longer used, the buffer is free again when nothing holds it
+    """
+    def __init__(self, size: int):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+
+        # Number of views kept by their holders
+        self.holds = 0
+
+    def __len__(self) -> int:
+        return len(self.buf)
+
+    def retain(self, count: int = 1):
+        self.holds += count
+
+    def release(self, count: int = 1):
+        assert self.holds >= count, 'released a receive buffer more often than it was retained'
+        self.holds -= count
+
+    def in_use(self) -> bool:
+        return self.holds > 0
+
+class ReceiveBufferPool:
+    """
+    Pool of receive buffers, so payloads can be queued by reference instead of being copied out of a single buffer
+    reused on every wakeup.
+    Buffers are handed out again once all holds on them were released. When more than max_count are in use the
+    pool hands out buffers it doesn't keep, which are freed normally after use
+    """
+    def __init__(self, buffer_size: int, count: int = 4, max_count: int = 64):
+        assert 0 < count <= max_count
+
+        self.buffer_size = buffer_size
+        self.max_count = max_count
+        self.free = [ReceiveBuffer(buffer_size) for _ in range(count)]
+        self.used = []
+
+        # Number of buffers handed out while the pool was exhausted
+        self.exhausted = 0
+
+    def __len__(self) -> int:
+        return len(self.free) + len(self.used)
+
+    def _reclaim(self):
+        still_used = []
+
+        for buffer in self.used:
+            (still_used if buffer.in_use() else self.free).append(buffer)
+
+        self.used = still_used
+
+    def acquire(self) -> ReceiveBuffer:
+        """
+        Returns a buffer none of the previously decoded messages are held in
+        """
+        self._reclaim()
+
+        if self.free:
+            buffer = self.free.pop()
+        elif len(self.used) < self.max_count:
+            buffer = ReceiveBuffer(self.buffer_size)
+        else:
+            self.exhausted += 1
+            return ReceiveBuffer(self.buffer_size)
+
+        self.used.append(buffer)
+        return buffer
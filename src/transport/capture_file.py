@@ -0,0 +1,141 @@
+import mmap
+import struct
+import numpy as np
+
+from .batch_message import decode_frame
+from .imu_batch import SensorMessage_dtype
+
+# Fixed size record of a captured sensor message with the time it was received at, in perf_counter seconds
+Capture_dtype = np.dtype([
+    ('recv_time', '<f8'),
+    ('message', SensorMessage_dtype),
+])
+
+Capture_magic = b'SENSCAP\0'
+Capture_version = 1
+
+# Header fields, the number of records, the time range and the number of records of every sender id are
+# filled in when the writer is closed. Records start on the first page after the header
+Capture_header_format = '<8sIIQdd256Q'
+Capture_header_size = mmap.PAGESIZE * -(-struct.calcsize(Capture_header_format) // mmap.PAGESIZE)
+
+class CaptureWriter:
+    """
+    Appends received frames to a capture file, one fixed size record per sensor message.
+    Batch frames are split into the sensor messages they carry and compact payloads are decoded, so every record
+    has the same layout.
+    The header is rewritten on close, a file cut short by a crash is still readable from its size
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'wb')
+
+        self.count = 0
+        self.first_recv_time = 0.0
+        self.last_recv_time = 0.0
+        self.sender_counts = np.zeros(256, dtype=np.uint64)
+
+        self._write_header()
+        self.file.seek(Capture_header_size)
+
+    def _write_header(self):
+        header = struct.pack(Capture_header_format, Capture_magic, Capture_version, Capture_dtype.itemsize,
+                             self.count, self.first_recv_time, self.last_recv_time, *self.sender_counts.tolist())
+
+        self.file.seek(0)
+        self.file.write(header.ljust(Capture_header_size, b'\0'))
+
+    def _split_frames(self, buffer, frame_sizes: list[int]) -> np.ndarray:
+        messages = []
+        offset = 0
+
+        for size in frame_sizes:
+            if size == SensorMessage_dtype.itemsize:
+                messages.append(np.frombuffer(buffer, SensorMessage_dtype, 1, offset))
+            else:
+                id_, first_seq, imu_payloads = decode_frame(buffer, offset, size)
+
+                batch = np.empty(len(imu_payloads), dtype=SensorMessage_dtype)
+                batch['id'] = id_
+                batch['seq_num'] = (first_seq + np.arange(len(imu_payloads), dtype=np.uint64)) & ((1 << 32) - 1)
+                batch['payload'] = imu_payloads
+                messages.append(batch)
+
+            offset += size
+
+        return np.concatenate(messages)
+
+    def write(self, buffer, frame_sizes: list[int], recv_time: float):
+        """
+        Append the frames stored back to back in buffer, all received at recv_time
+        """
+        if not frame_sizes:
+            return
+
+        # Single messages only, take them all at once
+        if frame_sizes.count(SensorMessage_dtype.itemsize) == len(frame_sizes):
+            messages = np.frombuffer(buffer, SensorMessage_dtype, len(frame_sizes))
+        else:
+            messages = self._split_frames(buffer, frame_sizes)
+
+        records = np.empty(len(messages), dtype=Capture_dtype)
+        records['recv_time'] = recv_time
+        records['message'] = messages
+        self.file.write(records)
+
+        if self.count == 0:
+            self.first_recv_time = recv_time
+
+        self.count += len(records)
+        self.last_recv_time = recv_time
+        self.sender_counts += np.bincount(messages['id'], minlength=256).astype(np.uint64)
+
+    def close(self):
+        self._write_header()
+        self.file.close()
+
+class CaptureReader:
+    """
+    Memory maps a capture file and exposes its records as a structured array of Capture_dtype without copying.
+    Records are in the order they were received, so ranges of time can be found with a binary search
+    """
+    def __init__(self, path: str):
+        self.file = open(path, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, record_size, self.header_count, self.first_recv_time, self.last_recv_time, *sender_counts = \
+            struct.unpack_from(Capture_header_format, self.mmap)
+
+        if magic != Capture_magic or version != Capture_version or record_size != Capture_dtype.itemsize:
+            self.close()
+            raise ValueError(f'{path} is not a supported capture file')
+
+        self.sender_counts = np.array(sender_counts, dtype=np.uint64)
+
+        # Trust the file size over the header, which isn't updated if the capture didn't finish
+        count = (len(self.mmap) - Capture_header_size) // Capture_dtype.itemsize
+        self.records = np.frombuffer(self.mmap, Capture_dtype, count, Capture_header_size)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def find(self, recv_time: float) -> int:
+        """
+        Index of the first record received at or after recv_time
+        """
+        return int(np.searchsorted(self.records['recv_time'], recv_time))
+
+    def get_message_buffer(self) -> memoryview:
+        """
+        The raw file, the message of record i starts at get_message_offset(i)
+        """
+        return memoryview(self.mmap)
+
+    def get_message_offset(self, index: int) -> int:
+        return Capture_header_size + index * Capture_dtype.itemsize + Capture_dtype.fields['message'][1]
+
+    def close(self):
+        # The mapping can only be closed once no views of it are left
+        self.records = None
+        self.mmap.close()
+        self.file.close()
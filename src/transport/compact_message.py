@@ -0,0 +1,227 @@
+from typing import Tuple
+import struct
+import numpy as np
+
+from .imu_batch import IMUPayload_dtype, IMUBatch
+
+# Set in the flags of every frame carrying compact payloads, the low bits hold the version of the format
+COMPACT_FLAG = 0x40
+COMPACT_VERSION = 2
+COMPACT_VERSION_MASK = 0x0F
+
+# Struct format strings for un/packing the CompactMessage header, the compact header shared by all payloads of a
+# frame and a compact payload
+CompactMessage_header_format = '<BIB'
+CompactMessage_header_size = struct.calcsize(CompactMessage_header_format)
+CompactHeader_format = '<3bI'
+CompactHeader_size = struct.calcsize(CompactHeader_format)
+CompactHeader_struct = struct.Struct(CompactHeader_format)
+CompactPayload_format = '<Hbb9h'
+CompactPayload_size = struct.calcsize(CompactPayload_format)
+CompactPayload_struct = struct.Struct(CompactPayload_format)
+
+# Binary exponents of the fixed-point steps of acc, gyro and mag, chosen per stream.
+# The defaults cover about +-128m/s^2, +-32rad/s and +-2048mGauss
+CompactPayload_default_scales = (-8, -10, -4)
+
+# Largest gyro timestamp of a payload after the timestamp of its frame, in milliseconds
+CompactPayload_max_dt = 0xFFFF
+
+# NumPy equivalent of CompactHeader_format, sent once per frame
+#   scales      - binary exponents of acc, gyro and mag, an axis value is raw * 2**exponent
+#   timestamp   - gyro timestamp of the first payload in wrapping milliseconds, like the full payload
+CompactHeader_dtype = np.dtype([
+    ('scales', 'i1', (3,)),
+    ('timestamp', '<u4'),
+])
+
+# NumPy equivalent of CompactPayload_format
+#   dt          - gyro timestamp in milliseconds after the timestamp of the frame
+#   acc_dt      - acc timestamp relative to the gyro timestamp in milliseconds
+#   mag_dt      - mag timestamp relative to the gyro timestamp in milliseconds
+CompactPayload_dtype = np.dtype([
+    ('dt', '<u2'),
+    ('acc_dt', 'i1'),
+    ('mag_dt', 'i1'),
+    ('acc', '<i2', (3,)),
+    ('gyro', '<i2', (3,)),
+    ('mag', '<i2', (3,)),
+])
+
+# NumPy equivalent of a CompactMessage
+CompactMessage_dtype = np.dtype([
+    ('id', 'u1'),
+    ('seq_num', '<u4'),
+    ('flags', 'u1'),
+    ('scales', 'i1', (3,)),
+    ('timestamp', '<u4'),
+    ('payload', CompactPayload_dtype),
+])
+
+# Sanity check
+assert CompactHeader_dtype.itemsize == CompactHeader_size == 7
+assert CompactPayload_dtype.itemsize == CompactPayload_size == 22
+assert CompactMessage_dtype.itemsize == CompactMessage_header_size + CompactHeader_size + CompactPayload_size == 35
+
+def _quantize(values, exponent: int):
+    return np.clip(np.rint(np.ldexp(values, -exponent)), -32767, 32767)
+
+def _quantize_sample(accel, gyro, mag, scales: tuple) -> list[int]:
+    acc_factor, gyro_factor, mag_factor = [2.0 ** -exponent for exponent in scales]
+
+    # A single sample is too small to gain from numpy, round rounds half to even like encode_compact_payloads
+    axes = [round(value * acc_factor) for value in np.asarray(accel, dtype=np.float64).tolist()]
+    axes += [round(value * gyro_factor) for value in np.asarray(gyro, dtype=np.float64).tolist()]
+    axes += [round(value * mag_factor) for value in np.asarray(mag, dtype=np.float64).tolist()]
+
+    if max(axes) > 32767 or min(axes) < -32767:
+        axes = [max(-32767, min(32767, axis)) for axis in axes]
+
+    return axes
+
+def pack_compact_header_into(buffer, offset: int, timestamp: int, scales: tuple = CompactPayload_default_scales):
+    """
+    Pack the compact header of a frame, timestamp is the gyro timestamp of its first payload in milliseconds
+    """
+    CompactHeader_struct.pack_into(buffer, offset, *scales, timestamp & 0xFFFFFFFF)
+
+def pack_compact_payload(accel, gyro, mag, dt: int = 0, scales: tuple = CompactPayload_default_scales,
+                         acc_dt: int = 0, mag_dt: int = 0) -> bytes:
+    """
+    Pack one sample into a compact payload, axis values out of the range of the scales saturate.
+    The sample was taken dt milliseconds after the timestamp of the frame, which holds the scales
+    """
+    return CompactPayload_struct.pack(dt, acc_dt, mag_dt, *_quantize_sample(accel, gyro, mag, scales))
+
+def pack_compact_payload_into(buffer, offset: int, accel, gyro, mag, dt: int = 0,
+                              scales: tuple = CompactPayload_default_scales, acc_dt: int = 0, mag_dt: int = 0):
+    """
+    Pack one sample into a compact payload straight into buffer at offset
+    """
+    CompactPayload_struct.pack_into(buffer, offset, dt, acc_dt, mag_dt, *_quantize_sample(accel, gyro, mag, scales))
+
+def encode_compact_payloads(imu_payloads: np.ndarray, scales: tuple = CompactPayload_default_scales) -> np.ndarray:
+    """
+    Encode payloads of IMUPayload_dtype sampled at the timestamp of their frames into an array of
+    CompactPayload_dtype
+    """
+    compact = np.zeros(imu_payloads.shape, dtype=CompactPayload_dtype)
+    compact['acc'] = _quantize(imu_payloads['acc'], scales[0])
+    compact['gyro'] = _quantize(imu_payloads['gyro'], scales[1])
+    compact['mag'] = _quantize(imu_payloads['mag'], scales[2])
+
+    return compact
+
+def decode_compact_payloads(compact: np.ndarray, scales, timestamp) -> np.ndarray:
+    """
+    Decode compact payloads into a new array of IMUPayload_dtype, with the scales and timestamp of their frames,
+    either one for all payloads or one per payload.
+    Timestamps become wrapping milliseconds, the same as publishers of the full payload send
+    """
+    imu_payloads = np.empty(compact.shape, dtype=IMUPayload_dtype)
+    scales = np.asarray(scales, dtype=np.int32)
+
+    imu_payloads['acc'] = np.ldexp(compact['acc'].astype(np.float32), scales[..., 0:1])
+    imu_payloads['gyro'] = np.ldexp(compact['gyro'].astype(np.float32), scales[..., 1:2])
+    imu_payloads['mag'] = np.ldexp(compact['mag'].astype(np.float32), scales[..., 2:3])
+
+    gyro_timestamp = np.asarray(timestamp, dtype=np.int64) + compact['dt']
+    imu_payloads['acc_timestamp'] = (gyro_timestamp + compact['acc_dt']) & 0xFFFFFFFF
+    imu_payloads['gyro_timestamp'] = gyro_timestamp & 0xFFFFFFFF
+    imu_payloads['mag_timestamp'] = (gyro_timestamp + compact['mag_dt']) & 0xFFFFFFFF
+
+    return imu_payloads
+
+def is_compact_flags(flags: int) -> bool:
+    """
+    Whether the flags mark compact payloads of a version this side understands
+    """
+    return bool(flags & COMPACT_FLAG) and flags & COMPACT_VERSION_MASK == COMPACT_VERSION
+
+class CompactMessage:
+    """
+    Class for assembling a sensor message carrying a compact payload into a fixed size buffer
+
+    Buffer layout:
+    +----+---------+-------+--------+-----------+------+
+    | id | seq_num | flags | scales | timestamp | body |
+    +----+---------+-------+--------+-----------+------+
+    0    1         5       6        9           13     13 + CompactPayload_size
+
+    id        - identifies the sender
+    seq_num   - the sequence number of current packet
+    flags     - COMPACT_FLAG | COMPACT_VERSION
+    scales    - binary exponents of acc, gyro and mag
+    timestamp - gyro timestamp of the payload in wrapping milliseconds
+    body      - the compact payload, with a dt of 0
+
+    Unlike the full SensorMessage the header has a flags byte, the two are told apart by their size
+    """
+    def __init__(self):
+        self.header_size = CompactMessage_header_size + CompactHeader_size
+        self.body_size = CompactPayload_size
+
+        self.buf = bytearray(self.header_size + self.body_size)
+        self.body = memoryview(self.buf)[self.header_size:]
+
+    def get_buffer(self) -> bytearray:
+        return self.buf
+
+    def get_body(self) -> memoryview:
+        """
+        Writable view of the body, for packing the payload in place
+        """
+        return self.body
+
+    def pack_header(self, id_: int, seq_num: int):
+        struct.pack_into(CompactMessage_header_format, self.buf, 0, id_, seq_num, COMPACT_FLAG | COMPACT_VERSION)
+
+    def pack_compact_header(self, timestamp: int, scales: tuple = CompactPayload_default_scales):
+        pack_compact_header_into(self.buf, CompactMessage_header_size, timestamp, scales)
+
+    def pack(self, id_: int, seq_num: int, body: bytes, timestamp: int,
+             scales: tuple = CompactPayload_default_scales):
+        self.pack_header(id_, seq_num)
+        self.pack_compact_header(timestamp, scales)
+        self.buf[self.header_size:] = body
+
+def compact_message_size(buffer, offset: int = 0) -> int:
+    """
+    Size of the compact message at offset according to its header, 0 if it isn't one
+    """
+    _, _, flags = struct.unpack_from(CompactMessage_header_format, buffer, offset)
+
+    # Batch frames of compact payloads set further flags
+    if not is_compact_flags(flags) or flags & ~COMPACT_VERSION_MASK != COMPACT_FLAG:
+        return 0
+
+    return CompactMessage_dtype.itemsize
+
+def decode_compact_messages(buffer, count: int = -1, offset: int = 0) -> IMUBatch:
+    """
+    Decode back to back compact messages into columnar arrays.
+    The header arrays are views into the buffer, the payloads are decoded into a new array
+    """
+    records = np.frombuffer(buffer, CompactMessage_dtype, count, offset)
+    payload = decode_compact_payloads(records['payload'], records['scales'], records['timestamp'])
+
+    return IMUBatch(
+        records['id'],
+        records['seq_num'],
+        payload,
+        payload['acc'],
+        payload['acc_timestamp'],
+        payload['gyro'],
+        payload['gyro_timestamp'],
+        payload['mag'],
+        payload['mag_timestamp'],
+    )
+
+def decode_compact_message(buffer, offset: int = 0) -> Tuple[int, int, np.ndarray]:
+    """
+    Decode the compact message at offset into the sender id, the sequence number and a single payload record
+    """
+    record = np.frombuffer(buffer, CompactMessage_dtype, 1, offset)
+
+    return int(record['id'][0]), int(record['seq_num'][0]), decode_compact_payloads(
+        record['payload'], record['scales'], record['timestamp'])
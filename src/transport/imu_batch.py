@@ -0,0 +1,58 @@
+import numpy as np
+from collections import namedtuple
+
+from .imu_payload import IMUPayload_size
+from .sensor_message import SensorMessage_header_size
+
+# NumPy equivalent of IMUPayload_format, keeps the native byte order used by struct
+IMUPayload_dtype = np.dtype([
+    ('acc', '=f4', (3,)),
+    ('acc_timestamp', '=u4'),
+    ('gyro', '=f4', (3,)),
+    ('gyro_timestamp', '=u4'),
+    ('mag', '=f4', (3,)),
+    ('mag_timestamp', '=u4'),
+])
+
+# NumPy equivalent of a SensorMessage carrying an IMUPayload
+SensorMessage_dtype = np.dtype([
+    ('id', 'u1'),
+    ('seq_num', '<u4'),
+    ('payload', IMUPayload_dtype),
+])
+
+# Sanity check
+assert IMUPayload_dtype.itemsize == IMUPayload_size
+assert SensorMessage_dtype.itemsize == SensorMessage_header_size + IMUPayload_size
+
+IMUBatch = namedtuple('IMUBatch', """
+    sender_id
+    seq_num
+    payload
+    accel
+    acc_timestamp
+    gyro
+    gyro_timestamp
+    mag
+    mag_timestamp
+""")
+
+def decode_imu_messages(buffer, count: int = -1, offset: int = 0) -> IMUBatch:
+    """
+    Decode back to back sensor messages into columnar arrays.
+    All arrays are views into the buffer, no data is copied
+    """
+    records = np.frombuffer(buffer, SensorMessage_dtype, count, offset)
+    payload = records['payload']
+
+    return IMUBatch(
+        records['id'],
+        records['seq_num'],
+        payload,
+        payload['acc'],
+        payload['acc_timestamp'],
+        payload['gyro'],
+        payload['gyro_timestamp'],
+        payload['mag'],
+        payload['mag_timestamp'],
+    )
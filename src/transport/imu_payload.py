@@ -19,12 +19,32 @@ IMUPayload = namedtuple('IMUPayload', """
 # Struct format string for un/packing the IMUPayload
 IMUPayload_format = '3fI3fI3fI'
 IMUPayload_size = struct.calcsize(IMUPayload_format)
+IMUPayload_struct = struct.Struct(IMUPayload_format)
 
 # Sanity check
 assert IMUPayload_size == 48
 
+def timestamp_ms(now: float) -> int:
+    """
+    Payload timestamp for a perf_counter time, in milliseconds wrapped to 32 bits.
+    The wrap is after about 49.7 days of host uptime, receivers take differences modulo the wrap
+    """
+    return int(now * 1000) & 0xFFFFFFFF
+
 def pack_imu_payload(imu_payload: IMUPayload) -> bytes:
     return struct.pack(IMUPayload_format, *imu_payload)
 
+def pack_imu_payload_into(buffer, offset: int, accel, gyro, mag, timestamp: int):
+    """
+    Pack the readings of one sample straight into buffer at offset, all three sharing the timestamp.
+    Readings are sequences of 3 floats or NumPy arrays
+    """
+    IMUPayload_struct.pack_into(buffer, offset, *_as_floats(accel), timestamp, *_as_floats(gyro), timestamp,
+                                *_as_floats(mag), timestamp)
+
+def _as_floats(values) -> list:
+    # Unpacking NumPy arrays element by element is several times slower than converting them at once
+    return values.tolist() if hasattr(values, 'tolist') else values
+
 def unpack_imu_payload(buffer: bytes) -> IMUPayload:
     return IMUPayload._make(struct.unpack(IMUPayload_format, buffer))
@@ -0,0 +1,125 @@
+import numpy as np
+from collections import namedtuple
+from multiprocessing.shared_memory import SharedMemory
+
+from ..misc.quaternion_loader import quat
+from .shared_memory import attach_shared_memory
+
+# Sender ids are 8 bit
+OrientationTable_slots = 256
+
+# Layout of a single slot, version is the seqlock counter and stays odd while the slot is written
+OrientationTable_dtype = np.dtype([
+    ('version', '<u8'),
+    ('orientation', '<f8', (4,)),
+    ('seq_num', '<u4'),
+    ('timestamp', '<u4'),
+])
+
+OrientationSnapshot = namedtuple('OrientationSnapshot', """
+    sender_id
+    orientation
+    seq_num
+    timestamp
+""")
+
+class OrientationTable:
+    """
+    Table of the latest orientation of every sender kept in shared memory and indexed by sender id.
+    There is a single writer, any number of processes can attach and read consistent snapshots without
+    talking to the writer. Every slot is guarded by a seqlock: the writer bumps the version to odd before
+    and back to even after updating it, readers retry when the version is odd or changed while copying.
+    This relies on stores becoming visible in program order, which holds on x86
+    """
+    def __init__(self, shm: SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.table = np.ndarray((OrientationTable_slots,), dtype=OrientationTable_dtype, buffer=shm.buf)
+
+        self.versions = self.table['version']
+        self.orientations = self.table['orientation']
+        self.seq_nums = self.table['seq_num']
+        self.timestamps = self.table['timestamp']
+
+    @classmethod
+    def create(cls, name: str | None = None) -> 'OrientationTable':
+        shm = SharedMemory(name, create=True, size=OrientationTable_slots * OrientationTable_dtype.itemsize)
+        table = cls(shm, owner=True)
+        table.table[:] = np.zeros_like(table.table)
+
+        return table
+
+    @classmethod
+    def attach(cls, name: str) -> 'OrientationTable':
+        return cls(attach_shared_memory(name), owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def write(self, sender_id: int, orientation: np.quaternion, seq_num: int, timestamp: int):
+        version = self.versions[sender_id]
+
+        self.versions[sender_id] = version + 1
+        self.orientations[sender_id] = quat.as_float_array(orientation)
+        self.seq_nums[sender_id] = seq_num
+        self.timestamps[sender_id] = timestamp
+        self.versions[sender_id] = version + 2
+
+    def read(self, sender_id: int, max_retries: int = 100) -> OrientationSnapshot | None:
+        """
+        Read a consistent snapshot of a slot, None if the sender hasn't been seen yet
+        """
+        for _ in range(max_retries):
+            version = self.versions[sender_id]
+
+            if version & 1:
+                continue
+
+            slot = self.table[sender_id].copy()
+
+            if self.versions[sender_id] == version:
+                if version == 0:
+                    return None
+
+                return OrientationSnapshot(
+                    sender_id,
+                    quat.as_quat_array(slot['orientation']),
+                    int(slot['seq_num']),
+                    int(slot['timestamp']))
+
+        raise TimeoutError(f'slot {sender_id} kept changing while being read')
+
+    def read_all(self) -> list[OrientationSnapshot]:
+        """
+        Read consistent snapshots of every sender seen so far
+        """
+        table = self.table.copy()
+
+        # Copy the whole table at once and only retry the slots that were written in the meantime
+        versions = table['version']
+        torn = (versions & 1).astype(bool) | (versions != self.versions)
+        snapshots = []
+
+        for sender_id in np.flatnonzero(versions | torn).tolist():
+            if torn[sender_id]:
+                snapshot = self.read(sender_id)
+            else:
+                slot = table[sender_id]
+                snapshot = OrientationSnapshot(
+                    sender_id,
+                    quat.as_quat_array(slot['orientation']),
+                    int(slot['seq_num']),
+                    int(slot['timestamp']))
+
+            if snapshot is not None:
+                snapshots.append(snapshot)
+
+        return snapshots
+
+    def close(self):
+        del self.table, self.versions, self.orientations, self.seq_nums, self.timestamps
+        self.shm.close()
+
+        if self.owner:
+            self.shm.unlink()
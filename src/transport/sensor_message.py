@@ -1,6 +1,10 @@
 from typing import Tuple
 import struct
 
+# Struct format string for un/packing the SensorMessage header
+SensorMessage_header_format = '<BI'
+SensorMessage_header_size = struct.calcsize(SensorMessage_header_format)
+
 class SensorMessage:
     """
     Class for easy assembly of a sensor message into a fixed size buffer
@@ -16,19 +20,37 @@ class SensorMessage:
     body    - the message payload
     """
     def __init__(self, body_size):
-        self.header_size = 5 # For sender id + sequence number
+        self.header_size = SensorMessage_header_size # For sender id + sequence number
         self.body_size = body_size
         total_size = self.header_size + self.body_size
 
         self.buf = bytearray(total_size)
+        self.body = memoryview(self.buf)[self.header_size:]
 
     def get_buffer(self) -> bytearray:
         return self.buf
 
+    def get_body(self) -> memoryview:
+        """
+        Writable view of the body, for packing the payload in place
+        """
+        return self.body
+
+    def pack_header(self, id_: int, seq_num: int):
+        struct.pack_into(SensorMessage_header_format, self.buf, 0, id_, seq_num)
+
     def pack(self, id_: int, seq_num: int, body: bytes):
-        struct.pack_into('<BI', self.buf, 0, id_, seq_num)
+        self.pack_header(id_, seq_num)
         self.buf[self.header_size:] = body
 
     def unpack(self) -> Tuple[int, int, bytes]:
-        id_, seq_num = struct.unpack_from('<BI', self.buf)
-        return id_, seq_num, bytes(self.buf[self.header_size:])
+        id_, seq_num, body = self.unpack_view()
+        return id_, seq_num, bytes(body)
+
+    def unpack_view(self) -> Tuple[int, int, memoryview]:
+        """
+        Like unpack, but the body is a view into the buffer, valid until the next pack
+        """
+        id_, seq_num = struct.unpack_from(SensorMessage_header_format, self.buf)
+        return id_, seq_num, self.body
+
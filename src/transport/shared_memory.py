@@ -0,0 +1,20 @@
+import sys
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+def attach_shared_memory(name: str) -> SharedMemory:
+    """
+    Attach to an existing block without registering it with the resource tracker,
+    which would otherwise unlink it as soon as the attaching process exits
+    """
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name, track=False)
+
+    # Older versions always register, suppress it for the duration of the call
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+
+    try:
+        return SharedMemory(name)
+    finally:
+        resource_tracker.register = register
@@ -0,0 +1,112 @@
+import os
+from multiprocessing.shared_memory import SharedMemory
+
+from .shared_memory import attach_shared_memory
+
+# Header fields as indices into the block viewed as uint64, head and tail live on separate cache lines
+_HEAD = 0       # written by the producer only
+_TAIL = 8       # written by the consumer only
+_WAITING = 16   # set by the consumer before it goes to sleep
+_SLOT_SIZE = 17
+_CAPACITY = 18
+
+ShmRing_header_size = 192
+
+class ShmRing:
+    """
+    Single producer, single consumer ring of fixed size message slots in shared memory.
+    Head and tail are free running 64 bit counters, each written by one side only, so no locks are needed.
+    The producer signals the optional eventfd only when the consumer has flagged that it's about to sleep,
+    keeping the common path free of syscalls. A wakeup can be missed when both sides race on the flag, which
+    is bounded by the timeout the consumer sleeps with.
+    This relies on stores becoming visible in program order, which holds on x86
+    """
+    def __init__(self, shm: SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.header = shm.buf[:ShmRing_header_size].cast('Q')
+        self.slot_size = self.header[_SLOT_SIZE]
+        self.capacity = self.header[_CAPACITY]
+        self.slots = shm.buf[ShmRing_header_size:ShmRing_header_size + self.slot_size * self.capacity]
+
+        # Used for waking up the consumer, the producer creates it and passes it to the consumer
+        self.eventfd = None
+
+        # Number of messages dropped because the ring was full
+        self.dropped = 0
+
+    @classmethod
+    def create(cls, slot_size: int, capacity: int = 4096, name: str | None = None) -> 'ShmRing':
+        assert capacity & (capacity - 1) == 0, 'capacity must be a power of two'
+
+        shm = SharedMemory(name, create=True, size=ShmRing_header_size + slot_size * capacity)
+        header = shm.buf[:ShmRing_header_size].cast('Q')
+        header[_SLOT_SIZE] = slot_size
+        header[_CAPACITY] = capacity
+        header.release()
+
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'ShmRing':
+        return cls(attach_shared_memory(name), owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def __len__(self) -> int:
+        return self.header[_HEAD] - self.header[_TAIL]
+
+    def write(self, buf) -> bool:
+        """
+        Copy a message into the next slot, returns False and drops the message when the ring is full
+        """
+        head = self.header[_HEAD]
+
+        if head - self.header[_TAIL] >= self.capacity:
+            self.dropped += 1
+            return False
+
+        offset = (head & (self.capacity - 1)) * self.slot_size
+        self.slots[offset:offset + self.slot_size] = buf
+
+        # Publish the slot, then wake the consumer if it's sleeping
+        self.header[_HEAD] = head + 1
+
+        if self.header[_WAITING] and self.eventfd is not None:
+            os.eventfd_write(self.eventfd, 1)
+
+        return True
+
+    def read_into(self, buf: memoryview, max_count: int) -> int:
+        """
+        Copy up to max_count messages back to back into buf and release their slots.
+        Returns the number of messages copied
+        """
+        tail = self.header[_TAIL]
+        count = min(self.header[_HEAD] - tail, max_count)
+
+        # Copy in at most two runs, the second one when wrapping around the end of the ring
+        start = tail & (self.capacity - 1)
+        first = min(count, self.capacity - start)
+        buf[:first * self.slot_size] = self.slots[start * self.slot_size:(start + first) * self.slot_size]
+        buf[first * self.slot_size:count * self.slot_size] = self.slots[:(count - first) * self.slot_size]
+
+        self.header[_TAIL] = tail + count
+
+        return count
+
+    def set_waiting(self, waiting: bool):
+        self.header[_WAITING] = int(waiting)
+
+    def close(self):
+        self.header.release()
+        self.slots.release()
+        self.shm.close()
+
+        if self.eventfd is not None:
+            os.close(self.eventfd)
+
+        if self.owner:
+            self.shm.unlink()
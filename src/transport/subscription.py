@@ -0,0 +1,66 @@
+import struct
+import numpy as np
+from collections import namedtuple
+
+# What a subscriber receives, the frames as the consumer received them or the fused orientations
+SUBSCRIBE_RAW = 'raw'
+SUBSCRIBE_ORIENTATION = 'orientation'
+Subscription_modes = (SUBSCRIBE_RAW, SUBSCRIBE_ORIENTATION)
+
+# Sent instead of a subscription to cancel it
+UNSUBSCRIBE = b'unsubscribe'
+
+Subscription = namedtuple('Subscription', """
+    mode
+    decimation
+    sender_ids
+""")
+
+# Struct format string for packing an OrientationMessage record
+OrientationMessage_format = '<BII4d'
+OrientationMessage_struct = struct.Struct(OrientationMessage_format)
+
+# NumPy equivalent of OrientationMessage_format, datagrams to orientation subscribers hold these back to back
+#   seq_num     - sequence number of the last message the orientation was estimated from
+#   timestamp   - gyro timestamp of that message in milliseconds
+#   orientation - w, x, y, z
+OrientationMessage_dtype = np.dtype([
+    ('id', 'u1'),
+    ('seq_num', '<u4'),
+    ('timestamp', '<u4'),
+    ('orientation', '<f8', (4,)),
+])
+
+# Sanity check
+assert OrientationMessage_dtype.itemsize == OrientationMessage_struct.size
+
+def encode_subscription(mode: str, decimation: int = 1, sender_ids=None) -> bytes:
+    """
+    Encode a subscription as "<mode> <decimation> [sender ids...]", no sender ids subscribes to all senders.
+    A decimation of N delivers every Nth frame or orientation of each sender
+    """
+    assert mode in Subscription_modes and decimation > 0
+
+    return ' '.join([mode, str(decimation)] + [str(sender_id) for sender_id in sender_ids or ()]).encode()
+
+def decode_subscription(msg: bytes) -> Subscription:
+    """
+    Decode a subscription, raises ValueError if it's malformed
+    """
+    mode, decimation, *sender_ids = msg.decode().split()
+    decimation = int(decimation)
+    sender_ids = frozenset(int(sender_id) for sender_id in sender_ids) or None
+
+    if mode not in Subscription_modes or decimation <= 0:
+        raise ValueError(f'invalid subscription {msg}')
+
+    return Subscription(mode, decimation, sender_ids)
+
+def pack_orientation_message(sender_id: int, seq_num: int, timestamp: int, orientation) -> bytes:
+    return OrientationMessage_struct.pack(sender_id, seq_num, timestamp, *orientation)
+
+def decode_orientation_messages(buffer) -> np.ndarray:
+    """
+    Decode a datagram of orientation records, the array is a view into the buffer
+    """
+    return np.frombuffer(buffer, OrientationMessage_dtype)
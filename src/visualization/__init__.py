@@ -1 +1 @@
-from .orientation_preview import OrientationPreview
\ No newline at end of file
+from .orientation_viewer import OrientationViewer, run_viewer, start_viewer
@@ -0,0 +1,174 @@
+import argparse
+import logging
+import os
+import numpy as np
+import pyqtgraph as pg
+from multiprocessing import Process
+from pyqtgraph.Qt import QtCore
+
+from ..misc import setup_logging
+from ..misc.quaternion_loader import quat
+from ..transport import OrientationTable
+
+logger = logging.getLogger(__name__)
+
+# Spacing between the centers of neighbouring gizmos, the axes are unit length
+Gizmo_spacing = 3.0
+
+class OrientationViewer:
+    """
+    Shows the orientations of all senders in an orientation table in one window, as a grid of coordinate gizmos
+    projected on the XY plane.
+    The table is read at the frame rate from its lock-free snapshots, the writer never waits on the viewer.
+    Each axis color is a single line item holding the segments of every gizmo, so a frame costs three setData
+    calls no matter how many senders are shown
+    """
+    def __init__(self, orientation_table: OrientationTable, title: str, time_step: float = 1.0 / 60,
+                 columns: int = 8):
+        self.orientation_table = orientation_table
+        self.dt = time_step
+        self.columns = columns
+
+        # Grid position of every sender, in the order they first showed up
+        self.positions = dict()
+        self.labels = []
+
+        self._init_visualization(title)
+
+    def _init_visualization(self, title: str):
+        # Create the application and window
+        self.app = pg.mkQApp("Orientation Visualization")
+        self.view = pg.PlotWidget(title="Orientation Preview")
+        self.view.setWindowTitle(f'Orientation Visualization {title}')
+        self.view.resize(800, 800)
+        self.view.show()
+
+        self.plot = self.view.getPlotItem()
+        self.plot.setAspectLocked(True)
+        self.plot.hideAxis('left')
+        self.plot.hideAxis('bottom')
+
+        # Create the axis lines of all gizmos, every pair of points is a separate segment
+        self.axis_lines = [pg.PlotDataItem([], [], pen=pg.mkPen(color, width=2), connect='pairs')
+                           for color in ('r', 'g', 'b')]
+
+        for axis_line in self.axis_lines:
+            self.plot.addItem(axis_line)
+
+        # Setup timer for fixed frame rate updates
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self._update_gui)
+        self.timer.start(int(self.dt * 1000)) # Convert to milliseconds
+
+    def _get_center(self, position: int) -> tuple[float, float]:
+        row, column = divmod(position, self.columns)
+        return column * Gizmo_spacing, -row * Gizmo_spacing
+
+    def _add_sender(self, sender_id: int):
+        position = len(self.positions)
+        self.positions[sender_id] = position
+
+        center_x, center_y = self._get_center(position)
+        label = pg.TextItem(str(sender_id), anchor=(0.5, 0))
+        label.setPos(center_x, center_y - 1.1)
+        self.plot.addItem(label)
+        self.labels.append(label)
+
+    def _update_gui(self):
+        # A slot can stay torn while its writer is descheduled, keep showing the last frame then
+        try:
+            snapshots = self.orientation_table.read_all()
+        except TimeoutError as e:
+            logger.debug(f'skipped frame, {e}')
+            return
+
+        if not snapshots:
+            return
+
+        for snapshot in snapshots:
+            if snapshot.sender_id not in self.positions:
+                self._add_sender(snapshot.sender_id)
+
+        positions = np.array([self.positions[snapshot.sender_id] for snapshot in snapshots])
+        orientations = np.array([snapshot.orientation for snapshot in snapshots], dtype=np.quaternion)
+
+        centers = np.empty((len(snapshots), 2))
+        centers[:, 0] = positions % self.columns * Gizmo_spacing
+        centers[:, 1] = -(positions // self.columns) * Gizmo_spacing
+
+        # Rotate the body axes by every orientation at once, shape (senders, axis, xyz)
+        rotated = quat.rotate_vectors(orientations, np.eye(3))
+        segments = np.empty((len(snapshots), 2, 2))
+        segments[:, 0] = centers
+
+        # Update the axis lines for 2D projection
+        for i, axis_line in enumerate(self.axis_lines):
+            segments[:, 1] = centers + rotated[:, i, :2]
+            axis_line.setData(segments[..., 0].ravel(), segments[..., 1].ravel())
+
+    def run(self):
+        self.app.exec()
+
+    def close(self):
+        self.timer.stop()
+        self.view.close()
+
+def run_viewer(table_name: str, title: str, time_step: float = 1.0 / 60, parent_pid: int | None = None):
+    """
+    Show the orientation table with the given name until the window is closed,
+    or until the process parent_pid, which owns the table, exits
+    """
+    orientation_table = OrientationTable.attach(table_name)
+    viewer = OrientationViewer(orientation_table, title, time_step)
+
+    # A viewer started by a consumer or publisher must not outlive it, even when it was killed
+    def check_parent():
+        if os.getppid() != parent_pid:
+            viewer.app.quit()
+
+    if parent_pid is not None:
+        parent_timer = QtCore.QTimer()
+        parent_timer.timeout.connect(check_parent)
+        parent_timer.start(500)
+
+    try:
+        viewer.run()
+    finally:
+        viewer.close()
+        orientation_table.close()
+
+def start_viewer(table_name: str, title: str, time_step: float = 1.0 / 60) -> Process:
+    """
+    Start a viewer of the orientation table in a separate process, so drawing never runs on the caller's loop
+    """
+    viewer = Process(target=run_viewer, args=(table_name, title, time_step, os.getpid()), name='viewer',
+                     daemon=True)
+    viewer.start()
+
+    logger.info(f'started orientation viewer pid:{viewer.pid}')
+
+    return viewer
+
+def main():
+    parser = argparse.ArgumentParser(prog='orientation_viewer.py')
+    parser.add_argument('--shm-table',
+        required=True,
+        help='show the orientations published to the shared memory table with this name')
+    parser.add_argument('--frequency-hz',
+        default=60,
+        type=int,
+        help='set the frame rate of the viewer (default: 60)')
+    parser.add_argument(
+        '--log-level',
+        default='INFO',
+        choices=['debug', 'info', 'warning', 'error', 'critical'],
+        help='set logging level (default: info)')
+
+    args = parser.parse_args()
+
+    setup_logging(args.log_level)
+
+    try:
+        run_viewer(args.shm_table, args.shm_table, 1.0 / args.frequency_hz)
+    except KeyboardInterrupt:
+        pass
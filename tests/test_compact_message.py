@@ -0,0 +1,39 @@
+import numpy as np
+
+from src.transport import CompactMessage, CompactPayload_size, BatchMessage, pack_compact_payload
+from src.transport import pack_compact_payload_into, batch_message_size, compact_message_size, decode_frame
+from src.transport.compact_message import decode_compact_messages
+
+def test_single_message_round_trip():
+    compact_msg = CompactMessage()
+    compact_msg.pack(3, 7, pack_compact_payload([1, 2, -9.8], [0.1, 0.2, 0.3], [300, 0, 500], acc_dt=-1, mag_dt=2),
+                     (1 << 32) - 1)
+    buffer = bytes(compact_msg.get_buffer())
+
+    assert len(buffer) == compact_message_size(buffer) == 35
+
+    batch = decode_compact_messages(buffer)
+    assert batch.sender_id[0] == 3 and batch.seq_num[0] == 7
+    assert np.allclose(batch.accel[0], [1, 2, -9.8], atol=2 ** -8)
+    assert np.allclose(batch.gyro[0], [0.1, 0.2, 0.3], atol=2 ** -10)
+    assert np.allclose(batch.mag[0], [300, 0, 500], atol=2 ** -4)
+
+    # Offsets wrap with the millisecond timestamps
+    assert batch.gyro_timestamp[0] == (1 << 32) - 1
+    assert batch.acc_timestamp[0] == (1 << 32) - 2
+    assert batch.mag_timestamp[0] == 1
+
+def test_batch_round_trip():
+    batch_msg = BatchMessage(CompactPayload_size, 4, compact=True)
+    batch_msg.pack_compact_header(1000)
+
+    for i in range(3):
+        pack_compact_payload_into(batch_msg.next_body(), 0, [0, 0, -9.8], [0, 0, i], [1, 2, 3], dt=2 * i)
+
+    frame = bytes(batch_msg.pack(5, 10))
+    assert len(frame) == batch_message_size(frame) == 7 + 7 + 3 * 22
+
+    sender_id, first_seq, imu_payloads = decode_frame(frame, 0, len(frame))
+    assert (sender_id, first_seq) == (5, 10)
+    assert imu_payloads['gyro_timestamp'].tolist() == [1000, 1002, 1004]
+    assert imu_payloads['gyro'][:, 2].tolist() == [0, 1, 2]
@@ -0,0 +1,110 @@
+import time
+from socket import socket, AF_UNIX, SOCK_DGRAM
+
+import pytest
+
+from src.consumer.consumer import Consumer
+from src.transport import SensorMessage, IMUPayload, IMUPayload_size, pack_imu_payload, pack_imu_payload_into
+from src.transport import BatchMessage, CompactMessage, CompactPayload_size, pack_compact_payload
+from src.transport import pack_compact_payload_into
+
+@pytest.fixture
+def consumer(tmp_path):
+    consumer = Consumer(str(tmp_path / 'consumer.sock'), timeout_s=0.2)
+    yield consumer
+    consumer.sock.close()
+    consumer.close()
+
+def _send(consumer: Consumer, seq_nums: list[int], sender_id: int = 1):
+    sock = socket(AF_UNIX, SOCK_DGRAM, 0)
+    sensor_msg = SensorMessage(IMUPayload_size)
+
+    for seq_num in seq_nums:
+        timestamp = 2 * seq_num
+        sensor_msg.pack(sender_id, seq_num, pack_imu_payload(IMUPayload(0, 0, -9.8, timestamp, 0, 0, 0.1, timestamp,
+                                                                        0.3, 0, 0.5, timestamp)))
+        sock.sendto(sensor_msg.get_buffer(), consumer.socket_path)
+
+    sock.close()
+
+def _run_for(consumer: Consumer, duration: float):
+    end_time = time.perf_counter() + duration
+
+    while time.perf_counter() < end_time:
+        consumer._run_once()
+
+def test_separate_gaps_are_skipped_after_silence(consumer):
+    # Two gaps received in separate wakeups, the second one shortly before the first is skipped, then nothing more
+    # from the sender. Few enough datagrams to fit the socket queue without the consumer reading
+    _send(consumer, list(range(7)) + [8])
+    consumer._run_once()
+    time.sleep(0.1)
+    _send(consumer, [10])
+    _run_for(consumer, 1.0)
+
+    message_queue = consumer.remote_sensors[1].message_queue
+    assert message_queue.count == 0
+    assert consumer.remote_sensors[1].gap_skips == 2
+    assert message_queue.seq_num == 11
+
+def test_gap_deadline_moves_earlier(consumer):
+    # The first message arrives behind a gap before any arrival statistics, so the gap waits the full timeout
+    _send(consumer, [1])
+    consumer._run_once()
+    remote_sensor = consumer.remote_sensors[1]
+    assert remote_sensor.get_gap_wait() == consumer.timeout_s
+
+    # The next message teaches the sender's rate, the gap wait shrinks well below the timeout
+    time.sleep(0.01)
+    _send(consumer, [2])
+    consumer._run_once()
+    assert remote_sensor.get_gap_wait() < consumer.timeout_s / 2
+
+    deadline = remote_sensor.get_stall_deadline()
+    end_time = time.perf_counter() + consumer.timeout_s
+
+    while remote_sensor.gap_skips == 0 and time.perf_counter() < end_time:
+        consumer._run_once()
+
+    assert remote_sensor.gap_skips == 1
+    assert time.perf_counter() < deadline + consumer.timeout_s / 4
+
+def test_mixed_frames_in_one_wakeup(consumer):
+    sock = socket(AF_UNIX, SOCK_DGRAM, 0)
+    accel, gyro, mag = [0, 0, -9.8], [0, 0, 0.1], [0.3, 0, 0.5]
+
+    # A single message, a compact message, a batch and a compact batch of sender 1, and a batch of sender 2
+    sensor_msg = SensorMessage(IMUPayload_size)
+    sensor_msg.pack(1, 0, pack_imu_payload(IMUPayload(*accel, 0, *gyro, 0, *mag, 0)))
+    sock.sendto(sensor_msg.get_buffer(), consumer.socket_path)
+
+    compact_msg = CompactMessage()
+    compact_msg.pack(1, 1, pack_compact_payload(accel, gyro, mag), 2)
+    sock.sendto(compact_msg.get_buffer(), consumer.socket_path)
+
+    for sender_id, first_seq in ((1, 2), (2, 0)):
+        batch_msg = BatchMessage(IMUPayload_size, 3)
+
+        for i in range(3):
+            pack_imu_payload_into(batch_msg.next_body(), 0, accel, gyro, mag, 2 * (first_seq + i))
+
+        sock.sendto(batch_msg.pack(sender_id, first_seq), consumer.socket_path)
+
+    compact_batch = BatchMessage(CompactPayload_size, 2, compact=True)
+    compact_batch.pack_compact_header(10)
+
+    for i in range(2):
+        pack_compact_payload_into(compact_batch.next_body(), 0, accel, gyro, mag, dt=2 * i)
+
+    sock.sendto(compact_batch.pack(1, 5), consumer.socket_path)
+    sock.close()
+
+    consumer._run_once()
+
+    # Every message was delivered in order in the same wakeup
+    sensor_1, sensor_2 = consumer.remote_sensors[1], consumer.remote_sensors[2]
+    assert sensor_1.message_queue.received == 7 and sensor_1.message_queue.seq_num == 7
+    assert sensor_2.message_queue.received == 3 and sensor_2.message_queue.seq_num == 3
+    assert sensor_1.message_queue.count == 0 and sensor_1.gap_skips == 0
+    assert sensor_1.prev_state['gyro_timestamp'] == 12
+    assert sensor_2.prev_state['gyro_timestamp'] == 4
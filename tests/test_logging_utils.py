@@ -0,0 +1,28 @@
+import subprocess
+import sys
+
+# Forks a multiprocessing child that logs right before it returns
+_child_script = '''
+import logging
+from multiprocessing import get_context
+
+from src.misc import setup_logging
+
+def child():
+    for i in range(3):
+        logging.getLogger('child').error(f'child record {i}')
+
+if __name__ == '__main__':
+    setup_logging('INFO')
+    process = get_context('fork').Process(target=child)
+    process.start()
+    process.join()
+    logging.getLogger('parent').error('parent record')
+'''
+
+def test_child_records_are_written():
+    result = subprocess.run([sys.executable, '-c', _child_script], capture_output=True, text=True, timeout=60)
+
+    assert result.returncode == 0
+    assert [f'child record {i}' in result.stderr for i in range(3)] == [True] * 3
+    assert 'parent record' in result.stderr
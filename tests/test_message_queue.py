@@ -0,0 +1,103 @@
+from src.consumer.message_queue import MessageQueue
+from src.transport import ReceiveBuffer, ReceiveBufferPool
+
+def test_receive_buffer_holds():
+    queue = MessageQueue(capacity=8)
+    pool = ReceiveBufferPool(16, count=1)
+    buffer = pool.acquire()
+
+    # Buffered in the window, the duplicate isn't held
+    queue.put_messages(0, ['a', 'b', 'c'], owner=buffer)
+    queue.put_message(1, 'b', owner=buffer)
+    assert buffer.holds == 3
+
+    # Out of the window, moved into the window again on the resync
+    queue.put_message(100, 'x', owner=buffer)
+    assert buffer.holds == 4
+
+    # Handed out again only once every message was popped
+    assert queue.pop_message() == 'a'
+    assert buffer.in_use()
+
+    while queue.pop_message(force_order=False) is not None:
+        pass
+
+    assert queue.count == 0 and not queue.overflow
+    assert not buffer.in_use()
+    assert pool.acquire() is buffer
+
+def test_overflow_eviction_releases():
+    queue = MessageQueue(capacity=2)
+    buffers = [ReceiveBuffer(16) for _ in range(3)]
+
+    for i, buffer in enumerate(buffers):
+        queue.put_message(100 + i, i, owner=buffer)
+
+    assert queue.dropped == 1
+    assert [buffer.holds for buffer in buffers] == [0, 1, 1]
+
+def _drain(queue: MessageQueue) -> list:
+    msgs = []
+
+    while (msg := queue.pop_message()) is not None:
+        msgs.append(msg)
+
+    return msgs
+
+def test_restart_after_silence():
+    queue = MessageQueue(capacity=1024, restart_time=0.5)
+    buffer = ReceiveBuffer(16)
+
+    for seq_num in range(100):
+        queue.put_message(seq_num, seq_num, 0.01 * seq_num)
+
+    # Left buffered behind a gap when the sender stopped
+    queue.put_message(101, 101, 1.0, owner=buffer)
+    assert _drain(queue) == list(range(100))
+
+    # Restarted at 0 after a silence, which is within the window behind and would be dropped as late
+    queue.put_messages(0, [0, 1, 2], 2.0)
+    queue.put_message(3, 3, 2.0)
+
+    assert _drain(queue) == [0, 1, 2, 3]
+    assert queue.restarts == 1 and queue.late == 0 and queue.dropped == 1
+    assert not buffer.in_use()
+
+def test_restart_far_behind():
+    queue = MessageQueue(capacity=8, restart_time=0.5)
+
+    for seq_num in range(40):
+        queue.put_message(seq_num, seq_num, 0.0)
+        queue.pop_message()
+
+    # Still sending at the same rate, but much further back than reordering explains
+    queue.put_message(0, 0, 0.0)
+    assert queue.pop_message() == 0
+
+    # Late messages just behind the window are still dropped
+    queue.put_message(1, 1, 0.0)
+    queue.put_message(0, 0, 0.0)
+    assert _drain(queue) == [1]
+    assert queue.restarts == 1 and queue.late == 1
+
+def test_run_across_the_wrap():
+    queue = MessageQueue(capacity=8)
+    queue.seq_num = (1 << 32) - 2
+
+    queue.put_messages((1 << 32) - 2, ['a', 'b', 'c', 'd'])
+
+    assert _drain(queue) == ['a', 'b', 'c', 'd']
+    assert queue.seq_num == 2 and queue.received == 4
+
+def test_run_partly_behind_the_window():
+    queue = MessageQueue(capacity=8)
+
+    for seq_num in range(10):
+        queue.put_message(seq_num, seq_num)
+        assert queue.pop_message() == seq_num
+
+    # The first two were already skipped over, the rest is buffered
+    queue.put_messages(8, [8, 9, 10, 11])
+
+    assert _drain(queue) == [10, 11]
+    assert queue.late == 2 and queue.restarts == 0
@@ -0,0 +1,44 @@
+import numpy as np
+
+from src.consumer.remote_sensor import RemoteSensor
+from src.misc.quaternion_loader import quat
+from src.publisher.imu_simulator import IMUSimulator
+from src.transport import IMUPayload_dtype
+
+def _make_states(count: int, seed: int = 0) -> np.ndarray:
+    np.random.seed(seed)
+    imu_simulator = IMUSimulator(time_step=0.002)
+    states = np.zeros(count, dtype=IMUPayload_dtype)
+
+    for i in range(count):
+        accel, gyro, mag = next(imu_simulator)
+        states[i] = (accel, 2 * i, gyro, 2 * i, mag, 2 * i)
+
+    return states
+
+def test_update_batch_matches_update():
+    states = _make_states(1000)
+
+    # Reference orientations from the per sample path
+    reference = RemoteSensor(1, 0.1)
+    expected = []
+
+    for state in states:
+        reference._update(state)
+        expected.append(quat.as_float_array(reference.orientation))
+
+    # Same stream in uneven chunks, including single states
+    remote_sensor = RemoteSensor(1, 0.1)
+    orientations = []
+    offset = 0
+
+    for size in [1, 1, 7, 64, 3, 200, 1, 124] * 2:
+        orientations.append(quat.as_float_array(remote_sensor.update_batch(states[offset:offset + size])))
+        offset += size
+
+    orientations.append(quat.as_float_array(remote_sensor.update_batch(states[offset:])))
+    orientations = np.concatenate(orientations)
+
+    assert len(orientations) == len(states)
+    assert np.allclose(orientations, np.array(expected), rtol=0, atol=1e-12)
+    assert np.allclose(quat.as_float_array(remote_sensor.orientation), expected[-1], rtol=0, atol=1e-12)
@@ -0,0 +1,68 @@
+import numpy as np
+
+from src.consumer.orientation_history import OrientationHistory, Timestamp_wrap
+from src.misc.quaternion_loader import quat
+
+def _yaw(angles) -> np.ndarray:
+    """
+    Orientations rotated by the angles in radians about the z axis
+    """
+    angles = np.asarray(angles, dtype=np.float64)
+    return quat.from_rotation_vector(np.stack([np.zeros_like(angles), np.zeros_like(angles), angles], axis=-1))
+
+def _angles(orientations: np.ndarray) -> np.ndarray:
+    return quat.as_rotation_vector(orientations)[..., 2]
+
+def test_interpolates_across_the_wrap():
+    history = OrientationHistory(capacity=16, slots=4)
+
+    # Samples every 10 ms, the clock wraps between the third and the fourth
+    timestamps = (Timestamp_wrap - 30 + 10 * np.arange(6)) % Timestamp_wrap
+    history.append(1, timestamps[:3], _yaw(0.1 * np.arange(3)))
+    history.append(1, timestamps[3:], _yaw(0.1 * np.arange(3, 6)))
+
+    oldest, newest = history.get_range(1)
+    assert newest - oldest == 50
+
+    # Halfway between the samples either side of the wrap, and past the newest one
+    queries = [Timestamp_wrap - 5, 5, 100]
+    assert np.allclose(_angles(history.lookup(1, queries)), [0.25, 0.35, 0.5])
+
+def test_overwritten_times_are_nan():
+    history = OrientationHistory(capacity=4, slots=4)
+    history.append(2, 10 * np.arange(10), _yaw(0.1 * np.arange(10)))
+
+    assert history.get_range(2) == (60, 90)
+
+    orientations = quat.as_float_array(history.lookup(2, [30, 59, 60, 75]))
+    assert np.isnan(orientations[:2]).all()
+    assert np.allclose(_angles(quat.as_quat_array(orientations[2:])), [0.6, 0.75])
+
+def test_backwards_clock_clears_history():
+    history = OrientationHistory(capacity=8, slots=4)
+    history.append(0, [1000, 1010, 1020], _yaw([0.1, 0.2, 0.3]))
+
+    # Restarted with a clock behind the history, only the samples from there on are kept
+    history.append(0, [1030, 500, 510], _yaw([0.4, 0.5, 0.6]))
+
+    assert len(history) == 2
+    assert history.get_range(0) == (500, 510)
+    assert np.isnan(quat.as_float_array(history.lookup(0, 495))).all()
+    assert np.allclose(_angles(history.lookup(0, [505, 1015])), [0.55, 0.6])
+
+def test_broadcast_queries():
+    history = OrientationHistory(capacity=8, slots=4)
+    history.append(1, [0, 10], _yaw([0.0, 0.2]))
+    history.append(2, [0, 10], _yaw([0.4, 0.6]))
+
+    # Every sender against every timestamp, a sender without history is NaN
+    orientations = history.lookup(np.array([[1], [2], [3]]), np.array([0, 5, 10]))
+    assert orientations.shape == (3, 3)
+    assert np.allclose(_angles(orientations[:2]), [[0.0, 0.1, 0.2], [0.4, 0.5, 0.6]])
+    assert np.isnan(quat.as_float_array(orientations[2])).all()
+
+def test_empty_append():
+    history = OrientationHistory(capacity=8, slots=4)
+    history.append(1, np.array([], dtype=np.int64), _yaw([]))
+
+    assert len(history) == 0
@@ -0,0 +1,47 @@
+import io
+
+import numpy as np
+
+from src.replay.replay import reprocess, Replay_dtype
+from src.transport import CaptureWriter, CaptureReader, SensorMessage_dtype
+
+def _write_capture(path, seq_nums: list[int], recv_times: list[float]) -> CaptureReader:
+    messages = np.zeros(len(seq_nums), dtype=SensorMessage_dtype)
+    messages['id'] = 1
+    messages['seq_num'] = seq_nums
+    messages['payload']['acc'] = [0, 0, -9.8]
+    messages['payload']['mag'] = [0.3, 0, 0.5]
+    messages['payload']['gyro_timestamp'] = 2 * np.arange(len(seq_nums))
+
+    writer = CaptureWriter(str(path))
+
+    for message, recv_time in zip(messages, recv_times):
+        writer.write(message.tobytes(), [SensorMessage_dtype.itemsize], recv_time)
+
+    writer.close()
+    return CaptureReader(str(path))
+
+def _reprocessed_seq_nums(reader: CaptureReader, chunk_size: int) -> list[int]:
+    output = io.BytesIO()
+
+    try:
+        reprocess(reader, chunk_size, output)
+    finally:
+        reader.close()
+
+    return np.frombuffer(output.getvalue(), Replay_dtype)['seq_num'].tolist()
+
+def test_restart_within_chunk(tmp_path):
+    seq_nums = [5000, 5001, 5002, *range(7), *range(7, 12)]
+    reader = _write_capture(tmp_path / 'capture', seq_nums, [0.002 * i for i in range(len(seq_nums))])
+
+    # Far behind, taken as a restart without a silence
+    assert _reprocessed_seq_nums(reader, 10) == seq_nums
+
+def test_restart_after_silence_across_chunks(tmp_path):
+    seq_nums = [100, 101, 103, 102, *range(6)]
+    recv_times = [0.0, 0.002, 0.004, 0.006, *(1.0 + 0.002 * i for i in range(6))]
+    reader = _write_capture(tmp_path / 'capture', seq_nums, recv_times)
+
+    # Reordering is resolved within the chunk, the restart is just behind but follows a silence
+    assert _reprocessed_seq_nums(reader, 4) == [100, 101, 102, 103, *range(6)]
@@ -0,0 +1,79 @@
+import time
+from socket import socket, AF_UNIX, SOCK_DGRAM
+
+import pytest
+
+from src.consumer.sharded_consumer import ShardedConsumer, Shard_backlog
+from src.transport import SensorMessage, IMUPayload, IMUPayload_size, pack_imu_payload
+
+@pytest.fixture
+def consumer(tmp_path):
+    consumer = ShardedConsumer(str(tmp_path / 'consumer.sock'), timeout_s=0.2, shards=2)
+
+    # Worker ends of the socket pairs, read by the test instead of worker processes
+    worker_socks = [consumer._open_worker_sock() for _ in range(consumer.shards)]
+
+    yield consumer, worker_socks
+
+    for sock in worker_socks + consumer.worker_socks:
+        sock.close()
+
+    consumer.sock.close()
+    consumer.close()
+
+def _route(consumer: ShardedConsumer, sender_ids: list[int]):
+    sock = socket(AF_UNIX, SOCK_DGRAM, 0)
+    sensor_msg = SensorMessage(IMUPayload_size)
+
+    # Few enough datagrams per wakeup to fit the socket queue of the consumer
+    for start in range(0, len(sender_ids), 8):
+        for seq_num, sender_id in enumerate(sender_ids[start:start + 8], start):
+            sensor_msg.pack(sender_id, seq_num, pack_imu_payload(IMUPayload(0, 0, -9.8, 0, 0, 0, 0, 0, 0.3, 0, 0.5, 0)))
+            sock.sendto(sensor_msg.get_buffer(), consumer.socket_path)
+
+        consumer._route_messages(consumer._recv_batch())
+
+    sock.close()
+
+def _recv_all(sock: socket) -> list[int]:
+    sock.setblocking(False)
+    seq_nums = []
+
+    while True:
+        try:
+            frame = sock.recv(4096)
+        except BlockingIOError:
+            return seq_nums
+
+        seq_nums.append(int.from_bytes(frame[1:5], 'little'))
+
+def test_busy_worker_doesnt_stall_the_others(consumer):
+    consumer, worker_socks = consumer
+
+    # Shard 0 never reads, far more frames than its socket holds
+    start_time = time.perf_counter()
+    _route(consumer, [0, 1] * 200)
+    assert time.perf_counter() - start_time < consumer.timeout_s
+
+    assert _recv_all(worker_socks[1]) == list(range(1, 400, 2))
+    assert consumer.dropped == 0
+
+    # The backlog is sent in order once the worker drains its socket
+    received = _recv_all(worker_socks[0])
+
+    while consumer.backlogs[consumer.worker_socks[0].fileno()]:
+        consumer._route_messages(consumer._recv_batch())
+        received += _recv_all(worker_socks[0])
+
+    assert received == list(range(0, 400, 2))
+
+def test_full_backlog_drops_oldest(consumer):
+    consumer, worker_socks = consumer
+
+    _route(consumer, [0] * (4 * Shard_backlog))
+    received = _recv_all(worker_socks[0])
+    backlog = consumer.backlogs[consumer.worker_socks[0].fileno()]
+
+    assert consumer.dropped == 4 * Shard_backlog - len(received) - len(backlog)
+    assert consumer.dropped > 0
+    assert int.from_bytes(backlog[-1][1:5], 'little') == 4 * Shard_backlog - 1
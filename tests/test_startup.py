@@ -0,0 +1,12 @@
+import pytest
+
+from src.benchmark.startup import STARTUP_MODULES, DEFERRED_MODULES, _measure_import
+
+@pytest.mark.parametrize('module', STARTUP_MODULES.values())
+def test_entry_point_defers_optional_modules(module):
+    import_time, modules = _measure_import(module)
+
+    assert [deferred for deferred in DEFERRED_MODULES if deferred in modules] == []
+
+    # Far above the benchmark budget, only catches an import pulling in something heavy
+    assert import_time < 2.0